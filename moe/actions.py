@@ -148,16 +148,21 @@ class EquivalenceCheck(Action):
         ('Checking for an Equivalence between internal revision %s and '
          'public revision %s') % (self.internal_revision, self.public_revision))
     with task:
-      internal = internal_codebase_creator.Create(self.internal_revision)
-      generated = translators.TranslateToProjectSpace(
-          internal, base.PUBLIC_STR,
-          self.translators)
-      public = public_codebase_creator.Create(self.public_revision)
+      def CreateGenerated():
+        internal = internal_codebase_creator.Create(self.internal_revision)
+        return translators.TranslateToProjectSpace(
+            internal, base.PUBLIC_STR,
+            self.translators)
+      # The two repositories are independent, so export them concurrently.
+      generated, public = moe_app.RunConcurrently([
+          CreateGenerated,
+          lambda: public_codebase_creator.Create(self.public_revision)])
       codebases_differ = None
       if not self.project.manual_equivalence_deltas:
         codebases_differ = base.AreCodebasesDifferent(
             generated, public,
-            noisy_files_re=self.project.noisy_files_re)
+            noisy_files_re=self.project.noisy_files_re,
+            any_difference=True)
 
       return self.result_dispatch(self,
                                   codebases_differ=codebases_differ,
@@ -367,7 +372,8 @@ class Migration(Action):
         return StateUpdate(actions=[action] + actions)
 
       should_migrate = bool(base.AreCodebasesDifferent(
-          previous_source, source, noisy_files_re=self.project.noisy_files_re))
+          previous_source, source, noisy_files_re=self.project.noisy_files_re,
+          any_difference=True))
       if not should_migrate:
         return result
 
@@ -7,14 +7,24 @@ __author__ = 'dbentley@google.com (Dan Bentley)'
 
 
 import codecs
+import collections
+import contextlib
+import difflib
 import errno
+import fcntl
+import hashlib
+import json as simplejson
+from multiprocessing import pool
 import os
 import re
+import shutil
 import stat
 import subprocess
 import sys
 import tarfile
 import tempfile
+import threading
+import time
 
 import pytz
 
@@ -22,6 +32,8 @@ from google.apputils import datelib
 import gflags as flags
 import logging
 
+from moe import compat
+
 FLAGS = flags.FLAGS
 
 flags.DEFINE_string('project', '', 'Name of the MOE project')
@@ -38,6 +50,9 @@ flags.DEFINE_boolean('debug_dry_run', False,
                      'the DB or any VCS. NOTE: this is only for debugging; do '
                      'not use if you just want to avoid automatically pushing '
                      'to your external repo')
+flags.DEFINE_boolean('walk_untracked_files', False,
+                     'Whether walking a VCS client also lists files its VCS '
+                     "doesn't track (but doesn't ignore either)")
 
 
 # Commit strategy enumeration
@@ -211,6 +226,37 @@ def MakeDir(path):
       raise
 
 
+_TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2')
+
+
+def _IsExpandable(codebase):
+  """Whether codebase names an archive PossiblyExpandCodebase can expand."""
+  return codebase.endswith(_TAR_SUFFIXES + ('.zip',))
+
+
+def _ExpandArchive(codebase, temp_dir):
+  """Expand the archive codebase into the existing directory temp_dir.
+
+  Raises:
+    Error: if the archive could not be expanded.
+  """
+  if codebase.endswith(_TAR_SUFFIXES):
+    codebase_tar = tarfile.open(codebase)
+    codebase_tar.errorlevel = 2
+    members = codebase_tar.getmembers()
+    for m in members:
+      codebase_tar.extract(m, path=temp_dir)
+      # make sure file is writeable
+      os.chmod(os.path.join(temp_dir, m.name), m.mode | stat.S_IWUSR)
+    codebase_tar.close()
+  else:
+    print 'Unzipping %s into %s' % (codebase, temp_dir)
+    p = subprocess.Popen(['unzip', '-qq', codebase, '-d', temp_dir])
+    p.wait()
+    if p.returncode:
+      raise Error('Codebase %s could not be unzipped' % codebase)
+
+
 def PossiblyExpandCodebase(codebase, base_temp_dir, cache=None):
   """Turn possibly-compressed codebase into a directory.
 
@@ -229,47 +275,325 @@ def PossiblyExpandCodebase(codebase, base_temp_dir, cache=None):
     cache = {}
   if os.path.isdir(codebase):
     return os.path.abspath(codebase)
-  if codebase.endswith('.tar'):
-    if codebase in cache:
-      return cache[codebase]
-    if not base_temp_dir:
-      raise Error('No temp_dir specified, but needed')
-    temp_dir = tempfile.mkdtemp(dir=base_temp_dir, prefix='codebase_')
-    # expand tar into temporary directory, return that.
-    codebase_tar = tarfile.TarFile(codebase)
-    codebase_tar.errorlevel = 2
-    members = codebase_tar.getmembers()
-    for m in members:
-      codebase_tar.extract(m, path=temp_dir)
-      # make sure file is writeable
-      os.chmod(os.path.join(temp_dir, m.name), m.mode | stat.S_IWUSR)
-    codebase_tar.close()
-    cache[codebase] = os.path.abspath(temp_dir)
+  if not _IsExpandable(codebase):
+    raise Error(
+        'Codebase %s is not a directory, .tar, .tar.gz, .tar.bz2, or .zip'
+        % codebase)
+  if codebase in cache:
     return cache[codebase]
+  if not base_temp_dir:
+    raise Error('No temp_dir specified, but needed')
   if codebase.endswith('.zip'):
-    if codebase in cache:
-      return cache[codebase]
-    if not base_temp_dir:
-      raise Error('No temp_dir specified, but needed')
-    temp_dir = tempfile.mkdtemp(
-        dir=base_temp_dir,
-        prefix=os.path.splitext(os.path.basename(codebase))[0]+'.')
-    print 'Unzipping %s into %s' % (codebase, temp_dir)
-    p = subprocess.Popen(['unzip', '-qq', codebase, '-d', temp_dir])
-    p.wait()
-    if p.returncode:
-      raise Error('Codebase %s could not be unzipped' % codebase)
-    cache[codebase] = os.path.abspath(temp_dir)
-    return cache[codebase]
-  # TODO(dbentley): it's also easy to add support for gz and bz2, but
-  # these have not been needed yet.
-  raise Error('Codebase %s is not a directory, .tar, or .zip' %
-              codebase)
+    prefix = os.path.splitext(os.path.basename(codebase))[0] + '.'
+  else:
+    prefix = 'codebase_'
+  temp_dir = tempfile.mkdtemp(dir=base_temp_dir, prefix=prefix)
+  # expand archive into temporary directory, return that.
+  _ExpandArchive(codebase, temp_dir)
+  cache[codebase] = os.path.abspath(temp_dir)
+  return cache[codebase]
+
+
+class ExpansionCache(object):
+  """An on-disk cache of expanded archives, shared between MOE runs.
+
+  Expansions are keyed by the SHA-1 of the archive's contents, so the same
+  export is only expanded once however many times (and under whatever name)
+  it is compared. Each expansion lives in cache_dir/<digest>, next to a
+  cache_dir/<digest>.json sidecar recording its size; the sidecar's mtime is
+  when the expansion was last used. Expansions are shared, and must be treated
+  as read-only.
+
+  An archive's digest is noted in cache_dir/.archives, keyed on its path, and
+  reused without reading the archive again while its size and mtime are
+  unchanged.
+
+  Expansions are made in a scratch directory and renamed into place, so
+  concurrent runs never see a partial expansion. The least recently used
+  expansions are removed once the cache grows past max_bytes, except those in
+  use: an ExpansionCache holds a shared lock on cache_dir/<digest>.lock for
+  each expansion it returns, until it's closed (or its process exits), and
+  an expansion is only removed under an exclusive one.
+  """
+
+  _SIDECAR_SUFFIX = '.json'
+  _LOCK_SUFFIX = '.lock'
+  _SCRATCH_PREFIX = '.expanding_'
+  _ARCHIVES_DIR = '.archives'
+  # Scratch directories older than this were left by runs that died.
+  _SCRATCH_MAX_AGE = 24 * 60 * 60
+
+  def __init__(self, cache_dir, max_bytes):
+    """Constructs.
+
+    Args:
+      cache_dir: str, the directory to keep expansions in
+      max_bytes: int, how large the expansions may grow in total
+    """
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    # {digest: file}, the locks held on the expansions returned so far.
+    self._in_use = {}
+    self._in_use_lock = threading.Lock()
+
+  def _Sidecar(self, digest):
+    return os.path.join(self.cache_dir, digest + self._SIDECAR_SUFFIX)
+
+  def _OpenLock(self, digest, operation):
+    return LockFile(
+        os.path.join(self.cache_dir, digest + self._LOCK_SUFFIX), operation)
+
+  def _Use(self, digest):
+    """Hold a shared lock on digest's expansion, until Close."""
+    with self._in_use_lock:
+      if digest not in self._in_use:
+        self._in_use[digest] = self._OpenLock(digest, fcntl.LOCK_SH)
+
+  def Close(self):
+    """Release the expansions returned so far, for other runs to remove."""
+    with self._in_use_lock:
+      for lock in self._in_use.itervalues():
+        lock.close()
+      self._in_use.clear()
+
+  def _Digest(self, archive):
+    """The SHA-1 of archive's contents, only reading it if it has changed.
+
+    Args:
+      archive: str, the absolute path of the archive
+
+    Returns:
+      str, the digest
+    """
+    st = os.stat(archive)
+    record = os.path.join(self.cache_dir, self._ARCHIVES_DIR,
+                          hashlib.sha1(archive).hexdigest() +
+                          self._SIDECAR_SUFFIX)
+    try:
+      with open(record) as f:
+        noted = simplejson.load(f)
+      if (noted['size'], noted['mtime']) == (st.st_size, st.st_mtime):
+        return str(noted['digest'])
+    except (IOError, ValueError, KeyError):
+      pass
+
+    digest = HashFile(archive)
+    MakeDir(os.path.dirname(record))
+    temp_record = record + '.tmp.%d' % os.getpid()
+    with open(temp_record, 'w') as f:
+      simplejson.dump({'archive': archive, 'size': st.st_size,
+                       'mtime': st.st_mtime, 'digest': digest}, f)
+    os.rename(temp_record, record)
+    return digest
+
+  def Expand(self, archive):
+    """Return the path of an expansion of archive, expanding it if necessary.
+
+    Args:
+      archive: str, path to a .tar, .tar.gz, .tar.bz2 or .zip file
+
+    Returns:
+      str, the absolute path of the (shared, read-only) expansion
+
+    Raises:
+      Error: if the archive could not be expanded.
+    """
+    archive = os.path.abspath(archive)
+    digest = self._Digest(archive)
+    expanded = os.path.abspath(os.path.join(self.cache_dir, digest))
+    sidecar = self._Sidecar(digest)
+    MakeDir(self.cache_dir)
+    # Locked before looking, so it can't be removed once found.
+    self._Use(digest)
+    if os.path.isfile(sidecar) and os.path.isdir(expanded):
+      os.utime(sidecar, None)
+      return expanded
+
+    scratch_dir = tempfile.mkdtemp(dir=self.cache_dir,
+                                   prefix=self._SCRATCH_PREFIX)
+    try:
+      _ExpandArchive(archive, scratch_dir)
+      try:
+        os.rename(scratch_dir, expanded)
+      except OSError, e:
+        # Another run may have expanded the same archive first; use theirs.
+        if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+          raise
+    finally:
+      # Only still there if we failed, or lost the race.
+      shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    size = sum(s.st_size for _, s in ListFilesWithStats(expanded, None))
+    temp_sidecar = sidecar + '.tmp.%d' % os.getpid()
+    with open(temp_sidecar, 'w') as f:
+      simplejson.dump({'size': size, 'archive': archive}, f)
+    os.rename(temp_sidecar, sidecar)
+    self.GarbageCollect()
+    return expanded
+
+  def Entries(self):
+    """The cached expansions.
+
+    Returns:
+      list of (digest, size in bytes, last use as seconds since the epoch),
+      least recently used first.
+    """
+    entries = []
+    if not os.path.isdir(self.cache_dir):
+      return entries
+    for name in os.listdir(self.cache_dir):
+      if not name.endswith(self._SIDECAR_SUFFIX):
+        continue
+      digest = name[:-len(self._SIDECAR_SUFFIX)]
+      sidecar = self._Sidecar(digest)
+      try:
+        with open(sidecar) as f:
+          size = simplejson.load(f)['size']
+        last_used = os.path.getmtime(sidecar)
+      except (IOError, OSError, ValueError, KeyError):
+        # Removed or being replaced by a concurrent run.
+        continue
+      entries.append((digest, size, last_used))
+    entries.sort(key=lambda entry: entry[2])
+    return entries
+
+  def GarbageCollect(self, max_bytes=None):
+    """Remove least recently used expansions until within the byte budget.
+
+    Expansions in use, by this or any other ExpansionCache, are kept.
+
+    Args:
+      max_bytes: int, the budget; self.max_bytes if None
+
+    Returns:
+      (number of expansions removed, number of bytes freed)
+    """
+    if max_bytes is None:
+      max_bytes = self.max_bytes
+    if not os.path.isdir(self.cache_dir):
+      return 0, 0
+    entries = self.Entries()
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    freed = 0
+    for digest, size, _ in entries:
+      if total <= max_bytes:
+        break
+      if digest in self._in_use:
+        continue
+      lock = self._OpenLock(digest, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      if not lock:
+        continue
+      try:
+        try:
+          os.remove(self._Sidecar(digest))
+        except OSError:
+          continue
+        shutil.rmtree(os.path.join(self.cache_dir, digest), ignore_errors=True)
+        os.remove(lock.name)
+      finally:
+        lock.close()
+      total -= size
+      removed += 1
+      freed += size
+
+    now = time.time()
+    for name in os.listdir(self.cache_dir):
+      path = os.path.join(self.cache_dir, name)
+      if (name.startswith(self._SCRATCH_PREFIX) and
+          now - os.path.getmtime(path) > self._SCRATCH_MAX_AGE):
+        shutil.rmtree(path, ignore_errors=True)
+      elif name.endswith(self._LOCK_SUFFIX):
+        # Left by an expansion that failed, unless it's being retried.
+        digest = name[:-len(self._LOCK_SUFFIX)]
+        if (digest in self._in_use or
+            os.path.exists(self._Sidecar(digest))):
+          continue
+        lock = self._OpenLock(digest, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if lock:
+          if not os.path.exists(self._Sidecar(digest)):
+            os.remove(path)
+          lock.close()
+    # Digests noted for archives (e.g. temporary ones) that haven't been seen
+    # for as long are forgotten too.
+    archives_dir = os.path.join(self.cache_dir, self._ARCHIVES_DIR)
+    if os.path.isdir(archives_dir):
+      for name in os.listdir(archives_dir):
+        path = os.path.join(archives_dir, name)
+        try:
+          if now - os.path.getmtime(path) > self._SCRATCH_MAX_AGE:
+            os.remove(path)
+        except OSError:
+          continue
+    return removed, freed
+
+
+def LockFile(path, operation):
+  """flock path, creating it if need be.
+
+  If path is removed (with its lock held) and made again while waiting, the
+  new file is locked instead, so holding the returned lock means holding
+  path's.
+
+  Args:
+    path: str, the lock file
+    operation: int, the fcntl.flock operation
+
+  Returns:
+    file, the open lock file, or None if operation was non-blocking and the
+    lock is held elsewhere
+  """
+  while True:
+    lock = open(path, 'a')
+    try:
+      fcntl.flock(lock, operation)
+    except IOError, e:
+      lock.close()
+      if e.errno in (errno.EAGAIN, errno.EACCES):
+        return None
+      raise
+    try:
+      if os.fstat(lock.fileno()).st_ino == os.stat(path).st_ino:
+        return lock
+    except OSError:
+      pass
+    lock.close()
+
+
+@contextlib.contextmanager
+def ListFile(items, separator='\n'):
+  """A temporary file listing items, for commands that read a list from one.
+
+  E.g. svn's --targets, or hg's listfile0: pattern.
+
+  Args:
+    items: seq of str
+    separator: str, what to end each item with
+
+  Yields:
+    str, the path of the file, which is removed afterwards
+  """
+  fd, filename = tempfile.mkstemp(prefix='moe_list_')
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      f.write(''.join(item + separator for item in items))
+    yield filename
+  finally:
+    os.remove(filename)
+
+
+def IsExecutableMode(mode):
+  """Determine whether a file with st_mode mode is executable.
+
+  Only the owner's bit counts, as it's the one git and svn keep.
+  """
+  return bool(mode & stat.S_IXUSR)
 
 
 def IsExecutable(path):
   """Determine whether path is executable."""
-  return os.access(path, os.X_OK)
+  st = _StatOrNone(path)
+  return bool(st) and IsExecutableMode(st.st_mode)
 
 
 def SetExecutable(path):
@@ -284,6 +608,12 @@ def SetExecutable(path):
   os.chmod(path,mode)
 
 
+def SetNotExecutable(path):
+  """Make path (an absolute path) not executable."""
+  os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) &
+           ~(stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH))
+
+
 def FindBinaryOnPath(binary_name, path):
   """Find a binary on a path, a la which(1).
 
@@ -440,6 +770,63 @@ class CodebaseClient(object):
     raise NotImplementedError
 
 
+class ClientFiles(object):
+  """The files in a VCS client, as its VCS lists them.
+
+  The VCS is asked once, when the files are first needed. After that, the
+  editor that owns this tells it which files it adds and removes.
+  """
+
+  def __init__(self, root, list_fn, hidden_re=None):
+    """Construct.
+
+    Args:
+      root: str, the client's directory
+      list_fn: function(bool) -> seq of str, the relative filenames the VCS
+               knows of in root (including untracked ones, if passed True)
+      hidden_re: re, files matching this aren't listed
+    """
+    self._root = root
+    self._list_fn = list_fn
+    self._hidden_re = hidden_re
+    self._files = None
+
+  def Files(self):
+    """Return the relative filenames of the existent files, sorted."""
+    if self._files is None:
+      self._files = set(
+          f for f in map(EncodeFilename,
+                         self._list_fn(FLAGS.walk_untracked_files))
+          if not (self._hidden_re and self._hidden_re.search(f)) and
+          os.path.lexists(os.path.join(self._root, f)) and
+          not os.path.isdir(os.path.join(self._root, f)))
+    return sorted(self._files)
+
+  def Add(self, relative_filename):
+    if self._files is not None:
+      self._files.add(relative_filename)
+
+  def Remove(self, relative_filename):
+    if self._files is not None:
+      self._files.discard(relative_filename)
+
+
+def EncodeFilename(filename):
+  """Return filename as the UTF-8 bytes paths are kept in, if it's unicode.
+
+  RunCmd decodes output, but filenames elsewhere (e.g. from ListFiles) are
+  byte strings, and the two must compare equal.
+  """
+  if isinstance(filename, unicode):
+    return filename.encode('utf-8')
+  return filename
+
+
+def SplitNulTerminated(output):
+  """Split the output of a command that ends each item with a NUL."""
+  return [item for item in output.split('\0') if item]
+
+
 class CodebaseEditor(object):
   """Allows editing (i.e. both reading and writing) of a codebase.
 
@@ -590,6 +977,12 @@ class SourceControlRepository(object):
     """
     raise NotImplementedError
 
+  def Close(self):
+    """Release what the repository keeps open (e.g. processes) between uses.
+
+    Called when a run is done with the repository.
+    """
+
 
 MOE_MIGRATION_RE = re.compile(r'MOE_MIGRATION=(\w+)')
 
@@ -732,10 +1125,90 @@ class FileDifference(object):
     return '%s: %s' % (self.relative_filename, self.reason or '[Unknown]')
 
 
+# How much of a file to read at a time when comparing or hashing it.
+_READ_CHUNK_SIZE = 64 * 1024
+
+# How many lines of a full diff to record.
+_MAX_DIFF_LINES = 10
+
+
+def _StatOrNone(path):
+  try:
+    return os.stat(path)
+  except os.error:
+    return None
+
+
+def _AreContentsEqual(file1, file2):
+  """Whether file1 and file2, which are the same size, have the same bytes."""
+  with open(file1, 'rb') as f1:
+    with open(file2, 'rb') as f2:
+      while True:
+        chunk1 = f1.read(_READ_CHUNK_SIZE)
+        chunk2 = f2.read(_READ_CHUNK_SIZE)
+        if chunk1 != chunk2:
+          return False
+        if not chunk1:
+          return True
+
+
+def HashFile(path):
+  """Return the hex SHA-1 digest of the contents of path."""
+  digest = hashlib.sha1()
+  with open(path, 'rb') as f:
+    while True:
+      chunk = f.read(_READ_CHUNK_SIZE)
+      if not chunk:
+        return digest.hexdigest()
+      digest.update(chunk)
+
+
+def _NormalDiffRange(start, end):
+  """Format the 0-based line range [start, end) as diff(1) does."""
+  if end - start == 1:
+    return str(end)
+  if start == end:
+    return str(start)
+  return '%d,%d' % (start + 1, end)
+
+
+def _NormalDiffLines(file1, file2):
+  """Generate the lines diff(1) would print to describe file1 -> file2."""
+  contents1 = open(file1, 'rb').read()
+  contents2 = open(file2, 'rb').read()
+  if '\0' in contents1 or '\0' in contents2:
+    yield 'Binary files %s and %s differ' % (file1, file2)
+    return
+
+  def Lines(prefix, lines):
+    for line in lines:
+      yield prefix + line.rstrip('\n')
+      if not line.endswith('\n'):
+        yield '\\ No newline at end of file'
+
+  lines1 = contents1.splitlines(True)
+  lines2 = contents2.splitlines(True)
+  matcher = difflib.SequenceMatcher(None, lines1, lines2, autojunk=False)
+  for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+    if tag == 'equal':
+      continue
+    command = {'replace': 'c', 'delete': 'd', 'insert': 'a'}[tag]
+    yield '%s%s%s' % (_NormalDiffRange(i1, i2), command,
+                      _NormalDiffRange(j1, j2))
+    for line in Lines('< ', lines1[i1:i2]):
+      yield line
+    if tag == 'replace':
+      yield '---'
+    for line in Lines('> ', lines2[j1:j2]):
+      yield line
+
+
 def AreFilesDifferent(file1, file2, relative_filename='',
                       record_full_diffs=False):
   """Diff file1 and file2.
 
+  Files are compared in-process: by size, then byte for byte.
+
   Args:
     file1: str, path to file1
     file2: str, path to file2
@@ -746,10 +1219,12 @@ def AreFilesDifferent(file1, file2, relative_filename='',
     FileDifference (or None, if not different)
   """
   difference = FileDifference(relative_filename)
+  stat1 = _StatOrNone(file1)
+  stat2 = _StatOrNone(file2)
   # We want to generate diffs even if one file doesn't exist.
-  if not os.path.exists(file1):
+  if not stat1:
     difference.file1_missing = True
-  if not os.path.exists(file2):
+  if not stat2:
     difference.file2_missing = True
   if difference.file1_missing or difference.file2_missing:
     if difference.file1_missing and difference.file2_missing:
@@ -758,30 +1233,26 @@ def AreFilesDifferent(file1, file2, relative_filename='',
     # one exists, the other does not, therefore they differ
     difference.reason = 'File missing from one codebase'
     return difference
-  if IsExecutable(file1) != IsExecutable(file2):
+  if IsExecutableMode(stat1.st_mode) != IsExecutableMode(stat2.st_mode):
     difference.reason = 'Executable bit differs'
     return difference
 
-  p = None
-  dev_null = open('/dev/null', 'w')
-  diff_reason = 'File contents differ'
-  if record_full_diffs:
-    p = subprocess.Popen(['diff', file1, file2],
-                         stdout=subprocess.PIPE, stderr=dev_null)
-    stdoutlines = p.communicate()[0].splitlines()
-    diff_reason += ':\n%s' % '\n'.join(stdoutlines[:10])
-    if len(stdoutlines) > 10:
-      diff_reason += '\n...Truncated...'
-  else:
-    p = subprocess.Popen(['diff', '-q', file1, file2],
-                         stdout=dev_null, stderr=dev_null)
-    p.wait()
-
-  if p.returncode:
-    difference.reason = diff_reason
-    return difference
+  if os.path.samestat(stat1, stat2):
+    return None
+  if (stat1.st_size == stat2.st_size and
+      _AreContentsEqual(file1, file2)):
+    return None
 
-  return None
+  difference.reason = 'File contents differ'
+  if record_full_diffs:
+    diff_lines = []
+    for line in _NormalDiffLines(file1, file2):
+      if len(diff_lines) == _MAX_DIFF_LINES:
+        diff_lines.append('...Truncated...')
+        break
+      diff_lines.append(line)
+    difference.reason += ':\n%s' % '\n'.join(diff_lines)
+  return difference
 
 
 class CodebaseDifference(object):
@@ -824,8 +1295,92 @@ class CodebaseDifference(object):
     self.differences.append(file_difference)
 
 
+def _AreManifestEntriesDifferent(entry1, entry2, file1, file2,
+                                 relative_filename, record_full_diffs):
+  """Like AreFilesDifferent, but using the files' codebase manifest entries.
+
+  Args:
+    entry1: codebase_utils.ManifestEntry, the entry of file1
+    entry2: codebase_utils.ManifestEntry, the entry of file2
+    file1: str, path to file1
+    file2: str, path to file2
+    relative_filename: str, the relative filename
+    record_full_diffs: bool, whether to record full diff output
+
+  Returns:
+    FileDifference (or None, if not different)
+  """
+  if IsExecutableMode(entry1.mode) != IsExecutableMode(entry2.mode):
+    difference = FileDifference(relative_filename)
+    difference.reason = 'Executable bit differs'
+    return difference
+  if entry1.digest == entry2.digest:
+    return None
+  if record_full_diffs:
+    return AreFilesDifferent(file1, file2, relative_filename, record_full_diffs)
+  difference = FileDifference(relative_filename)
+  difference.reason = 'File contents differ'
+  return difference
+
+
+def _FirstDifference(codebase1, codebase2, relative_files1, relative_files2,
+                     record_full_diffs):
+  """Find some difference between two codebases, checking cheapest first.
+
+  Args:
+    codebase1: codebase_utils.Codebase
+    codebase2: codebase_utils.Codebase
+    relative_files1: set of str, the files to consider in codebase1
+    relative_files2: set of str, the files to consider in codebase2
+    record_full_diffs: bool, whether to record full diff output
+
+  Returns:
+    FileDifference, or None if no difference
+  """
+  # Files in only one codebase.
+  for relative_filename in relative_files1.symmetric_difference(
+      relative_files2):
+    file_difference = AreFilesDifferent(
+        codebase1.FilePath(relative_filename),
+        codebase2.FilePath(relative_filename),
+        relative_filename, record_full_diffs)
+    if file_difference:
+      return file_difference
+
+  paths = [(relative_filename,
+            codebase1.FilePath(relative_filename),
+            codebase2.FilePath(relative_filename))
+           for relative_filename in relative_files1]
+
+  # Sizes.
+  for relative_filename, path1, path2 in paths:
+    stat1 = _StatOrNone(path1)
+    stat2 = _StatOrNone(path2)
+    if not stat1 or not stat2 or stat1.st_size != stat2.st_size:
+      file_difference = AreFilesDifferent(path1, path2, relative_filename,
+                                          record_full_diffs)
+      if file_difference:
+        return file_difference
+
+  # Executable bits.
+  for relative_filename, path1, path2 in paths:
+    if IsExecutable(path1) != IsExecutable(path2):
+      return AreFilesDifferent(path1, path2, relative_filename,
+                               record_full_diffs)
+
+  # Contents.
+  for relative_filename, path1, path2 in paths:
+    file_difference = AreFilesDifferent(path1, path2, relative_filename,
+                                        record_full_diffs)
+    if file_difference:
+      return file_difference
+
+  return None
+
+
 def AreCodebasesDifferent(codebase1, codebase2, noisy_files_re=None,
-                          record_full_diffs=False):
+                          record_full_diffs=False, any_difference=False,
+                          jobs=1):
   """Determines whether two Codebases are different, and how.
 
   NB(dbentley): this takes Codebase objects, and replaces an older method
@@ -838,6 +1393,15 @@ def AreCodebasesDifferent(codebase1, codebase2, noisy_files_re=None,
                     they change so often that we should not consider their
                     differences.
     record_full_diffs: bool, whether to record full diff output
+    any_difference: bool, whether to stop at the first difference found. Files
+                    are then checked cheapest first: which exist, then sizes,
+                    then executable bits, then contents. The result has only
+                    that difference.
+    jobs: int, how many files to compare at once when finding all differences.
+          Differences are in the same order whatever this is.
+
+  If both codebases have a Manifest, files' contents are compared by digest
+  instead of being read.
 
   Returns:
     CodebaseDifference, or None if no difference
@@ -845,50 +1409,166 @@ def AreCodebasesDifferent(codebase1, codebase2, noisy_files_re=None,
   if noisy_files_re:
     noisy_files_re = re.compile(noisy_files_re)
 
-  relative_files = set(codebase1.Walk()).union(codebase2.Walk())
+  def Consider(relative_files):
+    return set(f for f in relative_files
+               if not (noisy_files_re and noisy_files_re.search(f)))
+
+  relative_files1 = Consider(codebase1.Walk())
+  relative_files2 = Consider(codebase2.Walk())
   result = CodebaseDifference(record_full_diffs=record_full_diffs)
 
-  for relative_filename in relative_files:
-    if noisy_files_re and noisy_files_re.search(relative_filename):
-      continue
-    file_difference = AreFilesDifferent(
-        codebase1.FilePath(relative_filename),
-        codebase2.FilePath(relative_filename),
-        relative_filename,
-        record_full_diffs)
+  # With manifests of both codebases, files needn't be read to compare them.
+  manifest1 = codebase1.Manifest()
+  manifest2 = codebase2.Manifest()
+
+  def Compare(relative_filename):
+    file1 = codebase1.FilePath(relative_filename)
+    file2 = codebase2.FilePath(relative_filename)
+    entry1 = manifest1 and manifest1.Entry(relative_filename)
+    entry2 = manifest2 and manifest2.Entry(relative_filename)
+    if entry1 and entry2:
+      return _AreManifestEntriesDifferent(entry1, entry2, file1, file2,
+                                          relative_filename, record_full_diffs)
+    return AreFilesDifferent(file1, file2, relative_filename, record_full_diffs)
+
+  if any_difference and manifest1 and manifest2:
+    for relative_filename in (
+        list(relative_files1.symmetric_difference(relative_files2)) +
+        list(relative_files1.intersection(relative_files2))):
+      file_difference = Compare(relative_filename)
+      if file_difference:
+        result.AddDifference(file_difference)
+        break
+  elif any_difference:
+    file_difference = _FirstDifference(codebase1, codebase2, relative_files1,
+                                       relative_files2, record_full_diffs)
     if file_difference:
       result.AddDifference(file_difference)
+  else:
+    relative_files = relative_files1.union(relative_files2)
+    if jobs > 1:
+      thread_pool = pool.ThreadPool(jobs)
+      try:
+        file_differences = thread_pool.imap(Compare, relative_files)
+        for file_difference in file_differences:
+          if file_difference:
+            result.AddDifference(file_difference)
+      finally:
+        thread_pool.terminate()
+    else:
+      for relative_filename in relative_files:
+        file_difference = Compare(relative_filename)
+        if file_difference:
+          result.AddDifference(file_difference)
 
   if result.HasDifference():
     return result
   return None
 
 
-def ListFiles(root, files_to_ignore_re):
-  """Return the files below root.
+def _ListDir(path):
+  """List the entries of directory path, for _WalkFiles.
+
+  Args:
+    path: str, the directory
+
+  Returns:
+    seq of (str, bool, bool, os.stat_result), the name of each entry, whether
+    it's a directory, whether it's a symlink, and its stat (following
+    symlinks), or None if it can't be stat'ed
+  """
+  result = []
+  if compat.scandir:
+    for entry in compat.scandir(path):
+      try:
+        st = entry.stat()
+      except os.error:
+        st = None
+      result.append((entry.name, entry.is_dir(), entry.is_symlink(), st))
+    return result
+
+  for name in os.listdir(path):
+    entry_path = os.path.join(path, name)
+    try:
+      st = os.lstat(entry_path)
+    except os.error:
+      continue
+    is_symlink = stat.S_ISLNK(st.st_mode)
+    if is_symlink:
+      try:
+        st = os.stat(entry_path)
+      except os.error:
+        st = None
+    result.append((name, bool(st) and stat.S_ISDIR(st.st_mode), is_symlink,
+                   st))
+  return result
+
+
+def _WalkFiles(path, relative_dir, files_to_ignore_re, dirs_to_ignore_re,
+               result):
+  """Add the files below path to result, as ListFilesWithStats does."""
+  try:
+    entries = _ListDir(path)
+  except os.error:
+    # Like os.walk, ignore directories that can't be listed.
+    return
+
+  subdirs = []
+  for name, is_dir, is_symlink, st in entries:
+    relative_path = relative_dir + name
+    if is_dir:
+      # Like os.walk, don't follow symlinks to directories, or list them.
+      if not is_symlink:
+        subdirs.append((name, relative_path))
+      continue
+    if files_to_ignore_re and files_to_ignore_re.search(relative_path):
+      # this file is extraneous; don't list it
+      continue
+    result.append((relative_path, st))
+
+  for name, relative_path in subdirs:
+    if dirs_to_ignore_re and dirs_to_ignore_re.search(relative_path):
+      continue
+    _WalkFiles(os.path.join(path, name), relative_path + '/',
+               files_to_ignore_re, dirs_to_ignore_re, result)
+
+
+def ListFilesWithStats(root, files_to_ignore_re, dirs_to_ignore_re=None):
+  """Return the files below root, and their stats.
+
+  Files are in the same order os.walk finds them.
 
   Arguments:
     root: str, the directory.
     files_to_ignore_re: re, a matcher for files to ignore. May be None.
+    dirs_to_ignore_re: re, a matcher for directories not to look in at all.
+                       May be None.
 
   Returns:
-    seq of str, the relative filenames in this directory
+    seq of (str, os.stat_result), the relative filenames in this directory and
+    their stats (following symlinks), or None for files that can't be stat'ed
   """
   result = []
-  for (dirpath, _, filenames) in os.walk(root):
-    for f in filenames:
-      abs_path = os.path.join(dirpath, f)
-      relative_path = abs_path.replace(root, '', 1)
-      relative_path = relative_path.lstrip('/')
-      if (files_to_ignore_re and
-          files_to_ignore_re.search(relative_path)):
-        # this file is extraneous; don't list it
-        continue
-      result.append(relative_path)
-
+  _WalkFiles(root, '', files_to_ignore_re, dirs_to_ignore_re, result)
   return result
 
 
+def ListFiles(root, files_to_ignore_re, dirs_to_ignore_re=None):
+  """Return the files below root.
+
+  Arguments:
+    root: str, the directory.
+    files_to_ignore_re: re, a matcher for files to ignore. May be None.
+    dirs_to_ignore_re: re, a matcher for directories not to look in at all.
+                       May be None.
+
+  Returns:
+    seq of str, the relative filenames in this directory
+  """
+  return [relative_path for relative_path, _ in
+          ListFilesWithStats(root, files_to_ignore_re, dirs_to_ignore_re)]
+
+
 class CmdError(Error):
   """An error occurred while running a command."""
 
@@ -908,9 +1588,151 @@ class CmdError(Error):
     self._message += '\n' + s
 
 
+# A command RunCmd ran. task is the MOE task that ran it, seconds its wall time.
+CmdTrace = collections.namedtuple(
+    'CmdTrace', ['cmd', 'args', 'cwd', 'task', 'seconds', 'stdout_bytes',
+                 'stderr_bytes', 'returncode'])
+
+
+class CmdTracer(object):
+  """Records the commands RunCmd runs, to show where a MOE run's time went."""
+
+  def __init__(self, current_task=None, trace_file=''):
+    """Constructs.
+
+    Args:
+      current_task: function() -> str, the name of the MOE task in progress
+      trace_file: str, a file to append each CmdTrace to as a JSON line
+    """
+    self._current_task = current_task
+    self._trace_file = trace_file
+    self._lock = threading.Lock()
+    self.traces = []
+
+  def CurrentTask(self):
+    """The name of the MOE task in progress, or '' if unknown."""
+    if self._current_task:
+      return self._current_task()
+    return ''
+
+  def Record(self, trace):
+    """Record trace, a CmdTrace."""
+    with self._lock:
+      self.traces.append(trace)
+      if self._trace_file:
+        with open(self._trace_file, 'a') as f:
+          f.write(simplejson.dumps(trace._asdict()) + '\n')
+
+  def SummaryLines(self, top=10):
+    """Summarize the commands that took the most time.
+
+    Commands are grouped by name and subcommand (e.g. "git fetch").
+
+    Args:
+      top: int, how many groups of commands to show
+
+    Returns:
+      list of str, the lines of a table
+    """
+    totals = {}
+    with self._lock:
+      traces = list(self.traces)
+    for trace in traces:
+      key = os.path.basename(trace.cmd)
+      if trace.args and not trace.args[0].startswith('-'):
+        key += ' ' + trace.args[0]
+      count, seconds, longest = totals.get(key, (0, 0.0, 0.0))
+      totals[key] = (count + 1, seconds + trace.seconds,
+                     max(longest, trace.seconds))
+    lines = ['Ran %d commands in %.1fs' % (
+        len(traces), sum(trace.seconds for trace in traces))]
+    if totals:
+      lines.append('%10s %6s %10s  %s' % ('total', 'count', 'longest',
+                                         'command'))
+      by_time = sorted(totals.iteritems(), key=lambda item: -item[1][1])
+      for key, (count, seconds, longest) in by_time[:top]:
+        lines.append('%9.1fs %6d %9.1fs  %s' % (seconds, count, longest, key))
+    return lines
+
+
+# The CmdTracer every RunCmd is recorded in. moe_app replaces it for each run.
+CMD_TRACER = CmdTracer()
+
+
+class CmdExecutor(object):
+  """Runs commands with bounded concurrency.
+
+  At most max_concurrent commands run at once, and commands with the same lock
+  key (e.g. the same working copy) run one at a time.
+  """
+
+  def __init__(self, max_concurrent):
+    self.max_concurrent = max_concurrent
+    self._slots = threading.BoundedSemaphore(max_concurrent)
+    self._locks = {}
+    self._locks_lock = threading.Lock()
+
+  @contextlib.contextmanager
+  def Slot(self, lock_key=None):
+    """A context to run one command in, once it may run."""
+    lock = None
+    if lock_key:
+      with self._locks_lock:
+        lock = self._locks.setdefault(lock_key, threading.RLock())
+      lock.acquire()
+    try:
+      with self._slots:
+        yield
+    finally:
+      if lock:
+        lock.release()
+
+  def Map(self, fns):
+    """Call fns concurrently, each in its own thread.
+
+    Args:
+      fns: list of function() -> object
+
+    Returns:
+      list, the results of fns, in order
+
+    Raises:
+      the first exception (in the order of fns) that any of fns raised, once
+      they have all finished.
+    """
+    if len(fns) < 2:
+      return [fn() for fn in fns]
+    results = [None] * len(fns)
+    errors = [None] * len(fns)
+
+    def Call(i):
+      try:
+        results[i] = fns[i]()
+      except:  # pylint: disable-msg=W0702
+        errors[i] = sys.exc_info()
+
+    threads = [threading.Thread(target=Call, args=(i,))
+               for i in range(len(fns))]
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+    for thread in threads:
+      # Join with a timeout, which (unlike join()) ^C can interrupt.
+      while thread.isAlive():
+        thread.join(1)
+    for error in errors:
+      if error:
+        raise error[0], error[1], error[2]
+    return results
+
+
+# The CmdExecutor every RunCmd runs in. moe_app replaces it for each run.
+CMD_EXECUTOR = CmdExecutor(4)
+
+
 def RunCmd(cmd, args, cwd=None, need_stdout=False, print_stdout_and_err=False,
            unhook_stdout_and_err=False,
-           stdin_data=None, env=None):
+           stdin_data=None, env=None, lock_key=None):
   """Run a command.
 
   Args:
@@ -924,6 +1746,8 @@ def RunCmd(cmd, args, cwd=None, need_stdout=False, print_stdout_and_err=False,
                             when sub-commands need to interact with the user.
     stdin_data: str, data to pass on stdin
     env: dict, the environment to run the command in
+    lock_key: str, commands with the same lock_key never run concurrently.
+              Defaults to cwd.
 
   Returns:
     str or None, the stdout if requested
@@ -950,9 +1774,14 @@ def RunCmd(cmd, args, cwd=None, need_stdout=False, print_stdout_and_err=False,
 
   if env:
     kwargs['env'] = env
-  process = subprocess.Popen([cmd] + args,
-                             **kwargs)
-  stdout_data, stderr_data = process.communicate(stdin_data)
+  with CMD_EXECUTOR.Slot(lock_key or cwd):
+    start = time.time()
+    process = subprocess.Popen([cmd] + args,
+                               **kwargs)
+    stdout_data, stderr_data = process.communicate(stdin_data)
+  CMD_TRACER.Record(CmdTrace(
+      cmd, args, cwd, CMD_TRACER.CurrentTask(), time.time() - start,
+      len(stdout_data or ''), len(stderr_data or ''), process.returncode))
 
   if print_stdout_and_err:
     print stdout_data
@@ -978,6 +1807,62 @@ def RunCmd(cmd, args, cwd=None, need_stdout=False, print_stdout_and_err=False,
     return stdout_data.decode('utf-8')
 
 
+def RunPipe(producer, consumer, cwd=None, lock_key=None):
+  """Run two commands, with the first's stdout piped into the second.
+
+  The output streams between them, so it's never all in memory or on disk.
+
+  Args:
+    producer: (str, list), the command and arguments whose stdout is piped
+    consumer: (str, list), the command and arguments that read it on stdin
+    cwd: str, the directory to run both commands in
+    lock_key: str, as for RunCmd. Defaults to cwd.
+
+  Raises:
+    CmdError: if either command returns non-zero.
+  """
+  logging.debug('>>RUNNING: %s | %s', ' '.join([producer[0]] + producer[1]),
+                ' '.join([consumer[0]] + consumer[1]))
+  # Nothing reads the producer's stderr until the consumer is done, so it goes
+  # to a file rather than a pipe that could fill up and stall them both.
+  with CMD_EXECUTOR.Slot(lock_key or cwd), tempfile.TemporaryFile() as errors:
+    start = time.time()
+    producer_process = subprocess.Popen(
+        [producer[0]] + producer[1], cwd=cwd, stdout=subprocess.PIPE,
+        stderr=errors)
+    consumer_process = subprocess.Popen(
+        [consumer[0]] + consumer[1], cwd=cwd,
+        stdin=producer_process.stdout, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    # Only the consumer reads the pipe now, so the producer gets SIGPIPE if
+    # the consumer exits early.
+    producer_process.stdout.close()
+    consumer_stdout, consumer_stderr = consumer_process.communicate()
+    producer_process.wait()
+    errors.seek(0)
+    producer_stderr = errors.read()
+  seconds = time.time() - start
+  for (cmd, args), process, stdout_data, stderr_data in [
+      (producer, producer_process, '', producer_stderr),
+      (consumer, consumer_process, consumer_stdout, consumer_stderr)]:
+    CMD_TRACER.Record(CmdTrace(
+        cmd, args, cwd, CMD_TRACER.CurrentTask(), seconds, len(stdout_data),
+        len(stderr_data), process.returncode))
+
+  for (cmd, args), process, stderr_data in [
+      (producer, producer_process, producer_stderr),
+      (consumer, consumer_process, consumer_stderr)]:
+    if process.returncode:
+      if stderr_data:
+        sys.stderr.write(stderr_data)
+      message = ('%(cmd)s command %(args)s in %(dir)s returned '
+                 '%(return_code)d' %
+                 {'cmd': cmd, 'args': args,
+                  'return_code': process.returncode, 'dir': cwd})
+      print message
+      raise CmdError(message, returncode=process.returncode)
+
+
 class RepositoryConfig(object):
   """Configuration for a MOE repository."""
 
@@ -1013,14 +1898,17 @@ class RepositoryConfig(object):
 class CodebaseExpander(object):
   """Expands Codebases idempotently."""
 
-  def __init__(self, temp_dir):
+  def __init__(self, temp_dir, expansion_cache=None):
     """Constructs.
 
     Args:
       temp_dir: str, path to a temporary directory
+      expansion_cache: ExpansionCache, where to expand archives, or None to
+                       expand them under temp_dir
     """
     self._temp_dir = temp_dir
     self._expansion_cache = {}
+    self._disk_cache = expansion_cache
 
   def _PossiblyExpandCodebase(self, codebase):
     """Expand (if necessary) a codebase we created.
@@ -1033,6 +1921,9 @@ class CodebaseExpander(object):
 
     NB(dbentley): this is for friends (created Codebase's) only. Hence _-prefix.
     """
+    if (self._disk_cache and codebase not in self._expansion_cache and
+        not os.path.isdir(codebase) and _IsExpandable(codebase)):
+      self._expansion_cache[codebase] = self._disk_cache.Expand(codebase)
     return PossiblyExpandCodebase(codebase, self._temp_dir,
                                   cache=self._expansion_cache)
 
@@ -6,14 +6,34 @@
 
 __author__ = 'dbentley@google.com (Daniel Bentley)'
 
+import collections
+import errno
+import fcntl
+import json as simplejson
 import os
+import posixpath
 import re
 import shutil
+import stat
+import tarfile
 import tempfile
+import threading
+import time
+import zipfile
+
+import gflags as flags
+import logging
 
 from moe import base
 from moe import moe_app
 
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('export_store_max_bytes', 4 * 1024 * 1024 * 1024,
+                     'How much disk the exported revisions of each project '
+                     'space may use before the least recently used are '
+                     'removed.')
+
 
 class Codebase(object):
   """A Codebase is a body of code.
@@ -29,7 +49,8 @@ class Codebase(object):
   def __init__(self, path, expander=None, client_creator=None,
                additional_files_re=None, expanded_path=None,
                metadata=None, rev_id='',
-               project_space=base.PUBLIC_STR):
+               project_space=base.PUBLIC_STR, manifest_path=None,
+               manifest=None):
     """Construct.
 
     Args:
@@ -44,6 +65,9 @@ class Codebase(object):
                 usage by the creator
       rev_id: str, the id of the revision this Codebase is created at
       project_space: str, which project space this Codebase is in
+      manifest_path: str, where to keep this Codebase's Manifest between runs.
+                     Only give one if the Codebase won't be modified.
+      manifest: Manifest, this Codebase's Manifest, if it's known already
     """
     self._path = path
     self._expanded_path = expanded_path
@@ -53,6 +77,8 @@ class Codebase(object):
     self._metadata = metadata
     self._rev_id = rev_id
     self._project_space = project_space
+    self._manifest_path = manifest_path
+    self._manifest = manifest
 
   def ProjectSpace(self):
     """Which project space this Codebase is in. (one of base.PROJECT_SPACES)."""
@@ -68,8 +94,24 @@ class Codebase(object):
     Returns:
       seq of str, the relative filenames in this Codebase
     """
+    manifest = self.Manifest()
+    if manifest:
+      return [f for f in manifest.Files()
+              if not (self._additional_files_re and
+                      self._additional_files_re.search(f))]
     return base.ListFiles(self.ExpandedPath(), self._additional_files_re)
 
+  def Manifest(self):
+    """Return a Manifest of this Codebase, or None if it doesn't keep one.
+
+    The Manifest is computed once per Codebase, reusing the hashes in the one
+    saved at manifest_path for files that haven't changed since.
+    """
+    if self._manifest_path and not self._manifest:
+      self._manifest = LoadOrComputeManifest(self.ExpandedPath(),
+                                             self._manifest_path)
+    return self._manifest
+
   def _DebugWalk(self):
     """Debug finding files in this Codebase."""
     lst = base.ListFiles(self.ExpandedPath(), None)
@@ -90,6 +132,28 @@ class Codebase(object):
   def FilePath(self, relative_filename):
     return os.path.join(self.ExpandedPath(), relative_filename)
 
+  def WritableFilePath(self, relative_filename):
+    """Return the path of relative_filename, ready to be modified in place.
+
+    Files in a copy made by CreateModifiableCopy(copy_on_write=True) may be
+    hardlinks to the original's, and files shared between codebases are kept
+    read-only; this gives the file its own, writable, copy first.
+    """
+    path = self.FilePath(relative_filename)
+    try:
+      st = os.lstat(path)
+    except OSError:
+      return path
+    if not stat.S_ISREG(st.st_mode):
+      return path
+    if st.st_nlink > 1:
+      temp_path = path + '.moe_copy'
+      _CopyFile(path, temp_path)
+      os.rename(temp_path, path)
+    else:
+      _MakeWritable(path)
+    return path
+
   def Path(self):
     """Return a str path to the (possibly-tar'ed up) codebase.
 
@@ -191,24 +255,20 @@ class ExportingCodebaseCreator(CodebaseCreator):
         'Exporting codebase at revision %s' % revision)
     with task:
       is_head = not revision
-      path = os.path.join(
-          moe_app.RUN.temp_dir,
-          '%s_export' % self._project_space,
-          str(revision) or 'head')
+      name = str(revision) or 'head'
+      store = _ExportStoreAt(os.path.join(moe_app.RUN.temp_dir,
+                                          '%s_export' % self._project_space))
 
       if is_head:
-        # TODO(dbentley): remove the existing path
-        shutil.rmtree(path, ignore_errors=True)
+        # head moves, so an earlier export of it is stale. One still in use
+        # is left alone, and head exported beside it.
+        suffix = 0
+        while not store.Remove(name):
+          suffix += 1
+          name = 'head.%d' % suffix
 
-      if not os.path.exists(path):
-        # TODO(dbentley): if something got partially exported (e.g.,
-        # an export process was interrupted), this corrupt export will
-        # persist. It will be neither detected nor fixed. Instead, the
-        # corrupt export will be used which will lead to confusing
-        # results. Perhaps fix this by requiring that implementations
-        # of export be atomic, e.g. by exporting to a temp place, and
-        # then renaming to the desired destination atomically.
-        self._repository.Export(path, revision)
+      path = store.Export(
+          name, lambda directory: self._repository.Export(directory, revision))
 
       client_creator = lambda: self._repository.MakeClient(
           moe_app.RUN.temp_dir,
@@ -217,17 +277,823 @@ class ExportingCodebaseCreator(CodebaseCreator):
       result = Codebase(path, None, client_creator=client_creator,
                         additional_files_re=self._additional_files_re,
                         rev_id=revision,
-                        project_space=self._project_space)
+                        project_space=self._project_space,
+                        manifest_path=path + MANIFEST_SUFFIX,
+                        manifest=store.Manifest(name))
       return result
 
 
-def CreateModifiableCopy(codebase):
-  """Create a modifiable copy of this codebase_utils.Codebase."""
+# {str: ExportStore}, the stores in use by this run, by root, so each keeps
+# what it exports in use for the rest of the run.
+_EXPORT_STORES = {}
+_EXPORT_STORES_LOCK = threading.Lock()
+
+
+def _ExportStoreAt(root):
+  """The ExportStore this run keeps exports in at root."""
+  with _EXPORT_STORES_LOCK:
+    if root not in _EXPORT_STORES:
+      _EXPORT_STORES[root] = ExportStore(root, FLAGS.export_store_max_bytes)
+    return _EXPORT_STORES[root]
+
+
+# Linux's FICLONE ioctl (from <linux/fs.h>), which reflinks one file to another.
+_FICLONE = 0x40049409
+
+
+def _Reflink(src, dst):
+  """Make dst a copy-on-write clone of src, if the filesystem can.
+
+  Returns:
+    bool, whether dst was created
+  """
+  try:
+    with open(src, 'rb') as src_file:
+      with open(dst, 'wb') as dst_file:
+        fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+  except (IOError, OSError):
+    if os.path.exists(dst):
+      os.remove(dst)
+    return False
+  shutil.copystat(src, dst)
+  return True
+
+
+def _MakeWritable(path):
+  """Give the owner write permission on path, a file no one else shares."""
+  mode = stat.S_IMODE(os.stat(path).st_mode)
+  if not mode & stat.S_IWUSR:
+    os.chmod(path, mode | stat.S_IWUSR)
+
+
+def _CopyFile(src, dst):
+  """Copy src to dst (with its permissions), reflinking if possible.
+
+  dst is writable even if src (e.g. a shared blob) isn't.
+  """
+  if not _Reflink(src, dst):
+    shutil.copy2(src, dst)
+  _MakeWritable(dst)
+
+
+def _CopyTree(src, dst, link_files):
+  """Copy the directory src to dst, like shutil.copytree.
+
+  Files are reflinked where the filesystem supports it. Otherwise, if
+  link_files, they are hardlinked; if not, they are copied.
+  """
+  can_reflink = True
+  dirs = []
+  for dirpath, _, filenames in os.walk(src, followlinks=True):
+    dst_dirpath = os.path.join(dst, os.path.relpath(dirpath, src))
+    base.MakeDir(dst_dirpath)
+    dirs.append((dirpath, dst_dirpath))
+    for filename in filenames:
+      src_file = os.path.join(dirpath, filename)
+      dst_file = os.path.join(dst_dirpath, filename)
+      if can_reflink:
+        if _Reflink(src_file, dst_file):
+          _MakeWritable(dst_file)
+          continue
+        # The filesystem doesn't support it; don't try again for every file.
+        can_reflink = False
+      if link_files:
+        try:
+          os.link(os.path.realpath(src_file), dst_file)
+          continue
+        except OSError, e:
+          if e.errno != errno.EXDEV:
+            raise
+          link_files = False
+      shutil.copy2(src_file, dst_file)
+      _MakeWritable(dst_file)
+  for dirpath, dst_dirpath in dirs:
+    shutil.copystat(dirpath, dst_dirpath)
+
+
+def CreateModifiableCopy(codebase, copy_on_write=False):
+  """Create a modifiable copy of this codebase_utils.Codebase.
+
+  Args:
+    codebase: Codebase, the codebase to copy
+    copy_on_write: bool, whether the copy may share files with codebase (as
+                   hardlinks, where reflinks aren't supported). Only pass
+                   True if every file is modified through the copy's
+                   WritableFilePath, rather than in place by e.g. a tool.
+
+  Returns:
+    Codebase
+  """
   new_dir = tempfile.mkdtemp(
       dir=moe_app.RUN.temp_dir,
       prefix='modified_codebase_')
 
   os.rmdir(new_dir)
-  shutil.copytree(codebase.ExpandedPath(), new_dir)
+  _CopyTree(codebase.ExpandedPath(), new_dir, link_files=copy_on_write)
 
   return Codebase(new_dir, additional_files_re=codebase.AdditionalFilesRe())
+
+
+# Suffixes of the tar files ArchiveCodebase reads, and their tarfile modes.
+_TAR_MODES = [
+    ('.tar', 'r:'),
+    ('.tar.gz', 'r|gz'),
+    ('.tgz', 'r|gz'),
+    ('.tar.bz2', 'r|bz2'),
+    ('.tbz2', 'r|bz2'),
+    ]
+
+
+def _TarMode(path):
+  for suffix, mode in _TAR_MODES:
+    if path.endswith(suffix):
+      return mode
+  return None
+
+
+def IsArchive(path):
+  """Whether path is an archive file an ArchiveCodebase can read."""
+  return (os.path.isfile(path) and
+          (path.endswith('.zip') or _TarMode(path) is not None))
+
+
+def CodebaseFromPath(path, **kwargs):
+  """Return a Codebase of the directory or archive at path.
+
+  Args:
+    path: str, a directory, or an archive IsArchive accepts
+    kwargs: passed to the Codebase
+
+  Returns:
+    Codebase
+  """
+  if IsArchive(path):
+    return ArchiveCodebase(path, **kwargs)
+  return Codebase(path, **kwargs)
+
+
+def _MemberName(name):
+  """The relative filename of an archive member named name, or None."""
+  name = posixpath.normpath(name)
+  if name == '.':
+    return None
+  if name.startswith('/') or name == '..' or name.startswith('../'):
+    raise base.Error('Archive member %s is outside the archive' % name)
+  return name
+
+
+def _CheckLinkTarget(name, target, hard=False):
+  """Raise base.Error if archive member name links outside the archive.
+
+  Args:
+    name: str, the member's relative filename
+    target: str, what it links to: relative to its directory for a symlink,
+            or to the archive's root for a hard link
+    hard: bool, whether it's a hard link
+  """
+  if not hard:
+    target = posixpath.join(posixpath.dirname(name), target)
+  target = posixpath.normpath(target)
+  if target.startswith('/') or target == '..' or target.startswith('../'):
+    raise base.Error('Archive member %s links outside the archive' % name)
+
+
+class ArchiveCodebase(Codebase):
+  """A Codebase in a .tar, .tar.gz, .tar.bz2 or .zip, expanded as needed.
+
+  Walk needs only the archive's index. FilePath extracts just the file asked
+  for: zip and uncompressed tar members are read directly. A compressed tar
+  can only be read in order, so it's extracted in the background and FilePath
+  waits for the member it wants. ExpandedPath extracts everything.
+  """
+
+  def __init__(self, path, **kwargs):
+    Codebase.__init__(self, path, **kwargs)
+    self._tar_mode = _TarMode(path)
+    self._streaming = self._tar_mode is not None and '|' in self._tar_mode
+    self._extraction_dir = None
+    # Guards everything below. Threads wait on it for extractions.
+    self._condition = threading.Condition()
+    self._archive = None
+    # relative filename -> (tarfile.TarInfo or zipfile.ZipInfo), in order.
+    self._members = collections.OrderedDict()
+    self._extracted = set()
+    self._indexed = False
+    self._stream_done = False
+    self._stream_error = None
+
+  def Walk(self):
+    """Return the files in the Codebase.
+
+    Returns:
+      seq of str, the relative filenames in this Codebase
+    """
+    with self._condition:
+      self._Index()
+      if self._streaming:
+        # Members are only known once they've been streamed.
+        self._WaitForStream()
+      return [f for f, member in self._members.iteritems()
+              if self._IsFile(member) and
+              not (self._additional_files_re and
+                   self._additional_files_re.search(f))]
+
+  def FilePath(self, relative_filename):
+    with self._condition:
+      self._Index()
+      if self._streaming:
+        while (relative_filename not in self._extracted and
+               not self._stream_done):
+          self._condition.wait()
+        self._RaiseStreamError()
+      elif relative_filename in self._members:
+        member = self._members[relative_filename]
+        if self._IsLink(member):
+          # Its target needs extracting too; just extract everything.
+          self._ExtractAll()
+        else:
+          self._Extract(relative_filename)
+    return os.path.join(self._extraction_dir, relative_filename)
+
+  def ExpandedPath(self):
+    with self._condition:
+      self._Index()
+      if self._streaming:
+        self._WaitForStream()
+      else:
+        self._ExtractAll()
+    return self._extraction_dir
+
+  def _IsFile(self, member):
+    if self._tar_mode:
+      return not member.isdir()
+    return not member.filename.endswith('/')
+
+  def _IsLink(self, member):
+    if self._tar_mode:
+      return member.issym() or member.islnk()
+    # The high bits of external_attr are the file's Unix mode, if any.
+    return stat.S_ISLNK(member.external_attr >> 16)
+
+  def _Index(self):
+    """Read the archive's index, or start streaming a compressed tar."""
+    if self._indexed:
+      return
+    self._extraction_dir = os.path.abspath(tempfile.mkdtemp(
+        dir=moe_app.RUN.temp_dir, prefix='codebase_'))
+    if self._tar_mode:
+      self._archive = tarfile.open(self._path, self._tar_mode)
+      self._archive.errorlevel = 2
+    else:
+      self._archive = zipfile.ZipFile(self._path)
+
+    if self._streaming:
+      stream_thread = threading.Thread(target=self._Stream)
+      stream_thread.daemon = True
+      stream_thread.start()
+    elif self._tar_mode:
+      for member in self._archive.getmembers():
+        name = _MemberName(member.name)
+        if name:
+          self._members[name] = member
+    else:
+      for member in self._archive.infolist():
+        name = _MemberName(member.filename)
+        if name:
+          self._members[name] = member
+    self._indexed = True
+
+  def _Stream(self):
+    """Extract a compressed tar, in order, noting each member as it's done."""
+    try:
+      for member in self._archive:
+        name = _MemberName(member.name)
+        if not name:
+          continue
+        self._ExtractTarMember(member)
+        with self._condition:
+          self._members[name] = member
+          self._extracted.add(name)
+          self._condition.notify_all()
+    except Exception, e:  # pylint: disable-msg=W0703
+      self._stream_error = e
+    finally:
+      with self._condition:
+        self._archive.close()
+        self._stream_done = True
+        self._condition.notify_all()
+
+  def _WaitForStream(self):
+    while not self._stream_done:
+      self._condition.wait()
+    self._RaiseStreamError()
+
+  def _RaiseStreamError(self):
+    if self._stream_error:
+      raise base.Error('Could not extract %s: %s' %
+                       (self._path, self._stream_error))
+
+  def _ExtractTarMember(self, member):
+    if member.issym() or member.islnk():
+      _CheckLinkTarget(_MemberName(member.name), member.linkname,
+                       hard=member.islnk())
+    self._archive.extract(member, path=self._extraction_dir)
+    if not member.issym():
+      # make sure file is writeable
+      os.chmod(os.path.join(self._extraction_dir, member.name),
+               member.mode | stat.S_IWUSR)
+
+  def _Extract(self, relative_filename):
+    """Extract a member of a zip or uncompressed tar, if not done already."""
+    if relative_filename in self._extracted:
+      return
+    member = self._members[relative_filename]
+    if self._tar_mode:
+      self._ExtractTarMember(member)
+    elif self._IsLink(member):
+      # A symlink is stored with its target as its contents.
+      target = self._archive.read(member)
+      _CheckLinkTarget(relative_filename, target)
+      path = os.path.join(self._extraction_dir, relative_filename)
+      base.MakeDir(os.path.dirname(path))
+      os.symlink(target, path)
+    else:
+      path = self._archive.extract(member, self._extraction_dir)
+      mode = (member.external_attr >> 16) & 07777
+      if mode:
+        os.chmod(path, mode | stat.S_IWUSR)
+    self._extracted.add(relative_filename)
+
+  def _ExtractAll(self):
+    for relative_filename in self._members:
+      self._Extract(relative_filename)
+
+
+# Bump this when changing what a saved manifest contains.
+_MANIFEST_VERSION = 1
+
+# Manifests of exported codebases are saved next to them, with this suffix.
+MANIFEST_SUFFIX = '.manifest.json'
+
+# A file's entry in a Manifest. size, mtime, ctime and inode tell whether the
+# file has changed since its digest was computed.
+ManifestEntry = collections.namedtuple(
+    'ManifestEntry', ['size', 'mode', 'mtime', 'ctime', 'inode', 'digest'])
+
+
+class Manifest(object):
+  """What files are in a directory, and what's in them.
+
+  Comparing the manifests of two directories is enough to tell whether their
+  files are the same, without reading them.
+  """
+
+  def __init__(self, files, entries):
+    """Initialize.
+
+    Args:
+      files: list of str, the relative filenames in the directory
+      entries: {str: ManifestEntry}, the entries of the files that could be
+               read
+    """
+    self._files = files
+    self._entries = entries
+
+  def __eq__(self, other):
+    return (isinstance(other, Manifest) and self._files == other._files and
+            self._entries == other._entries)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def Files(self):
+    """Return the relative filenames in the directory, a list of str."""
+    return self._files
+
+  def Entry(self, relative_filename):
+    """Return the ManifestEntry of relative_filename, or None if unknown."""
+    return self._entries.get(relative_filename)
+
+  def Save(self, filename):
+    """Save this Manifest in filename (atomically)."""
+    manifest_json = {
+        'version': _MANIFEST_VERSION,
+        'files': [[f] + list(self._entries.get(f) or []) for f in self._files],
+        }
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w') as f:
+      simplejson.dump(manifest_json, f)
+    os.rename(temp_filename, filename)
+
+
+def ComputeManifest(root, previous_manifest=None):
+  """Compute the Manifest of the directory root.
+
+  Args:
+    root: str, the directory
+    previous_manifest: Manifest, an earlier Manifest of root whose digests
+                       can be reused for files that haven't changed
+
+  Returns:
+    Manifest
+  """
+  files = []
+  entries = {}
+  for relative_filename, st in base.ListFilesWithStats(root, None):
+    files.append(relative_filename)
+    if not st or not stat.S_ISREG(st.st_mode):
+      # E.g. a broken symlink. Comparisons will look at the file itself.
+      continue
+    path = os.path.join(root, relative_filename)
+    previous_entry = (previous_manifest and
+                      previous_manifest.Entry(relative_filename))
+    if (previous_entry and
+        (previous_entry.size, previous_entry.mtime, previous_entry.ctime,
+         previous_entry.inode) ==
+        (st.st_size, st.st_mtime, st.st_ctime, st.st_ino)):
+      digest = previous_entry.digest
+    else:
+      digest = base.HashFile(path)
+    entries[relative_filename] = ManifestEntry(
+        st.st_size, st.st_mode, st.st_mtime, st.st_ctime, st.st_ino, digest)
+  return Manifest(files, entries)
+
+
+def LoadManifest(filename):
+  """Load the Manifest saved in filename.
+
+  Returns:
+    Manifest, or None if there's no usable one
+  """
+  try:
+    with open(filename) as f:
+      manifest_json = simplejson.load(f)
+    if manifest_json.get('version') != _MANIFEST_VERSION:
+      return None
+    files = []
+    entries = {}
+    for file_json in manifest_json['files']:
+      relative_filename = file_json[0].encode('utf-8')
+      files.append(relative_filename)
+      if len(file_json) > 1:
+        entries[relative_filename] = ManifestEntry(
+            *[v.encode('utf-8') if isinstance(v, unicode) else v
+              for v in file_json[1:]])
+    return Manifest(files, entries)
+  except (IOError, ValueError, KeyError, TypeError, IndexError,
+          AttributeError), e:
+    logging.debug('Not using manifest %s: %s', filename, e)
+    return None
+
+
+def LoadOrComputeManifest(root, filename):
+  """Compute the Manifest of root, reusing and updating the one in filename.
+
+  Args:
+    root: str, the directory
+    filename: str, where root's Manifest is saved between runs
+
+  Returns:
+    Manifest
+  """
+  previous_manifest = LoadManifest(filename)
+  manifest = ComputeManifest(root, previous_manifest)
+  if manifest != previous_manifest:
+    try:
+      manifest.Save(filename)
+    except (IOError, OSError, UnicodeError), e:
+      # E.g. a filename that isn't UTF-8, so can't be saved as JSON.
+      logging.warning('Could not save manifest %s: %s', filename, e)
+  return manifest
+
+
+class ExportStore(object):
+  """A directory of exported revisions, which are complete or absent.
+
+  Each revision is exported into a scratch directory, and only renamed to
+  root/<name> once the export has finished; root/<name>.complete then marks it
+  usable, so an interrupted export is never mistaken for a good one. Its
+  Manifest is saved alongside.
+
+  Files with the same contents and permissions are hardlinked to one read-only
+  copy in root/.blobs, so consecutive revisions cost little more than the
+  files that changed between them. Exported files must therefore never be
+  modified in place; make a copy (e.g. with CreateModifiableCopy) to modify
+  them. A saved Manifest is only used while the files still match it.
+
+  The complete marker's mtime is when the revision was last used; once the
+  store uses more than max_bytes, the least recently used revisions are
+  removed, except those in use: an ExportStore holds a shared lock on
+  root/<name>.lock for each revision it exports, until it's closed (or its
+  process exits), and a revision is only removed under an exclusive one.
+  """
+
+  COMPLETE_SUFFIX = '.complete'
+  _LOCK_SUFFIX = '.lock'
+  _BLOBS_DIR = '.blobs'
+  _SCRATCH_PREFIX = '.exporting_'
+  # Scratch directories older than this were left by runs that died.
+  _SCRATCH_MAX_AGE = 24 * 60 * 60
+
+  def __init__(self, root, max_bytes):
+    """Constructs.
+
+    Args:
+      root: str, the directory to keep exports in
+      max_bytes: int, how much disk the exports may use in total
+    """
+    self.root = root
+    self.max_bytes = max_bytes
+    self._blobs_dir = os.path.join(root, self._BLOBS_DIR)
+    # {name: file}, the locks held on the revisions exported so far.
+    self._in_use = {}
+    self._in_use_lock = threading.Lock()
+
+  def Path(self, name):
+    """The path revision name is (or would be) exported at."""
+    return os.path.join(self.root, name)
+
+  def _OpenLock(self, name, operation):
+    return base.LockFile(self.Path(name) + self._LOCK_SUFFIX, operation)
+
+  def _Use(self, name):
+    """Hold a shared lock on revision name, until Close."""
+    with self._in_use_lock:
+      if name not in self._in_use:
+        self._in_use[name] = self._OpenLock(name, fcntl.LOCK_SH)
+
+  def Close(self):
+    """Release the revisions exported so far, for other runs to remove."""
+    with self._in_use_lock:
+      for lock in self._in_use.itervalues():
+        lock.close()
+      self._in_use.clear()
+
+  def IsComplete(self, name):
+    """Whether revision name has been exported completely."""
+    return (os.path.isfile(self.Path(name) + self.COMPLETE_SUFFIX) and
+            os.path.isdir(self.Path(name)))
+
+  def Manifest(self, name):
+    """The Manifest of the export of revision name.
+
+    Returns:
+      Manifest, or None if it's unknown or the export's files have changed
+      since it was saved
+    """
+    path = self.Path(name)
+    manifest = LoadManifest(path + MANIFEST_SUFFIX)
+    if not manifest:
+      return None
+    for relative_filename in manifest.Files():
+      entry = manifest.Entry(relative_filename)
+      if not entry:
+        continue
+      try:
+        st = os.lstat(os.path.join(path, relative_filename))
+      except OSError:
+        st = None
+      # Linking a blob into another export changes its ctime, so that can't
+      # be compared.
+      if (not st or (st.st_size, st.st_mtime, st.st_ino) !=
+          (entry.size, entry.mtime, entry.inode) or
+          base.IsExecutableMode(st.st_mode) !=
+          base.IsExecutableMode(entry.mode)):
+        logging.warning('Not using manifest of %s: %s has changed',
+                        path, relative_filename)
+        return None
+    return manifest
+
+  def Export(self, name, export_fn):
+    """Return the path of a complete export of revision name.
+
+    Args:
+      name: str, the name of the revision
+      export_fn: function(str), exports the revision into the directory it's
+                 passed (which doesn't exist yet), if it isn't already
+
+    Returns:
+      str, the path of the export
+    """
+    path = self.Path(name)
+    base.MakeDir(self._blobs_dir)
+    # Locked before looking, so it can't be removed once found.
+    self._Use(name)
+    if self.IsComplete(name):
+      os.utime(path + self.COMPLETE_SUFFIX, None)
+      return path
+    # Whatever is there was left by an interrupted export.
+    self._RemoveFiles(name)
+
+    scratch_dir = tempfile.mkdtemp(dir=self.root, prefix=self._SCRATCH_PREFIX)
+    try:
+      tree = os.path.join(scratch_dir, 'tree')
+      export_fn(tree)
+      base.MakeDir(tree)
+      manifest, unshared_bytes = self._Deduplicate(tree)
+      try:
+        os.rename(tree, path)
+      except OSError, e:
+        # Another run may have exported the same revision first; use theirs.
+        if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+          raise
+    finally:
+      shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    try:
+      manifest.Save(path + MANIFEST_SUFFIX)
+    except (IOError, OSError, UnicodeError), e:
+      # The Codebase will compute its Manifest itself.
+      logging.warning('Could not save manifest of %s: %s', path, e)
+    with open(path + self.COMPLETE_SUFFIX, 'w') as f:
+      simplejson.dump({'unshared_bytes': unshared_bytes}, f)
+    self.GarbageCollect()
+    return path
+
+  def _Deduplicate(self, tree):
+    """Hardlink the files in tree to the blobs with the same contents.
+
+    Returns:
+      (Manifest of tree, bytes in files that couldn't be linked to a blob)
+    """
+    manifest = ComputeManifest(tree)
+    entries = {}
+    unshared_bytes = 0
+    for relative_filename in manifest.Files():
+      entry = manifest.Entry(relative_filename)
+      if not entry:
+        continue
+      path = os.path.join(tree, relative_filename)
+      if not os.path.islink(path) and self._LinkToBlob(path, entry):
+        st = os.stat(path)
+        entry = entry._replace(
+            mtime=st.st_mtime, ctime=st.st_ctime, inode=st.st_ino)
+      else:
+        unshared_bytes += entry.size
+      entries[relative_filename] = entry
+    return Manifest(manifest.Files(), entries), unshared_bytes
+
+  def _LinkToBlob(self, path, entry):
+    """Make path a hardlink to the blob for entry; return whether it is."""
+    blob = os.path.join(
+        self._blobs_dir, '%s.%o' % (entry.digest, stat.S_IMODE(entry.mode)))
+    try:
+      if os.path.exists(blob):
+        temp_path = path + '.moe_link'
+        os.link(blob, temp_path)
+        os.rename(temp_path, path)
+      else:
+        os.link(path, blob)
+        os.chmod(blob, stat.S_IMODE(entry.mode) & ~0222)
+      return True
+    except OSError, e:
+      # E.g. a concurrent run just removed the blob.
+      logging.debug('Not deduplicating %s: %s', path, e)
+      return False
+
+  def Remove(self, name):
+    """Remove the export of revision name, if there is one and it's not in use.
+
+    Returns:
+      bool, whether there is no export of name now
+    """
+    if name in self._in_use:
+      return False
+    lock = self._OpenLock(name, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    if not lock:
+      return False
+    try:
+      self._RemoveFiles(name)
+      os.remove(lock.name)
+    finally:
+      lock.close()
+    return True
+
+  def _RemoveFiles(self, name):
+    """Remove the files of the export of revision name, without locking it."""
+    path = self.Path(name)
+    # Remove the marker first, so the export is never used half-removed.
+    for filename in (path + self.COMPLETE_SUFFIX, path + MANIFEST_SUFFIX):
+      try:
+        os.remove(filename)
+      except OSError, e:
+        if e.errno != errno.ENOENT:
+          raise
+    shutil.rmtree(path, ignore_errors=True)
+
+  def Revisions(self):
+    """The completely exported revisions.
+
+    Returns:
+      list of (name, bytes not shared with other revisions, last use as seconds
+      since the epoch), least recently used first.
+    """
+    revisions = []
+    if not os.path.isdir(self.root):
+      return revisions
+    for filename in os.listdir(self.root):
+      if not filename.endswith(self.COMPLETE_SUFFIX):
+        continue
+      marker = os.path.join(self.root, filename)
+      try:
+        with open(marker) as f:
+          unshared_bytes = simplejson.load(f)['unshared_bytes']
+        last_used = os.path.getmtime(marker)
+      except (IOError, OSError, ValueError, KeyError):
+        # Removed or being written by a concurrent run.
+        continue
+      revisions.append(
+          (filename[:-len(self.COMPLETE_SUFFIX)], unshared_bytes, last_used))
+    revisions.sort(key=lambda revision: revision[2])
+    return revisions
+
+  def _PruneBlobs(self):
+    """Remove the blobs no export links to.
+
+    Returns:
+      int, the bytes in the remaining blobs
+    """
+    blob_bytes = 0
+    if not os.path.isdir(self._blobs_dir):
+      return blob_bytes
+    for filename in os.listdir(self._blobs_dir):
+      blob = os.path.join(self._blobs_dir, filename)
+      try:
+        st = os.stat(blob)
+        if st.st_nlink == 1:
+          os.remove(blob)
+        else:
+          blob_bytes += st.st_size
+      except OSError:
+        continue
+    return blob_bytes
+
+  def _PruneBlobsOf(self, manifest):
+    """Remove the blobs of manifest's files that no export links to any more.
+
+    Returns:
+      int, the bytes in the blobs removed
+    """
+    freed_bytes = 0
+    for relative_filename in manifest.Files():
+      entry = manifest.Entry(relative_filename)
+      if not entry:
+        continue
+      blob = os.path.join(
+          self._blobs_dir, '%s.%o' % (entry.digest, stat.S_IMODE(entry.mode)))
+      try:
+        st = os.stat(blob)
+        if st.st_nlink == 1:
+          os.remove(blob)
+          freed_bytes += st.st_size
+      except OSError:
+        continue
+    return freed_bytes
+
+  def DiskUsage(self):
+    """The bytes used by the exports in this store."""
+    return (self._PruneBlobs() +
+            sum(unshared for _, unshared, _ in self.Revisions()))
+
+  def GarbageCollect(self, max_bytes=None):
+    """Remove least recently used revisions until within the byte budget.
+
+    Revisions in use, by this or any other ExportStore, are kept.
+
+    Args:
+      max_bytes: int, the budget; self.max_bytes if None
+
+    Returns:
+      list of str, the names of the revisions removed
+    """
+    if max_bytes is None:
+      max_bytes = self.max_bytes
+    removed = []
+    if not os.path.isdir(self.root):
+      return removed
+    # Measured once; each removal then subtracts what it freed. Blobs of a
+    # revision without a Manifest are only freed by the next collection.
+    usage = self.DiskUsage()
+    for name, unshared_bytes, _ in self.Revisions():
+      if usage <= max_bytes:
+        break
+      manifest = self.Manifest(name)
+      if not self.Remove(name):
+        continue
+      usage -= unshared_bytes
+      if manifest:
+        usage -= self._PruneBlobsOf(manifest)
+      removed.append(name)
+
+    now = time.time()
+    for filename in os.listdir(self.root):
+      path = os.path.join(self.root, filename)
+      if (filename.startswith(self._SCRATCH_PREFIX) and
+          now - os.path.getmtime(path) > self._SCRATCH_MAX_AGE):
+        shutil.rmtree(path, ignore_errors=True)
+      elif filename.endswith(self._LOCK_SUFFIX):
+        # Left by an export that failed, unless it's being retried.
+        name = filename[:-len(self._LOCK_SUFFIX)]
+        if not self.IsComplete(name):
+          self.Remove(name)
+    return removed
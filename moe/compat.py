@@ -33,3 +33,12 @@ try:
   from xml.etree import cElementTree
 except ImportError:
   from compat import cElementTree
+
+
+try:
+  from os import scandir
+except ImportError:
+  try:
+    from scandir import scandir
+  except ImportError:
+    scandir = None
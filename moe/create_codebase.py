@@ -66,4 +66,5 @@ class CreateCodebaseCmd(appcommands.Cmd):
 
       moe_app.RUN.ui.Info('Codebase created at %s' % translated_codebase.Path())
     finally:
+      project.Close()
       project.db.Disconnect()
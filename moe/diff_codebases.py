@@ -7,6 +7,8 @@
 
 
 
+import multiprocessing
+
 from google.apputils import app
 from google.apputils import appcommands
 import gflags as flags
@@ -27,6 +29,10 @@ def DefineFlags(flag_values):
                        'The public revision to diff against.',
                        flag_values=flag_values)
 
+  flags.DEFINE_integer('diff_jobs', multiprocessing.cpu_count(),
+                       'How many files to compare at once.',
+                       flag_values=flag_values)
+
 
 def main(unused_argv):
   project = db_client.MakeProjectContext()
@@ -41,10 +47,12 @@ def main(unused_argv):
         internal_codebase,
         public_codebase,
         project.config.noisy_files_re,
-        record_full_diffs=True)
+        record_full_diffs=True,
+        jobs=FLAGS.diff_jobs)
     moe_app.RUN.ui.Info('\n===== Begin diff_codebases =====\n')
     moe_app.RUN.ui.Info(str(diff_obj))
   finally:
+    project.Close()
     project.db.Disconnect()
 
 
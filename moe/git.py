@@ -5,25 +5,103 @@
 
 
 
+import collections
+import cStringIO
+import fcntl
+import hashlib
+import json as simplejson
 import os
 import re
 import shutil
+import subprocess
+import tempfile
+import threading
+import time
 
 from google.apputils import file_util
+import gflags as flags
 
 from moe import base
 from moe import codebase_utils
 from moe import moe_app
 
+FLAGS = flags.FLAGS
+
+flags.DEFINE_boolean('git_lazy_codebases', False,
+                     'Whether to read git codebases straight out of the '
+                     'repository, writing files to disk only as they are '
+                     'needed, instead of exporting whole revisions.')
+
 ID_LENGTH = 12
 
+# How many commits to list at a time when walking history.
+LOG_PAGE_SIZE = 100
+
+# What git log prints of each commit (with -z): its id, author's email, date
+# and message, NUL-separated.
+_LOG_FORMAT = '%H%x00%ae%x00%ad%x00%B'
+_LOG_FIELDS = 4
+
+# The modes of tree entries for symlinks and submodules.
+_SYMLINK_MODE = '120000'
+_SUBMODULE_MODE = '160000'
+
+# How much of an object to copy at a time.
+_COPY_CHUNK_SIZE = 64 * 1024
+
+
+class GitMirror(object):
+  """A bare mirror of a git repository, kept between runs.
+
+  Updating it only fetches what's new upstream, and clients are cloned from it
+  locally instead of from the repository.
+  """
+
+  def __init__(self, mirror_root, repository_url):
+    """Construct.
+
+    Args:
+      mirror_root: str, the directory mirrors are kept in
+      repository_url: str, the url of the repository to mirror
+    """
+    self.repository_url = repository_url
+    self._path = os.path.join(
+        mirror_root, hashlib.sha1(repository_url).hexdigest() + '.git')
+    self._updated = False
+
+  def Path(self):
+    """Return the directory of the mirror."""
+    return self._path
+
+  def Update(self):
+    """Create the mirror, or fetch into it, once per run."""
+    if self._updated:
+      return
+    base.MakeDir(os.path.dirname(self._path))
+    # Runs sharing the mirror take turns updating it.
+    with open(self._path + '.lock', 'w') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      if os.path.exists(self._path):
+        print 'Fetching %s into %s' % (self.repository_url, self._path)
+        RunGit(['fetch', '--prune', '--quiet', 'origin'], cwd=self._path,
+               lock_key=self._path)
+      else:
+        print 'Mirroring %s into %s' % (self.repository_url, self._path)
+        # Clone beside the mirror, so an interrupted clone isn't mistaken for
+        # one.
+        scratch = self._path + '.cloning'
+        shutil.rmtree(scratch, ignore_errors=True)
+        RunGit(['clone', '--mirror', '--quiet', self.repository_url, scratch])
+        os.rename(scratch, self._path)
+    self._updated = True
+
 
 class GitClient(base.CodebaseClient):
   """Implementation for Git-stored codebases."""
 
   def __init__(self, temp_dir, repository_url, branch='',
                gerrit_autoapprove=False, gerrit_needs_verify=False,
-               review_thread_url=None):
+               review_thread_url=None, mirror=None, subdirectory=''):
     """Create GitClient.
 
     Git supports several transports: ssh:// is used with an ssh-agent and the
@@ -42,8 +120,12 @@ class GitClient(base.CodebaseClient):
                            configs exclude this from the workflow, and
                            attempting to tag as verified will fail.
       review_thread_url: The review thread URL with ${REVI_ID} as placeholder.
+      mirror: GitMirror, a mirror of repository_url to clone from, if any
+      subdirectory: str, the directory in the repository that holds the
+                    codebase, if not its root
     """
     self.repository_url = repository_url
+    self.mirror = mirror
     self.branch = branch
     self.gerrit_autoapprove = gerrit_autoapprove
     self.gerrit_needs_verify = gerrit_needs_verify
@@ -71,6 +153,9 @@ class GitClient(base.CodebaseClient):
     checkout = os.path.join(temp_dir, 'git')
 
     self.checkout = os.path.abspath(checkout)
+    # Where the codebase is in the checkout.
+    self.codebase_root = os.path.join(self.checkout, subdirectory).rstrip('/')
+    self.subdirectory = subdirectory
 
   def Checkout(self):
     """Obtain a local copy of the code tree."""
@@ -81,14 +166,24 @@ class GitClient(base.CodebaseClient):
       # in the directory.
       # Ensure checkout directory is empty
       base.RunCmd('rm', ['-rf', self.checkout])
-      args = ['clone', self.repository_url]
+      args = ['clone']
+      if self.mirror:
+        # Borrow the mirror's objects rather than copying them.
+        args += ['--shared', self.mirror.Path()]
+      else:
+        args += [self.repository_url]
       if self.branch:
         args += ['-b', self.branch]
       args += [self.checkout]
       self.checked_out = True
       try:
+        if self.mirror:
+          self.mirror.Update()
         RunGit(args, cwd=os.path.dirname(self.checkout),
                unhook_stdout_and_err=True)
+        if self.mirror:
+          RunGit(['remote', 'set-url', 'origin', self.repository_url],
+                 cwd=self.checkout)
       except base.CmdError as e:
         raise base.Error('Failed to clone git repository: ' + str(e))
       print 'Checked out.'
@@ -100,6 +195,9 @@ class GitClient(base.CodebaseClient):
 
   def GetHeadRevision(self, highest_rev_id=''):
     """Return the ID of the latest branch revision, or None if unfound."""
+    if not highest_rev_id and not self.checked_out:
+      # Asking the repository is enough; there's no need to clone it.
+      return self._RemoteHeadRevision()
 
     args = ['rev-list', '--max-count=1', '--abbrev-commit',
             '--abbrev=' + str(ID_LENGTH)]
@@ -112,7 +210,8 @@ class GitClient(base.CodebaseClient):
     else:
       args += ['HEAD']
     try:
-      log = self.RunGit(args, need_stdout=True)
+      git_dir, _ = self.HistoryDir()
+      log = RunGit(args, cwd=git_dir, need_stdout=True)
     except base.CmdError:
       return None
     for line in log.split('\n'):
@@ -120,11 +219,56 @@ class GitClient(base.CodebaseClient):
         return line
     return None
 
+  def _RemoteHeadRevision(self):
+    """Return the ID of the branch's head in the repository, or None."""
+    ref = 'refs/heads/' + self.branch if self.branch else 'HEAD'
+    try:
+      output = RunGit(['ls-remote', self.repository_url, ref],
+                      need_stdout=True)
+    except base.CmdError:
+      return None
+    for line in output.splitlines():
+      commit, _, name = line.partition('\t')
+      if name == ref:
+        return commit[:ID_LENGTH]
+    return None
+
   def RunGit(self, args, **kwargs):
     self.Checkout()
     kwargs['cwd'] = self.checkout
     return RunGit(args, **kwargs)
 
+  def HistoryDir(self):
+    """Where to read the repository's history from, without changing it.
+
+    That's the mirror, unless the client is already checked out (and so
+    may have commits of its own).
+
+    Returns:
+      (str, the git directory; str, the ref of the branch's head in it)
+    """
+    if self.mirror and not self.checked_out:
+      self.mirror.Update()
+      return (self.mirror.Path(),
+              'refs/heads/' + self.branch if self.branch else 'HEAD')
+    self.Checkout()
+    return (self.checkout, 'HEAD')
+
+  def Export(self, directory, revision=''):
+    """Export the codebase at revision (or head) into directory.
+
+    git archive's output is piped straight into tar, from the mirror if the
+    client isn't checked out.
+    """
+    git_dir, head = self.HistoryDir()
+    tree = revision or head
+    if self.subdirectory:
+      tree += ':' + self.subdirectory
+    base.MakeDir(directory)
+    base.RunPipe(('git', ['archive', '--format=tar', tree]),
+                 ('tar', ['-x', '-C', os.path.abspath(directory)]),
+                 cwd=git_dir)
+
   def MakeEditor(self, migration_strategy, revisions=None):
     """Make an editor for this client."""
     return GitEditor(self, migration_strategy=migration_strategy,
@@ -159,17 +303,27 @@ class GitEditor(base.CodebaseEditor):
     self._modified = None
     self._diff = None
     self._commit_message = ''
+    # Files PutFile changed, whose index entries FinalizeChange updates.
+    self._unstaged = []
+    self._files = base.ClientFiles(client.codebase_root, self._ListFiles,
+                                   re.compile(r'^\.git'))
 
   def Checkout(self):
     """Check out code."""
     self.client.Checkout()
 
   def Walk(self):
-    """Walks the client for existent files. Generates str's."""
+    """Walks the client for existent files. Returns a list of str's."""
     # TODO(dbentley): obey additional_files_re
-    # TODO(user): Ignore ^\.git$ directory by default, and possibly other
-    # .git files.
-    return base.ListFiles(self.client.checkout, re.compile(r'^\.git'))
+    return self._files.Files()
+
+  def _ListFiles(self, include_untracked):
+    """List the files in the index (and untracked ones, if asked)."""
+    args = ['ls-files', '-z', '--cached']
+    if include_untracked:
+      args += ['--others', '--exclude-standard']
+    return base.SplitNulTerminated(
+        self.RunGit(args, cwd=self.client.codebase_root, need_stdout=True))
 
   def PutFile(self, relative_dest, src):
     """Update relative_dest with src.
@@ -181,33 +335,54 @@ class GitEditor(base.CodebaseEditor):
     NB: Copies the file, and also important metadata (e.g. the execute bit).
     If src doesn't exist, then to make destination be source, we delete it.
     """
-    abs_dest = os.path.join(self.client.checkout, relative_dest)
+    abs_dest = os.path.join(self.client.codebase_root, relative_dest)
     src_exists = os.path.exists(src)
+    src_executable = base.IsExecutable(src)
     dest_exists = os.path.exists(abs_dest)
-
-    # Git handles executable bit automagically
-    # src_executable = base.IsExecutable(src)
-    # dest_executable = base.IsExecutable(abs_dest)
+    dest_executable = base.IsExecutable(abs_dest)
 
     if not src_exists and not dest_exists:
       raise base.Error('Neither src nor dest exists. Unreachable code.')
     if not src_exists:
-      self.RunGit(['rm', relative_dest])
+      os.remove(abs_dest)
+      self._unstaged.append(relative_dest)
+      self._files.Remove(relative_dest)
       # Git considers directories to derive from file-paths: No files under a
       # directory means git doesn't believe that directory exists, so empty
-      # directories are 'magically deleted'.
+      # directories are 'magically deleted'. Like git rm, remove them here too,
+      # up to (but not including) the codebase's root.
+      directory = os.path.dirname(relative_dest)
+      while directory:
+        try:
+          os.rmdir(os.path.join(self.client.codebase_root, directory))
+        except OSError:
+          break
+        directory = os.path.dirname(directory)
       return
 
     # Update/create the file
     base.MakeDir(os.path.dirname(abs_dest))
 
-    # NB(dbentley): copy instead of copyfile to copy permission bits
-    # (specifically executable, which git tracks, whereas svn
-    #  requires manual property management)
-    shutil.copy(src, abs_dest)
-
-    # Add both new files and modifications to index
-    self.RunGit(['add', relative_dest])
+    # Copy only the contents: src may be a read-only blob, whose mode must not
+    # reach the client. The executable bit, which git tracks, is set apart.
+    shutil.copyfile(src, abs_dest)
+    if src_executable != dest_executable:
+      if src_executable:
+        base.SetExecutable(abs_dest)
+      else:
+        base.SetNotExecutable(abs_dest)
+
+    # Add both new files and modifications to index, at FinalizeChange
+    self._unstaged.append(relative_dest)
+    self._files.Add(relative_dest)
+
+  def _StageChanges(self):
+    """Update the index for every file PutFile changed, in one command."""
+    if self._unstaged:
+      self.RunGit(['update-index', '--add', '--remove', '-z', '--stdin'],
+                  cwd=self.client.codebase_root,
+                  stdin_data=''.join(f + '\0' for f in self._unstaged))
+      self._unstaged = []
 
   def ChangesMade(self):
     if self._modified is None:
@@ -216,6 +391,7 @@ class GitEditor(base.CodebaseEditor):
 
   def FinalizeChange(self, commit_message, report):
     """Describe the state we're in."""
+    self._StageChanges()
     self._commit_message = commit_message
     msg_filename = os.path.join(self.client.checkout, '.git-commit.tmp')
     if os.path.exists(msg_filename):
@@ -300,10 +476,10 @@ class GitEditor(base.CodebaseEditor):
 
   def Root(self):
     """Return a path that's the conceptual root of the codebase."""
-    return self.client.checkout
+    return self.client.codebase_root
 
   def RunGit(self, args, **kwargs):
-    kwargs['cwd'] = self.client.checkout
+    kwargs.setdefault('cwd', self.client.checkout)
     return RunGit(args, **kwargs)
 
   def RunGerrit(self, args, **kwargs):
@@ -329,34 +505,65 @@ class GitRepository(base.SourceControlRepository):
   """A Git repository."""
 
   def __init__(self, repository_url, name, branch, gerrit_autoapprove,
-               gerrit_needs_verify, review_thread_url=None):
+               gerrit_needs_verify, review_thread_url=None, subdirectory=''):
     self._url = repository_url
     self._name = name
     self._branch = branch
     self._gerrit_autoapprove = gerrit_autoapprove
     self._gerrit_needs_verify = gerrit_needs_verify
     self._review_thread_url = review_thread_url
+    mirror_dir = moe_app.GitMirrorDirFromFlags()
+    mirror = mirror_dir and GitMirror(mirror_dir, repository_url)
     self._client = GitClient(moe_app.RUN.temp_dir, repository_url,
                              branch=branch,
                              gerrit_autoapprove=gerrit_autoapprove,
                              gerrit_needs_verify=gerrit_needs_verify,
-                             review_thread_url=review_thread_url)
+                             review_thread_url=review_thread_url,
+                             mirror=mirror, subdirectory=subdirectory)
+    # Kept next to the mirror, since they share a lifetime.
+    self._revision_cache = RevisionCache(
+        mirror and mirror.Path() + '.revisions')
+    # git directory -> CatFileBatch, shared by this repository's codebases.
+    self._cat_files = {}
+    self._cat_files_lock = threading.Lock()
+    self._blob_dir = None
 
   def Export(self, directory, revision=''):
     """Export repository at revision into directory."""
-    if not os.path.exists(directory):
-      os.makedirs(directory)
-    tar_file = os.path.join(directory, '.e.git.tar')
-    args = ['archive', '-o', tar_file]
-    if revision:
-      args += [revision]
-    else:
-      args += ['HEAD']
-    self._client.RunGit(args)
+    self._client.Export(directory, revision)
 
-    # This would be much better as a pipe.
-    base.RunCmd('tar', ['xf', tar_file, '--directory', directory])
-    os.remove(os.path.join(directory, tar_file))
+  def MakeCodebase(self, revision='', **kwargs):
+    """Make a GitTreeCodebase of revision (or head), exporting nothing.
+
+    Args:
+      revision: str, the revision
+      kwargs: passed to the Codebase
+
+    Returns:
+      GitTreeCodebase
+    """
+    with self._cat_files_lock:
+      if not self._blob_dir:
+        self._blob_dir = tempfile.mkdtemp(dir=moe_app.RUN.temp_dir,
+                                          prefix='git_blobs_')
+    return GitTreeCodebase(self._client, revision, self._CatFile,
+                           self._blob_dir,
+                           client_creator=lambda: self._client,
+                           rev_id=revision, **kwargs)
+
+  def _CatFile(self, git_dir):
+    """Return the CatFileBatch reading objects from git_dir."""
+    with self._cat_files_lock:
+      if git_dir not in self._cat_files:
+        self._cat_files[git_dir] = CatFileBatch(git_dir)
+      return self._cat_files[git_dir]
+
+  def Close(self):
+    """Stop the git processes this repository's codebases read through."""
+    with self._cat_files_lock:
+      for cat_file in self._cat_files.itervalues():
+        cat_file.Close()
+      self._cat_files.clear()
 
   def MakeClient(self, unused_directory, username='', password=''):
     (username, password) = (username, password)  # Silence gpylint
@@ -396,34 +603,330 @@ class GitRepository(base.SourceControlRepository):
     Returns:
       List of revisions.
     """
-    # Newest appears first
-    # TODO(user): Something like
-    #   git log -400 --pretty=format:"%H%n%ae%n%cd%n%s%n>>>>END_OF_DESCRIPTION
-    # would make parsing of the log a lot easier. Change to that!
-    args = ['log', '--format=medium',
-            '-' + str(limit),
-            '--no-decorate',  # no branch names
-            '--abbrev-commit', '--abbrev=' + str(ID_LENGTH)]
-    if head_revision:
-      args += [head_revision]
-    else:
-      args += ['HEAD']
-    text = self._client.RunGit(args, need_stdout=True)
-    return ParseRevisions(text, self._name, self._review_thread_url)
+    return list(self._Revisions(head_revision, limit=limit))
+
+  def _Revisions(self, head_revision, limit=None):
+    """Generate the revisions in head_revision's history, newest first.
+
+    One rev-list lists the commit ids; those the revision cache doesn't know
+    yet are read with git log a page at a time, as they are reached.
+
+    Args:
+      head_revision: str, id of the revision to consider head, or None.
+      limit: int, the most revisions to generate, or None for all of them.
+    """
+    git_dir, head = self._client.HistoryDir()
+    args = ['rev-list']
+    if limit is not None:
+      args.append('--max-count=%d' % limit)
+    commit_ids = RunGit(args + [head_revision or head],
+                        cwd=git_dir, need_stdout=True).split()
+    for start in xrange(0, len(commit_ids), LOG_PAGE_SIZE):
+      page = commit_ids[start:start + LOG_PAGE_SIZE]
+      unknown = [c for c in page if not self._revision_cache.Get(c)]
+      if unknown:
+        self._revision_cache.Add(ParseLog(RunGit(
+            ['log', '--no-walk=unsorted', '--stdin', '-z',
+             '--format=' + _LOG_FORMAT],
+            cwd=git_dir, need_stdout=True,
+            stdin_data=''.join(c + '\n' for c in unknown))))
+      for commit_id in page:
+        commit_id, author, date, message = self._revision_cache.Get(commit_id)
+        yield GitRevision(rev_id=commit_id[:ID_LENGTH],
+                          repository_name=self._name,
+                          time=date,
+                          author=author,
+                          changelog=message,
+                          review_thread_url=self._review_thread_url)
 
   def MakeRevisionFromId(self, rev_id):
     return base.Revision(rev_id=rev_id, repository_name=self._name)
 
   def RecurUntilMatchingRevision(self, starting_revision, matcher):
-    limit = 400
-    revisions = self.RetrieveGitLog(limit, starting_revision)
     result = []
-    for r in revisions:
+    for r in self._Revisions(starting_revision):
       result.append(r)
       if matcher(r):
         return result
 
-    raise base.Error('Could not find equivalence in %d revisions.' % limit)
+    raise base.Error('Could not find equivalence in %d revisions.' %
+                     len(result))
+
+
+class RevisionCache(object):
+  """What git log says of commits, by commit id.
+
+  Commits never change, so this never goes stale. If it has a file, what it
+  learns is appended there, to be known in later runs too.
+  """
+
+  def __init__(self, path=None):
+    """Construct.
+
+    Args:
+      path: str, the file to keep commits in between runs, if any
+    """
+    self._path = path
+    self._commits = None
+
+  def _Commits(self):
+    if self._commits is None:
+      self._commits = {}
+      if self._path and os.path.exists(self._path):
+        with open(self._path) as f:
+          for line in f:
+            try:
+              commit = simplejson.loads(line)
+            except ValueError:
+              # E.g. a line cut short by an interrupted run.
+              continue
+            self._commits[commit[0]] = commit
+    return self._commits
+
+  def Get(self, commit_id):
+    """Return (id, author, date, message) of commit_id, or None if unknown."""
+    return self._Commits().get(commit_id)
+
+  def Add(self, commits):
+    """Remember commits, a list of (id, author, date, message)."""
+    self._Commits().update((commit[0], commit) for commit in commits)
+    if self._path and commits:
+      # One write per batch, so runs appending at once don't interleave lines.
+      with open(self._path, 'a') as f:
+        f.write(''.join(simplejson.dumps(list(commit)) + '\n'
+                        for commit in commits))
+
+
+def ParseLog(log):
+  """Split the output of git log -z --format=_LOG_FORMAT into commits.
+
+  Args:
+    log: str
+
+  Returns:
+    list of (id, author, date, message)
+  """
+  fields = log.split('\0')
+  if fields and not fields[-1]:
+    fields.pop()
+  return [(commit_id, author, date, message.rstrip('\n'))
+          for commit_id, author, date, message in zip(
+              *[iter(fields)] * _LOG_FIELDS)]
+
+
+class CatFileBatch(object):
+  """A long-lived git cat-file --batch, to read many objects with one process.
+
+  It's started when the first object is read, and reads objects one at a time.
+  """
+
+  def __init__(self, git_dir):
+    """Construct.
+
+    Args:
+      git_dir: str, the git directory (or checkout) to read objects from
+    """
+    self._git_dir = git_dir
+    self._lock = threading.Lock()
+    self._process = None
+    self._start = None
+    self._bytes_read = 0
+
+  def Copy(self, object_id, output):
+    """Write the contents of object_id to output, a file object.
+
+    Each read takes a base.CMD_EXECUTOR slot, with the git directory as its
+    lock key, like the git commands run in that directory.
+    """
+    with self._lock, base.CMD_EXECUTOR.Slot(lock_key=self._git_dir):
+      if not self._process:
+        self._start = time.time()
+        self._process = subprocess.Popen(
+            ['git', 'cat-file', '--batch'], cwd=self._git_dir,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+      self._process.stdin.write(str(object_id) + '\n')
+      self._process.stdin.flush()
+      # <id> <type> <size>, or <id> missing.
+      header = self._process.stdout.readline().split()
+      if len(header) != 3:
+        raise base.Error('git cat-file could not read %s in %s: %s' %
+                         (object_id, self._git_dir, ' '.join(header)))
+      remaining = int(header[2])
+      while remaining:
+        chunk = self._process.stdout.read(min(remaining, _COPY_CHUNK_SIZE))
+        if not chunk:
+          raise base.Error('git cat-file stopped while reading %s in %s' %
+                           (object_id, self._git_dir))
+        output.write(chunk)
+        remaining -= len(chunk)
+      self._bytes_read += int(header[2])
+      # The contents are followed by a newline.
+      self._process.stdout.read(1)
+
+  def Close(self):
+    """Stop the process, recording it as one command in base.CMD_TRACER."""
+    with self._lock:
+      if not self._process:
+        return
+      self._process.stdin.close()
+      self._process.wait()
+      base.CMD_TRACER.Record(base.CmdTrace(
+          'git', ['cat-file', '--batch'], self._git_dir,
+          base.CMD_TRACER.CurrentTask(), time.time() - self._start,
+          self._bytes_read, 0, self._process.returncode))
+      self._process = None
+
+
+class GitTreeCodebase(codebase_utils.Codebase):
+  """A Codebase read straight out of a git repository, without exporting it.
+
+  Walk lists the revision's tree with one git ls-tree. FilePath writes just the
+  file asked for, read through a CatFileBatch. Each blob is read once into a
+  directory shared with the repository's other codebases, and files are
+  read-only hardlinks to it; WritableFilePath gives a file its own copy.
+  ExpandedPath writes everything.
+  """
+
+  def __init__(self, client, revision, cat_file_fn, blob_dir, **kwargs):
+    """Construct.
+
+    Args:
+      client: GitClient, the client of the repository
+      revision: str, the revision, or '' for head
+      cat_file_fn: function(str) -> CatFileBatch, the CatFileBatch reading
+                   objects from a git directory
+      blob_dir: str, the directory to keep the blobs read in
+      kwargs: passed to codebase_utils.Codebase
+    """
+    codebase_utils.Codebase.__init__(
+        self, '%s@%s' % (client.repository_url, revision or 'head'), **kwargs)
+    self._client = client
+    self._revision = revision
+    self._cat_file_fn = cat_file_fn
+    self._blob_dir = blob_dir
+    self._cat_file = None
+    self._extraction_dir = None
+    # relative filename -> (mode, object id), in the tree's order.
+    self._entries = None
+    self._written = set()
+    # Guards everything above; codebases may be read from several threads.
+    self._lock = threading.Lock()
+
+  def Walk(self):
+    """Return the files in the Codebase.
+
+    Returns:
+      seq of str, the relative filenames in this Codebase
+    """
+    with self._lock:
+      self._Index()
+      return [f for f, (mode, _) in self._entries.iteritems()
+              if mode != _SUBMODULE_MODE and
+              not (self._additional_files_re and
+                   self._additional_files_re.search(f))]
+
+  def FilePath(self, relative_filename):
+    with self._lock:
+      self._Index()
+      entry = self._entries.get(relative_filename)
+      if entry and entry[0] == _SYMLINK_MODE:
+        # Its target needs writing too; just write everything.
+        self._WriteAll()
+      elif entry:
+        self._Write(relative_filename)
+    return os.path.join(self._extraction_dir, relative_filename)
+
+  def ExpandedPath(self):
+    with self._lock:
+      self._Index()
+      self._WriteAll()
+    return self._extraction_dir
+
+  def _Index(self):
+    """List the revision's tree, if not done already."""
+    if self._entries is not None:
+      return
+    git_dir, head = self._client.HistoryDir()
+    self._cat_file = self._cat_file_fn(git_dir)
+    tree = self._revision or head
+    if self._client.subdirectory:
+      tree += ':' + self._client.subdirectory
+    listing = RunGit(['ls-tree', '-r', '-z', tree], cwd=git_dir,
+                     need_stdout=True)
+    self._entries = collections.OrderedDict()
+    for line in base.SplitNulTerminated(listing):
+      # <mode> SP <type> SP <object id> TAB <path>, the path as the bytes
+      # other codebases' filenames are.
+      info, _, path = base.EncodeFilename(line).partition('\t')
+      mode, _, object_id = info.split(' ')
+      self._entries[path] = (mode, object_id)
+    self._extraction_dir = os.path.abspath(tempfile.mkdtemp(
+        dir=moe_app.RUN.temp_dir, prefix='codebase_'))
+
+  def _Write(self, relative_filename):
+    """Write relative_filename into the extraction dir, if not done already."""
+    if relative_filename in self._written:
+      return
+    mode, object_id = self._entries[relative_filename]
+    if mode == _SUBMODULE_MODE:
+      # Like git archive, leave submodules out.
+      return
+    path = os.path.join(self._extraction_dir, relative_filename)
+    base.MakeDir(os.path.dirname(path))
+    if mode == _SYMLINK_MODE:
+      target = cStringIO.StringIO()
+      self._cat_file.Copy(object_id, target)
+      os.symlink(target.getvalue(), path)
+    else:
+      blob = self._Blob(object_id, mode)
+      try:
+        os.link(blob, path)
+      except OSError:
+        shutil.copy2(blob, path)
+        os.chmod(path, int(mode[-3:], 8))
+    self._written.add(relative_filename)
+
+  def _WriteAll(self):
+    for relative_filename in self._entries:
+      self._Write(relative_filename)
+
+  def _Blob(self, object_id, mode):
+    """Return the path of a file with object_id's contents and mode."""
+    # Files with the same contents but different modes can't share a blob.
+    blob = os.path.join(self._blob_dir, '%s.%s' % (object_id, mode[-3:]))
+    if not os.path.exists(blob):
+      fd, temp_path = tempfile.mkstemp(dir=self._blob_dir, prefix='.reading_')
+      with os.fdopen(fd, 'wb') as output:
+        self._cat_file.Copy(object_id, output)
+      # Read-only, since every codebase's copy of the file is this file.
+      os.chmod(temp_path, int(mode[-3:], 8) & ~0222)
+      os.rename(temp_path, blob)
+    return blob
+
+
+class GitTreeCodebaseCreator(codebase_utils.CodebaseCreator):
+  """CodebaseCreator that makes GitTreeCodebases, instead of exporting."""
+
+  def __init__(self, repository, additional_files_re=None, repository_name='',
+               project_space=base.PUBLIC_STR):
+    codebase_utils.CodebaseCreator.__init__(self,
+                                            repository_name=repository_name,
+                                            project_space=project_space)
+    self._repository = repository
+    self._additional_files_re = additional_files_re
+
+  def Create(self, revision=''):
+    """Make a Codebase of revision (or head) of the repository.
+
+    Args:
+      revision: str, the revision
+
+    Returns:
+      GitTreeCodebase
+    """
+    return self._repository.MakeCodebase(
+        revision, additional_files_re=self._additional_files_re,
+        project_space=self._project_space)
 
 
 def RunGit(args, **kwargs):
@@ -442,49 +945,6 @@ def RunGit(args, **kwargs):
   return base.RunCmd('git', args, **kwargs)
 
 
-COMMIT_RE = re.compile('^commit\s*([0-9a-f]{' + str(ID_LENGTH) + '})$')
-AUTHOR_RE = re.compile('^Author:.*[\s<]([^\s<>]+@[^\s<>]+).*$')
-DATE_RE = re.compile('^Date:\d*(.*)$')
-
-
-def ParseRevisions(log, repository_name, review_thread_url=None):
-  """Extract separate revisions out of the output of a verbose git log call."""
-  result = []
-  description_lines = []
-  rev_id = None
-  time = None
-  author = None
-  for line in log.splitlines():
-    if COMMIT_RE.match(line):
-      if rev_id:
-        result.append(GitRevision(
-            rev_id=rev_id,
-            repository_name=repository_name,
-            time=time,
-            author=author,
-            changelog='\n'.join(description_lines),
-            review_thread_url=review_thread_url))
-        rev_id = None
-        time = None
-        author = None
-        description_lines = []
-      rev_id = COMMIT_RE.match(line).group(1)
-    elif AUTHOR_RE.match(line):
-      author = AUTHOR_RE.match(line).group(1)
-    elif DATE_RE.match(line):
-      time = DATE_RE.match(line).group(1).strip()
-    else:
-      description_lines.append(line)
-  if rev_id:
-    result.append(GitRevision(
-        rev_id=rev_id,
-        repository_name=repository_name,
-        time=time,
-        author=author,
-        changelog='\n'.join(description_lines),
-        review_thread_url=review_thread_url))
-  return result
-
 def GitRevision(rev_id, repository_name, time, author, changelog,
                      review_thread_url=None):
   """Generate Git-specific information for the revision.
@@ -523,6 +983,7 @@ class GitRepositoryConfig(base.RepositoryConfig):
     self.gerrit_autoapprove = config_json.get('gerrit_autoapprove') == 'True'
     self.gerrit_needs_verify = config_json.get('gerrit_needs_verify') == 'True'
     self.review_thread_url = config_json.get('review_thread_url')
+    self.subdirectory = config_json.get('subdirectory', '')
     self.additional_files_re = config_json.get('additional_files_re')
     self._config_json = config_json
     if repository_name:
@@ -537,9 +998,14 @@ class GitRepositoryConfig(base.RepositoryConfig):
                                self.branch,
                                self.gerrit_autoapprove,
                                self.gerrit_needs_verify,
-                               review_thread_url=self.review_thread_url)
+                               review_thread_url=self.review_thread_url,
+                               subdirectory=self.subdirectory)
+    if FLAGS.git_lazy_codebases:
+      creator_class = GitTreeCodebaseCreator
+    else:
+      creator_class = codebase_utils.ExportingCodebaseCreator
     return (repository,
-            codebase_utils.ExportingCodebaseCreator(
+            creator_class(
                 repository,
                 repository_name=self._repository_name,
                 additional_files_re=self.additional_files_re,
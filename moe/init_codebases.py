@@ -182,6 +182,7 @@ def main(unused_argv):
     context.InitializeProject()
     moe_app.RUN.report.PrintSummary()
   finally:
+    project.Close()
     project.db.Disconnect()
 
 
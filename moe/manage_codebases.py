@@ -489,7 +489,9 @@ def main(unused_argv):
 
     return context.return_code
   finally:
+    project.Close()
     project.db.Disconnect()
+    moe_app.RUN.ui.Info('\n'.join(base.CMD_TRACER.SummaryLines()))
 
 
 class AutoCmd(appcommands.Cmd):
@@ -114,15 +114,35 @@ class MercurialEditor(base.CodebaseEditor):
     self._modified = None
     self._diff = None
     self._commit_message = ''
+    # Files PutFile deleted and added, which FinalizeChange tells hg about.
+    self._removed = []
+    self._added = []
+    self._files = base.ClientFiles(client.checkout, self._ListFiles,
+                                   re.compile(r'^\.hg'))
 
   def Checkout(self):
     """Check out code."""
     self.client.Checkout()
 
   def Walk(self):
-    """Walks the client for existent files. Generates str's."""
+    """Walks the client for existent files. Returns a list of str's."""
     # TODO(dbentley): obey additional_files_re
-    return base.ListFiles(self.client.checkout, re.compile(r'\.hg'))
+    return self._files.Files()
+
+  def _ListFiles(self, include_untracked):
+    """List the tracked files (and untracked ones, if asked)."""
+    try:
+      files = base.SplitNulTerminated(
+          self.RunHg(['files', '-0'], need_stdout=True))
+    except base.CmdError, e:
+      # hg files exits 1 when there are no files to list.
+      if e.returncode != 1:
+        raise
+      files = []
+    if include_untracked:
+      files += base.SplitNulTerminated(self.RunHg(
+          ['status', '--unknown', '--no-status', '-0'], need_stdout=True))
+    return files
 
   def PutFile(self, relative_dest, src):
     """Make relative_dest be src.
@@ -144,7 +164,8 @@ class MercurialEditor(base.CodebaseEditor):
       raise base.Error('Neither src nor dest exists. Unreachable code.')
     if not src_exists:
       # We need to delete this file.
-      self.RunHg(['rm', relative_dest])
+      self._removed.append(relative_dest)
+      self._files.Remove(relative_dest)
 
       # TODO(dbentley): handle newly-empty directories
       # NB(dbentley): mercurial doesn't manage directories, so this might
@@ -154,13 +175,27 @@ class MercurialEditor(base.CodebaseEditor):
     # Update/create the file
     base.MakeDir(os.path.dirname(abs_dest))
 
-    # NB(dbentley): copy instead of copyfile to copy permission bits
-    # (specifically executable, which mercurial tracks, whereas svn
-    #  requires manual property management)
-    shutil.copy(src, abs_dest)
+    # Copy only the contents: src may be a read-only blob, whose mode must not
+    # reach the client. The executable bit, which mercurial tracks, is set apart.
+    shutil.copyfile(src, abs_dest)
+    if src_executable != dest_executable:
+      if src_executable:
+        base.SetExecutable(abs_dest)
+      else:
+        base.SetNotExecutable(abs_dest)
 
     if not dest_exists:
-      self.RunHg(['add', relative_dest])
+      self._added.append(relative_dest)
+      self._files.Add(relative_dest)
+
+  def _AddAndRemove(self):
+    """Run hg rm and hg add on the files PutFile queued, once each."""
+    for command, files in [('rm', self._removed), ('add', self._added)]:
+      if files:
+        with base.ListFile(files, separator='\0') as list_file:
+          self.RunHg([command, 'listfile0:' + list_file])
+    self._removed = []
+    self._added = []
 
   def ChangesMade(self):
     if self._modified is None:
@@ -169,6 +204,7 @@ class MercurialEditor(base.CodebaseEditor):
 
   def FinalizeChange(self, commit_message, report):
     """Describe the state we're in."""
+    self._AddAndRemove()
     self._commit_message = commit_message
     msg_filename = os.path.join(self.client.checkout, 'hg-commit.tmp')
     if os.path.exists(msg_filename):
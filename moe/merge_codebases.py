@@ -22,11 +22,15 @@ Returns non-zero if unsuccessful merges.
 
 __author__ = 'dbentley@google.com (Dan Bentley)'
 
+import collections
+import multiprocessing
+from multiprocessing import pool
 import os
 import shutil
 import subprocess
 import sys
 import tempfile
+import time
 
 from google.apputils import app
 import gflags as flags
@@ -37,6 +41,540 @@ from moe import moe_app
 
 FLAGS = flags.FLAGS
 
+# Merge engines enumeration
+BUILTIN_ENGINE = 'builtin'
+RCS_ENGINE = 'rcs'
+
+MERGE_ENGINES = [BUILTIN_ENGINE, RCS_ENGINE]
+
+flags.DEFINE_enum('merge_engine', BUILTIN_ENGINE, MERGE_ENGINES,
+                  'How to merge files: in-process (builtin), or with RCS '
+                  'merge(1) (rcs).')
+flags.DEFINE_integer('merge_jobs', multiprocessing.cpu_count(),
+                     'How many files to merge at once.')
+
+
+# diff3 runs diff with this many lines of context around each difference for
+# it to shift hunks into (its --horizon-lines).
+_HORIZON_LINES = 100
+
+
+def _DiscardConfusingLines(equivs, other_counts):
+  """Which lines GNU diff leaves out of its search for the longest match.
+
+  Lines that don't occur in the other file can't match, and lines that occur
+  in it very often mostly mislead. GNU diff drops both before searching, but
+  keeps the frequent ones that sit among lines that are kept anyway.
+
+  Args:
+    equivs: list of int, the equivalence class of each line of a file
+    other_counts: dict of int -> int, how often each class occurs in the
+                  other file
+
+  Returns:
+    list of bool, whether each line is left out (and so is changed)
+  """
+  end = len(equivs)
+  many = 5
+  tem = end // 64
+  while True:
+    tem >>= 2
+    if tem <= 0:
+      break
+    many *= 2
+
+  # 1 means the line doesn't occur in the other file, 2 that it's frequent.
+  discards = []
+  for e in equivs:
+    count = other_counts.get(e, 0)
+    discards.append(1 if not count else 2 if count > many else 0)
+
+  i = 0
+  while i < end:
+    if discards[i] == 2:
+      discards[i] = 0
+    elif discards[i]:
+      # Find the end of this run of discardable lines, and how many of them
+      # are only provisionally so.
+      provisional = 0
+      j = i
+      while j < end and discards[j]:
+        if discards[j] == 2:
+          provisional += 1
+        j += 1
+      # Provisional lines at the end of the run are kept.
+      while j > i and discards[j - 1] == 2:
+        j -= 1
+        discards[j] = 0
+        provisional -= 1
+      length = j - i
+
+      if provisional * 4 > length:
+        # Mostly provisional: keep all the provisional ones.
+        for k in xrange(i, j):
+          if discards[k] == 2:
+            discards[k] = 0
+      else:
+        # Keep provisional lines in runs shorter than minimum.
+        minimum = 1
+        tem = length >> 2
+        while True:
+          tem >>= 2
+          if tem <= 0:
+            break
+          minimum <<= 1
+        minimum += 1
+        j = consec = 0
+        while j < length:
+          if discards[i + j] != 2:
+            consec = 0
+          else:
+            consec += 1
+            if consec == minimum:
+              # Back up and cancel the run's provisional discards.
+              j -= consec
+            elif consec > minimum:
+              discards[i + j] = 0
+          j += 1
+
+        # Keep provisional lines near the start of the run, up to the first
+        # three real discards in a row.
+        j = consec = 0
+        while j < length:
+          if j >= 8 and discards[i + j] == 1:
+            break
+          if discards[i + j] == 2:
+            consec = 0
+            discards[i + j] = 0
+          elif not discards[i + j]:
+            consec = 0
+          else:
+            consec += 1
+          if consec == 3:
+            break
+          j += 1
+
+        # And likewise near its end.
+        i += length - 1
+        j = consec = 0
+        while j < length:
+          if j >= 8 and discards[i - j] == 1:
+            break
+          if discards[i - j] == 2:
+            consec = 0
+            discards[i - j] = 0
+          elif not discards[i - j]:
+            consec = 0
+          else:
+            consec += 1
+          if consec == 3:
+            break
+          j += 1
+    i += 1
+  return [bool(d) for d in discards]
+
+
+def _MiddleSnake(xv, xoff, xlim, yv, yoff, ylim, fd, bd, off):
+  """Where a shortest edit script from xv to yv crosses its middle.
+
+  This is Myers' O(ND) search from both ends at once, as in GNU diff's diag().
+
+  Args:
+    xv, yv: lists of int, the sequences to compare
+    xoff, xlim, yoff, ylim: int, the bounds of the parts of them to compare
+    fd, bd: lists of int, scratch space for the forward and backward searches,
+            indexed by diagonal + off
+
+  Returns:
+    (int, int), the point in xv and yv to split the comparison at
+  """
+  dmin = xoff - ylim
+  dmax = xlim - yoff
+  fmid = xoff - yoff
+  bmid = xlim - ylim
+  fmin = fmax = fmid
+  bmin = bmax = bmid
+  odd = (fmid - bmid) & 1
+  fd[off + fmid] = xoff
+  bd[off + bmid] = xlim
+  while True:
+    # Extend the forward search by one edit.
+    if fmin > dmin:
+      fmin -= 1
+      fd[off + fmin - 1] = -1
+    else:
+      fmin += 1
+    if fmax < dmax:
+      fmax += 1
+      fd[off + fmax + 1] = -1
+    else:
+      fmax -= 1
+    for d in xrange(fmax, fmin - 1, -2):
+      tlo = fd[off + d - 1]
+      thi = fd[off + d + 1]
+      x = thi if tlo < thi else tlo + 1
+      y = x - d
+      while x < xlim and y < ylim and xv[x] == yv[y]:
+        x += 1
+        y += 1
+      fd[off + d] = x
+      if odd and bmin <= d <= bmax and bd[off + d] <= x:
+        return x, y
+
+    # And the backward one.
+    if bmin > dmin:
+      bmin -= 1
+      bd[off + bmin - 1] = xlim + ylim + 1
+    else:
+      bmin += 1
+    if bmax < dmax:
+      bmax += 1
+      bd[off + bmax + 1] = xlim + ylim + 1
+    else:
+      bmax -= 1
+    for d in xrange(bmax, bmin - 1, -2):
+      tlo = bd[off + d - 1]
+      thi = bd[off + d + 1]
+      x = tlo if tlo < thi else thi - 1
+      y = x - d
+      while x > xoff and y > yoff and xv[x - 1] == yv[y - 1]:
+        x -= 1
+        y -= 1
+      bd[off + d] = x
+      if not odd and fmin <= d <= fmax and x <= fd[off + d]:
+        return x, y
+
+
+def _ShiftBoundaries(changed, other_changed, equivs):
+  """Slide runs of changed lines the way GNU diff does, to tidy its output.
+
+  Runs move back to merge with earlier runs, then forward as far as they go,
+  then back again to line up with a run of changes in the other file.
+
+  Args:
+    changed: list of bool, whether each line of this file changed, with an
+             unchanged sentinel at each end
+    other_changed: the same for the other file
+    equivs: list of int, the equivalence class of each line of this file
+  """
+  # Index k of changed and other_changed is line k - 1.
+  def Changed(k):
+    return changed[k + 1]
+
+  def OtherChanged(k):
+    return other_changed[k + 1]
+
+  i = j = 0
+  i_end = len(equivs)
+  while True:
+    # Find the start of the next run, and the corresponding other line.
+    while i < i_end and not Changed(i):
+      while OtherChanged(j):
+        j += 1
+      j += 1
+      i += 1
+    if i == i_end:
+      return
+    start = i
+    i += 1
+    while Changed(i):
+      i += 1
+    while OtherChanged(j):
+      j += 1
+
+    while True:
+      runlength = i - start
+      while start and equivs[start - 1] == equivs[i - 1]:
+        start -= 1
+        changed[start + 1] = True
+        i -= 1
+        changed[i + 1] = False
+        while Changed(start - 1):
+          start -= 1
+        j -= 1
+        while OtherChanged(j):
+          j -= 1
+      # The end of the run, where it last lined up with other changes.
+      corresponding = i if OtherChanged(j - 1) else i_end
+      while i != i_end and equivs[start] == equivs[i]:
+        changed[start + 1] = False
+        start += 1
+        changed[i + 1] = True
+        i += 1
+        while Changed(i):
+          i += 1
+        j += 1
+        while OtherChanged(j):
+          j += 1
+          corresponding = i
+      if runlength == i - start:
+        break
+
+    while corresponding < i:
+      start -= 1
+      changed[start + 1] = True
+      i -= 1
+      changed[i + 1] = False
+      j -= 1
+      while OtherChanged(j):
+        j -= 1
+
+
+def _DiffLines(a_lines, b_lines):
+  """The hunks GNU diff (as diff3 runs it) finds between a_lines and b_lines.
+
+  This aligns lines exactly as diff -a --horizon-lines=100 does, so that
+  where repeated lines could be aligned more than one way, Merge3 picks the
+  same way diff3 (and so merge(1)) does.
+
+  Args:
+    a_lines, b_lines: lists of str
+
+  Returns:
+    list of (a_start, a_end, b_start, b_end), the half-open ranges of lines
+    that differ, in order
+  """
+  # Lines further than the horizon into a common prefix or suffix can't take
+  # part in the comparison.
+  a_len, b_len = len(a_lines), len(b_lines)
+  prefix = 0
+  while (prefix < a_len and prefix < b_len and
+         a_lines[prefix] == b_lines[prefix]):
+    prefix += 1
+  suffix = 0
+  while (suffix < a_len - prefix and suffix < b_len - prefix and
+         a_lines[a_len - suffix - 1] == b_lines[b_len - suffix - 1]):
+    suffix += 1
+  lo = prefix - min(prefix, _HORIZON_LINES)
+  a_hi = a_len - suffix + min(suffix, _HORIZON_LINES)
+  b_hi = b_len - suffix + min(suffix, _HORIZON_LINES)
+
+  classes = {}
+  a_equivs = [classes.setdefault(l, len(classes))
+              for l in a_lines[lo:a_hi]]
+  b_equivs = [classes.setdefault(l, len(classes))
+              for l in b_lines[lo:b_hi]]
+  a_discards = _DiscardConfusingLines(a_equivs,
+                                      collections.Counter(b_equivs))
+  b_discards = _DiscardConfusingLines(b_equivs,
+                                      collections.Counter(a_equivs))
+  xv = [e for e, d in zip(a_equivs, a_discards) if not d]
+  x_lines = [i for i, d in enumerate(a_discards) if not d]
+  yv = [e for e, d in zip(b_equivs, b_discards) if not d]
+  y_lines = [i for i, d in enumerate(b_discards) if not d]
+
+  # Discarded lines are changed; find which others are.
+  a_changed = [False] + a_discards + [False]
+  b_changed = [False] + b_discards + [False]
+  fd = [0] * (len(xv) + len(yv) + 3)
+  bd = [0] * len(fd)
+  off = len(yv) + 1
+  todo = [(0, len(xv), 0, len(yv))]
+  while todo:
+    xoff, xlim, yoff, ylim = todo.pop()
+    while xoff < xlim and yoff < ylim and xv[xoff] == yv[yoff]:
+      xoff += 1
+      yoff += 1
+    while xoff < xlim and yoff < ylim and xv[xlim - 1] == yv[ylim - 1]:
+      xlim -= 1
+      ylim -= 1
+    if xoff == xlim:
+      for y in xrange(yoff, ylim):
+        b_changed[y_lines[y] + 1] = True
+    elif yoff == ylim:
+      for x in xrange(xoff, xlim):
+        a_changed[x_lines[x] + 1] = True
+    else:
+      xmid, ymid = _MiddleSnake(xv, xoff, xlim, yv, yoff, ylim, fd, bd, off)
+      todo.append((xmid, xlim, ymid, ylim))
+      todo.append((xoff, xmid, yoff, ymid))
+
+  _ShiftBoundaries(a_changed, b_changed, a_equivs)
+  _ShiftBoundaries(b_changed, a_changed, b_equivs)
+
+  hunks = []
+  i = j = 1
+  while i <= len(a_equivs) or j <= len(b_equivs):
+    if a_changed[i] or b_changed[j]:
+      a_start, b_start = i, j
+      while a_changed[i]:
+        i += 1
+      while b_changed[j]:
+        j += 1
+      hunks.append((lo + a_start - 1, lo + i - 1, lo + b_start - 1,
+                    lo + j - 1))
+    i += 1
+    j += 1
+  return hunks
+
+
+def _Terminated(lines):
+  """lines, with a newline at the end if it lacks one."""
+  if lines and not lines[-1].endswith('\n'):
+    return lines[:-1] + [lines[-1] + '\n']
+  return lines
+
+
+def Merge3(mod1_lines, orig_lines, mod2_lines, mod1_label, mod2_label):
+  """Merge the changes from orig_lines to mod2_lines into mod1_lines.
+
+  This is the line-based three-way merge of diff3 -m -E (and so merge(1)),
+  with the same alignment of lines and the same grouping of changes into
+  conflicts. Where both sides changed overlapping or adjacent lines
+  differently, the result has both versions between conflict markers:
+    <<<<<<< mod1_label
+    (mod1's lines)
+    =======
+    (mod2's lines)
+    >>>>>>> mod2_label
+  Unlike diff3, a side whose last line lacks a newline gets one before the
+  marker that follows it.
+
+  Args:
+    mod1_lines: list of str, the lines (with line endings) of the first
+                modified file
+    orig_lines: list of str, the lines of the original file
+    mod2_lines: list of str, the lines of the second modified file
+    mod1_label: str, the label for mod1's side of a conflict
+    mod2_label: str, the label for mod2's side of a conflict
+
+  Returns:
+    (list of str, the merged lines; bool, whether there were conflicts)
+  """
+  # Like diff3, diff each side against the original, and group hunks that
+  # overlap or touch (in the original) into blocks. Hunks here are
+  # (mod_start, mod_end, orig_start, orig_end).
+  threads = [collections.deque(_DiffLines(mod1_lines, orig_lines)),
+             collections.deque(_DiffLines(mod2_lines, orig_lines))]
+  offsets = [0, 0]
+  merged = []
+  conflicts = False
+  mod1_pos = 0
+  while threads[0] or threads[1]:
+    using = [[], []]
+    if not threads[1] or (threads[0] and
+                          threads[0][0][2] <= threads[1][0][2]):
+      high = 0
+    else:
+      high = 1
+    orig_start = threads[high][0][2]
+    using[high].append(threads[high].popleft())
+    orig_end = using[high][-1][3]
+    other = 1 - high
+    while threads[other] and threads[other][0][2] <= orig_end:
+      using[other].append(threads[other].popleft())
+      if using[other][-1][3] > orig_end:
+        orig_end = using[other][-1][3]
+        high = other
+      other = 1 - high
+
+    # What each side has in place of orig_lines[orig_start:orig_end].
+    ranges = []
+    for side in (0, 1):
+      if using[side]:
+        first, last = using[side][0], using[side][-1]
+        ranges.append((first[0] - (first[2] - orig_start),
+                       last[1] + (orig_end - last[3])))
+        offsets[side] = last[1] - last[3]
+      else:
+        ranges.append((orig_start + offsets[side],
+                       orig_end + offsets[side]))
+    mod1_chunk = mod1_lines[ranges[0][0]:ranges[0][1]]
+    mod2_chunk = mod2_lines[ranges[1][0]:ranges[1][1]]
+    if not using[1] or mod1_chunk == mod2_chunk:
+      continue
+
+    merged.extend(mod1_lines[mod1_pos:ranges[0][0]])
+    mod1_pos = ranges[0][1]
+    if using[0]:
+      conflicts = True
+      merged.append('<<<<<<< %s\n' % mod1_label)
+      merged.extend(_Terminated(mod1_chunk))
+      merged.append('=======\n')
+      merged.extend(_Terminated(mod2_chunk))
+      merged.append('>>>>>>> %s\n' % mod2_label)
+    else:
+      merged.extend(mod2_chunk)
+  merged.extend(mod1_lines[mod1_pos:])
+  return merged, conflicts
+
+
+def _ReadLines(filename):
+  with open(filename, 'rb') as f:
+    return f.readlines()
+
+
+# Triage classes: how a file changed from the previous codebase.
+IDENTICAL = 'identical in generated and public'
+PUBLIC_CHANGED = 'changed only in public'
+GENERATED_CHANGED = 'changed only in generated'
+BOTH_CHANGED = 'changed in both'
+
+TRIAGE_CLASSES = [IDENTICAL, PUBLIC_CHANGED, GENERATED_CHANGED, BOTH_CHANGED]
+
+
+def _FileState(codebase, relative_filename):
+  """What relative_filename is in codebase, for comparing with other codebases.
+
+  Args:
+    codebase: codebase_utils.Codebase
+    relative_filename: str
+
+  Returns:
+    (str, the file's digest; bool, whether it's executable), or None if it
+    doesn't exist. The digest comes from codebase's Manifest, if it keeps one.
+  """
+  path = codebase.FilePath(relative_filename)
+  if not os.path.exists(path):
+    return None
+  manifest = codebase.Manifest()
+  entry = manifest and manifest.Entry(relative_filename)
+  digest = entry.digest if entry else base.HashFile(path)
+  return (digest, base.IsExecutable(path))
+
+
+def _TakeFile(source_file, merged_file):
+  """Make merged_file a copy of source_file (or absent, if that is)."""
+  if not os.path.exists(source_file):
+    return
+  shutil.copyfile(source_file, merged_file)
+  if base.IsExecutable(source_file):
+    base.SetExecutable(merged_file)
+
+
+class _ProgressReporter(object):
+  """Reports progress through some files, at most once per interval."""
+
+  def __init__(self, total, interval=5.0):
+    """Construct.
+
+    Args:
+      total: int, how many files there are
+      interval: float, the least number of seconds between reports
+    """
+    self._total = total
+    self._interval = interval
+    self._done = 0
+    self._reported = 0
+    self._last_report = time.time()
+
+  def Advance(self):
+    """Note that one more file is done."""
+    self._done += 1
+    if time.time() - self._last_report >= self._interval:
+      self._Report()
+
+  def Finish(self):
+    """Report the final count, unless it's been reported already."""
+    if self._reported != self._done:
+      self._Report()
+
+  def _Report(self):
+    print 'Merged %d/%d files' % (self._done, self._total)
+    sys.stdout.flush()
+    self._reported = self._done
+    self._last_report = time.time()
+
 
 class MergeCodebasesConfig(object):
   """Configuration to use for an examination of codebases."""
@@ -74,16 +612,21 @@ class MergeCodebasesConfig(object):
 class MergeCodebasesContext(object):
   """Context to examine codebases."""
 
-  def __init__(self, config):
+  def __init__(self, config, merge_engine=None, jobs=None):
     """Initialize MergeCodebasesContext.
 
     Args:
       config: MergeCodebasesConfig, configuration
+      merge_engine: str, one of MERGE_ENGINES; defaults to --merge_engine
+      jobs: int, how many files to merge at once; defaults to --merge_jobs
     """
     self.config = config
+    self.merge_engine = merge_engine or FLAGS.merge_engine
+    self.jobs = jobs or FLAGS.merge_jobs
     self.files = []
     self.merged_files = []
     self.failed_merges = []
+    self.triage_counts = collections.defaultdict(int)
 
   def GenerateFiles(self):
     """Determine all the files to examine."""
@@ -113,10 +656,26 @@ class MergeCodebasesContext(object):
     print ' Public Codebase:          ', self.config.public_codebase.Path()
     print ' Previous Codebase: ', self.config.previous_codebase.Path()
     print ' Merged Codebase:', self.config.merged_codebase
-    for f in files_to_merge:
-      self.GenerateMergedFile(f)
-    sys.stdout.write('\n')
-    sys.stdout.flush()
+    progress = _ProgressReporter(len(files_to_merge))
+    if self.jobs > 1:
+      thread_pool = pool.ThreadPool(self.jobs)
+      try:
+        triage_classes = thread_pool.imap(self.GenerateMergedFile,
+                                          files_to_merge)
+        for triage_class in triage_classes:
+          self.triage_counts[triage_class] += 1
+          progress.Advance()
+      finally:
+        thread_pool.terminate()
+      # Files finish in any order; report them in the order they were given.
+      order = dict((f, i) for i, f in enumerate(files_to_merge))
+      self.merged_files.sort(key=order.get)
+      self.failed_merges.sort(key=order.get)
+    else:
+      for f in files_to_merge:
+        self.triage_counts[self.GenerateMergedFile(f)] += 1
+        progress.Advance()
+    progress.Finish()
 
     self.Report()
 
@@ -126,6 +685,9 @@ class MergeCodebasesContext(object):
     """Print the final report."""
     print ('Examined %d generated/public/previous files.' %
            len(self.files))
+    for triage_class in TRIAGE_CLASSES:
+      if triage_class in self.triage_counts:
+        print '  %d %s' % (self.triage_counts[triage_class], triage_class)
     if self.merged_files:
       print ('%d required updating. First (up to) 10:' %
              len(self.merged_files))
@@ -140,30 +702,38 @@ class MergeCodebasesContext(object):
       print 'No merges required'
 
   def GenerateMergedFile(self, f):
-    """Generate the merged file for f."""
-    sys.stdout.write('.')
-    sys.stdout.flush()
+    """Generate the merged file for f.
 
+    Returns:
+      str, f's triage class (one of TRIAGE_CLASSES)
+    """
     generated_file = self.config.generated_codebase.FilePath(f)
     public_file = self.config.public_codebase.FilePath(f)
     previous_file = self.config.previous_codebase.FilePath(f)
     merged_file = os.path.join(self.config.merged_codebase, f)
     base.MakeDir(os.path.dirname(merged_file))
 
-    different = base.AreFilesDifferent(generated_file, public_file)
-    if not different:
-      shutil.copyfile(public_file, merged_file)
-      if base.IsExecutable(public_file):
-        base.SetExecutable(merged_file)
-      return
-
-    # TODO(dbentley): I probably need to think about executability
-    # So far, I've handled it in push_codebase but not here at all.
-    # This is probably a bug.
-    self.PerformMerge(public_file, previous_file, generated_file,
-                      merged_file, f)
+    # Only files changed differently on each side need a real merge.
+    generated_state = _FileState(self.config.generated_codebase, f)
+    public_state = _FileState(self.config.public_codebase, f)
+    if generated_state == public_state:
+      _TakeFile(public_file, merged_file)
+      return IDENTICAL
+
+    previous_state = _FileState(self.config.previous_codebase, f)
+    if generated_state == previous_state:
+      triage_class = PUBLIC_CHANGED
+      _TakeFile(public_file, merged_file)
+    elif public_state == previous_state:
+      triage_class = GENERATED_CHANGED
+      _TakeFile(generated_file, merged_file)
+    else:
+      triage_class = BOTH_CHANGED
+      self.PerformMerge(public_file, previous_file, generated_file,
+                        merged_file, f)
 
     self.merged_files.append(f)
+    return triage_class
 
   def PerformMerge(self, mod1_file, orig_file, mod2_file, output_file, f):
     """Merge changes.
@@ -209,10 +779,20 @@ class MergeCodebasesContext(object):
           # we want to delete the file; so we just don't output it
           return
 
-    # NB(dbentley): merge takes the original file in the middle. Yes it looks
-    # weird, but it is correct.
-    process = subprocess.Popen(['merge', '-p', mod1_file, orig_file, mod2_file],
-                               stdout=open(output_file, 'wb'))
+    process = None
+    if self.merge_engine == BUILTIN_ENGINE:
+      merged_lines, conflicts = Merge3(
+          _ReadLines(mod1_file), _ReadLines(orig_file), _ReadLines(mod2_file),
+          mod1_file, mod2_file)
+      with open(output_file, 'wb') as output:
+        output.writelines(merged_lines)
+      returncode = int(conflicts)
+    else:
+      # NB(dbentley): merge takes the original file in the middle. Yes it looks
+      # weird, but it is correct.
+      process = subprocess.Popen(
+          ['merge', '-p', mod1_file, orig_file, mod2_file],
+          stdout=open(output_file, 'wb'))
 
     # Handle executable bit
     orig_exec = base.IsExecutable(orig_file)
@@ -231,20 +811,22 @@ class MergeCodebasesContext(object):
 
     # From merge(1)'s man page:
     # Exit status is 0 for no conflicts, 1 for some conflicts, 2 for trouble.
-    process.wait()
-    if process.returncode != 0:
+    if process:
+      process.wait()
+      returncode = process.returncode
+    if returncode != 0:
       self.failed_merges.append(f)
-      if process.returncode == 1:
+      if returncode == 1:
         logging.error('FAILED MERGE %s', output_file)
         logging.debug(
             'FAILED MERGE command: merge -p %s %s %s',
             mod1_file, orig_file, mod2_file)
-      elif process.returncode == 2:
+      elif returncode == 2:
         logging.error('Merge found "trouble" when merging: %s %s %s',
                       (mod1_file, orig_file, mod2_file))
-      elif process.returncode != 0:
+      elif returncode != 0:
         logging.error('Merge returned status %d (outside of 0, 1, 2).',
-                      process.returncode)
+                      returncode)
 
 
 def main(unused_args):
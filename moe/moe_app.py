@@ -21,6 +21,23 @@ FLAGS = flags.FLAGS
 flags.DEFINE_string('moe_temp',
                     tempfile.gettempdir(),
                     'Base directory for all MOE temporary clients and files.')
+flags.DEFINE_string('expansion_cache_dir', '',
+                    'Directory to keep expanded codebase archives in, shared '
+                    'between runs. Defaults to expansion_cache under the '
+                    'per-user directory in --moe_temp.')
+flags.DEFINE_integer('expansion_cache_max_bytes', 2 * 1024 * 1024 * 1024,
+                     'How large the expansion cache may grow. 0 disables it.')
+flags.DEFINE_boolean('git_mirrors', True,
+                     'Whether to keep a bare mirror of each git repository, '
+                     'shared between runs, to fetch into and clone from.')
+flags.DEFINE_string('git_mirror_dir', '',
+                    'Directory to keep git mirrors in. Defaults to git_mirrors '
+                    'under the per-user directory in --moe_temp.')
+flags.DEFINE_integer('max_concurrent_cmds', 4,
+                     'How many commands MOE may run at once.')
+flags.DEFINE_string('cmd_trace_file', '',
+                    'File to append a JSON line to for every command MOE '
+                    'runs, with its timing and output sizes.')
 
 
 # RUN is the current MOE run. MOE code can assume it is non-None and a valid
@@ -49,6 +66,36 @@ class MoeRun(object):
     self.for_test = for_test
 
 
+def RunConcurrently(fns):
+  """Call fns concurrently, in the current MOE task.
+
+  Args:
+    fns: list of function() -> object, which must be independent (e.g.
+         operations on different repositories)
+
+  Returns:
+    list, the results of fns, in order
+  """
+  return base.CMD_EXECUTOR.Map([RUN.ui.InCurrentTask(fn) for fn in fns])
+
+
+def ExpansionCacheFromFlags():
+  """The base.ExpansionCache the flags ask for, or None if it's disabled."""
+  if not FLAGS.expansion_cache_max_bytes:
+    return None
+  cache_dir = FLAGS.expansion_cache_dir or os.path.join(
+      FLAGS.moe_temp, 'moe.%s' % getpass.getuser(), 'expansion_cache')
+  return base.ExpansionCache(cache_dir, FLAGS.expansion_cache_max_bytes)
+
+
+def GitMirrorDirFromFlags():
+  """The directory the flags ask for git mirrors in, or None if they're off."""
+  if not FLAGS.git_mirrors:
+    return None
+  return FLAGS.git_mirror_dir or os.path.join(
+      FLAGS.moe_temp, 'moe.%s' % getpass.getuser(), 'git_mirrors')
+
+
 def _Init(project_name):
   """Initialize a MOE run.
 
@@ -68,9 +115,11 @@ def _Init(project_name):
   temp_dir = os.path.join(
       FLAGS.moe_temp, 'moe.%s' % getpass.getuser(), project_name)
   base.MakeDir(temp_dir)
-  expander = base.CodebaseExpander(temp_dir)
+  expander = base.CodebaseExpander(temp_dir, ExpansionCacheFromFlags())
   report = base.MoeReport()
   ui = moe_ui.MoeUI()
+  base.CMD_TRACER = base.CmdTracer(ui.CurrentTask, FLAGS.cmd_trace_file)
+  base.CMD_EXECUTOR = base.CmdExecutor(FLAGS.max_concurrent_cmds)
   RUN = MoeRun(temp_dir, expander, report, ui)
 
 
@@ -21,6 +21,7 @@ FLAGS = flags.FLAGS
 
 def main(argv):
   appcommands.AddCmd('auto', manage_codebases.AutoCmd)
+  appcommands.AddCmd('cache', simple_commands.CacheCmd)
   appcommands.AddCmd('change', push_codebase.ChangeCmd)
   appcommands.AddCmd('check_config', simple_commands.CheckConfigCmd)
   appcommands.AddCmd('create_codebase', create_codebase.CreateCodebaseCmd)
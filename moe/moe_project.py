@@ -34,6 +34,12 @@ class MoeProjectContext(object):
     self.public_repository, self.public_codebase_creator = (
         config.public_repository_config.MakeRepository())
 
+  def Close(self):
+    """Close the project's repositories, once the run is done with them."""
+    for repository in (self.internal_repository, self.public_repository):
+      if repository:
+        repository.Close()
+
 
 _SCRUBBING_TRANSLATOR_CONFIG_KEYS = [
     u'from_project_space',
@@ -8,6 +8,7 @@ __author__ = 'dbentley@google.com (Daniel Bentley)'
 
 import os
 import sys
+import threading
 
 import logging
 
@@ -104,7 +105,27 @@ class MoeUI(object):
   """
 
   def __init__(self):
-    self._tasks = []
+    self._local = threading.local()
+
+  def _GetTasks(self):
+    if not hasattr(self._local, 'tasks'):
+      self._local.tasks = []
+    return self._local.tasks
+
+  def _SetTasks(self, tasks):
+    self._local.tasks = tasks
+
+  # The stack of tasks in progress. Each thread has its own.
+  _tasks = property(_GetTasks, _SetTasks)
+
+  def InCurrentTask(self, fn):
+    """Wrap fn to run (e.g. in another thread) in the tasks now in progress."""
+    tasks = list(self._tasks)
+
+    def Run():
+      self._tasks = list(tasks)
+      return fn()
+    return Run
 
   def _Print(self, text, new_line=True, with_indentation=True):
     """Helper function to format and print text."""
@@ -120,6 +141,10 @@ class MoeUI(object):
     indented_lines = ['  ' * len(self._tasks) + l for l in lines]
     return '\n'.join(indented_lines)
 
+  def CurrentTask(self):
+    """The names of the tasks in progress, outermost first, joined by '/'."""
+    return '/'.join(self._tasks)
+
   def Info(self, description):
     """Print some text in the current context."""
     self._Print(description)
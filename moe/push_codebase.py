@@ -69,6 +69,16 @@ Revision created by MOE tool push_codebase.
 MOE_MIGRATION=%s
 """
 
+# How a file in the destination compares to the source codebase's, in the order
+# Push reports them.
+ADDED = 'added'
+MODIFIED = 'modified'
+MODE_CHANGED = 'mode changed'
+DELETED = 'deleted'
+UNCHANGED = 'unchanged'
+CHANGE_KINDS = [ADDED, MODIFIED, MODE_CHANGED, DELETED, UNCHANGED]
+
+
 class CodebasePusher(object):
   """Pushes codebases into editors."""
 
@@ -103,15 +113,22 @@ class CodebasePusher(object):
     self.destination_editor.Checkout()
 
     files_to_push = self._FileUnion()
-    print 'Pushing %d files into %s' % (len(files_to_push),
-                                        self.destination_editor.Root())
+    print 'Comparing %d files with %s' % (len(files_to_push),
+                                          self.destination_editor.Root())
+    self.change_counts = dict((kind, 0) for kind in CHANGE_KINDS)
     for filename in files_to_push:
       codebase_path = os.path.join(self.source_codebase.ExpandedPath(),
                                    filename)
+      change = self._Compare(filename, codebase_path)
+      self.change_counts[change] += 1
+      if change == UNCHANGED:
+        continue
       sys.stdout.write('.')
       sys.stdout.flush()
       self.destination_editor.PutFile(filename, codebase_path)
     print
+    print 'Pushed %s' % ', '.join(
+        '%d %s' % (self.change_counts[kind], kind) for kind in CHANGE_KINDS)
 
     # TODO(dbentley): allow client to pass in a change message
     commit_message = COMMIT_MESSAGE_TEMPLATE % (
@@ -122,6 +139,37 @@ class CodebasePusher(object):
     self.pushed = self.destination_editor.ChangesMade()
     return commit_id
 
+  def _Compare(self, filename, codebase_path):
+    """How filename in the destination differs from codebase_path.
+
+    Sizes are compared before contents, and the source codebase's Manifest
+    supplies its digests where it keeps one, so most files aren't read.
+
+    Args:
+      filename: str, the relative filename
+      codebase_path: str, the path of filename in the source codebase
+
+    Returns:
+      str, one of CHANGE_KINDS
+    """
+    dest_path = os.path.join(self.destination_editor.Root(), filename)
+    src_exists = os.path.exists(codebase_path)
+    dest_exists = os.path.exists(dest_path)
+    if not dest_exists:
+      return ADDED if src_exists else UNCHANGED
+    if not src_exists:
+      return DELETED
+    if os.path.getsize(codebase_path) != os.path.getsize(dest_path):
+      return MODIFIED
+    manifest = self.source_codebase.Manifest()
+    entry = manifest and manifest.Entry(filename)
+    src_digest = entry.digest if entry else base.HashFile(codebase_path)
+    if src_digest != base.HashFile(dest_path):
+      return MODIFIED
+    if base.IsExecutable(codebase_path) != base.IsExecutable(dest_path):
+      return MODE_CHANGED
+    return UNCHANGED
+
   def _FileUnion(self):
     """Determine the union of files in the codebase and the SCM client.
 
@@ -182,7 +230,7 @@ def main(unused_args):
       raise base.Error('Unexpected destination: %s' % destination)
 
     if FLAGS.codebase:
-      source_codebase = codebase_utils.Codebase(FLAGS.codebase)
+      source_codebase = codebase_utils.CodebaseFromPath(FLAGS.codebase)
     else:
       source_codebase = source_codebase_creator.Create(source_revision)
 
@@ -211,6 +259,7 @@ def main(unused_args):
     pusher.Push()
     moe_app.RUN.report.PrintSummary()
   finally:
+    project.Close()
     project.db.Disconnect()
 
 
@@ -67,12 +67,12 @@ class RoundTripCmd(appcommands.Cmd):
 
       original_codebase = codebase_creator.Create(revision)
 
-      codebase = codebase_utils.CreateModifiableCopy(original_codebase)
+      codebase = codebase_utils.CreateModifiableCopy(original_codebase,
+                                                     copy_on_write=True)
 
       for relative_filename in codebase.Walk():
-        filename = codebase.FilePath(relative_filename)
-
-        if os.path.splitext(filename)[1] in EDITABLE_FILETYPES:
+        if os.path.splitext(relative_filename)[1] in EDITABLE_FILETYPES:
+          filename = codebase.WritableFilePath(relative_filename)
           file_util.Write(filename,
                           file_util.Read(filename) + '\nMOE was here.\n')
 
@@ -100,6 +100,7 @@ class RoundTripCmd(appcommands.Cmd):
       pusher.Push()
       moe_app.RUN.report.PrintSummary()
     finally:
+      project.Close()
       project.db.Disconnect()
 
 
@@ -186,9 +186,12 @@ def main(args):
   # TODO(dbentley): refactor further so that this boilerplate
   # is folded in to ScrubberContext's run method.
   print 'Found %d files' % len(context.files)
-  context.Scan()
+  try:
+    context.Scan()
 
-  context.WriteOutput()
+    context.WriteOutput()
+  finally:
+    context.Close()
   context.Report()
 
   stopwatch.sw.stop()
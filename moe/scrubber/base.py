@@ -132,6 +132,49 @@ class RegexScrubber(FileScrubber):
       file_obj.WriteContents(contents)
 
 
+# Pattern text that can't be embedded in a larger alternation without changing
+# its meaning: numbered backreferences, (global) inline flags, named groups and
+# conditional groups, which refer to groups by number or name.
+_UNCOMBINABLE_PATTERN_RE = re.compile(r'\\[1-9]|\(\?[iLmsux]|\(\?P|\(\?\(')
+
+# Inline flags leading a pattern, which are already in its compiled flags.
+_LEADING_FLAGS_RE = re.compile(r'^\(\?[iLmsux]+\)')
+
+
+def CombineRes(regexes):
+  """Combine compiled regexes into as few as possible, for scanning text.
+
+  Some regex in the result matches a text iff some regex in regexes does.
+  Regexes compiled with the same flags are joined into a single alternation;
+  ones that can't be joined safely are kept as they are.
+
+  Args:
+    regexes: seq of compiled regexes
+
+  Returns:
+    list of compiled regexes
+  """
+  result = []
+  patterns_by_flags = {}
+  for regex in regexes:
+    pattern = _LEADING_FLAGS_RE.sub('', regex.pattern)
+    if _UNCOMBINABLE_PATTERN_RE.search(pattern):
+      result.append(regex)
+    else:
+      patterns_by_flags.setdefault(regex.flags, []).append((pattern, regex))
+  for regex_flags, group in sorted(patterns_by_flags.iteritems()):
+    if len(group) == 1:
+      result.append(group[0][1])
+      continue
+    try:
+      result.append(re.compile(
+          '|'.join('(?:%s)' % pattern for pattern, _ in group), regex_flags))
+    except (re.error, AssertionError, UnicodeError):
+      # E.g. too many groups between them, or mixed str and unicode.
+      result.extend(regex for _, regex in group)
+  return result
+
+
 def MakeDirs(d):
   """Make directory 'd' exist."""
   try:
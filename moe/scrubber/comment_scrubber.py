@@ -25,7 +25,13 @@ COPYRIGHT_RE = re.compile('\W*copyright.*', re.I)
 
 
 class Comment(object):
-  """Class encapsulating a comment in a file."""
+  """Class encapsulating a comment in a file.
+
+  There's one of these for every comment in a batch of files, so they're kept
+  small: no instance dict, and the comments in a file share their filename.
+  """
+
+  __slots__ = ('filename', 'line', 'char_index', 'text')
 
   def __init__(self, filename, line, char_index, text):
     self.filename = filename
@@ -47,12 +53,16 @@ class Comment(object):
 def CommentsFromJson(comments_json, filename_substitutions=None):
   """Generate a list of Comment objects from a JSON list."""
   filename_substitutions = filename_substitutions or {}
+  filenames = {}
   result = []
   for comment_json in comments_json:
     config_utils.CheckJsonKeys('comment', comment_json,
                                [u'filename', u'line', u'text', u'char_index'])
     filename = comment_json.get(u'filename', '')
-    result.append(Comment(filename_substitutions.get(filename, filename),
+    filename = filename_substitutions.get(filename, filename)
+    # The JSON has a copy of the filename per comment; keep just one.
+    filename = filenames.setdefault(filename, filename)
+    result.append(Comment(filename,
                           comment_json.get(u'line', 0),
                           comment_json.get(u'char_index', 0),
                           comment_json.get(u'text', '')))
@@ -92,7 +102,7 @@ class CommentScrubber(base.FileScrubber, base.BatchFileScrubber):
 
     Members:
       _extractor: CommentExtractor
-      _scrubbers: seq of CommentOrientedScrubber
+      _scrubbers: _CommentScrubberPipeline
 
     Args:
       extractor: CommentExtractor
@@ -100,7 +110,7 @@ class CommentScrubber(base.FileScrubber, base.BatchFileScrubber):
     """
     comment_scrubbers = comment_scrubbers or []
     self._extractor = extractor
-    self._scrubbers = comment_scrubbers
+    self._scrubbers = _CommentScrubberPipeline(comment_scrubbers)
 
   def ScrubFile(self, file_obj, context):
     """Scrub the comments in file_obj in context.
@@ -164,10 +174,11 @@ class CommentScrubber(base.FileScrubber, base.BatchFileScrubber):
 
       # Now determine the comment's new text
       old_behavior = behavior
-      comment_text = self._ScrubComment(comment, file_obj, context)
+      comment_text, triggered = self._ScrubComment(comment, file_obj, context)
       try:
-        comment_text, behavior = self._HandleMoeDirectives(comment_text,
-                                                           behavior)
+        if triggered:
+          comment_text, behavior = self._HandleMoeDirectives(comment_text,
+                                                             behavior)
       except _CommentScrubberError, e:
         # Add any errors to the context, but keep going.
         context.AddError(CommentError('COMMENT_SCRUBBER_ERROR', e.trigger,
@@ -308,21 +319,73 @@ class CommentScrubber(base.FileScrubber, base.BatchFileScrubber):
         comment_text[:real_begin_pos] + comment_text[real_end_pos:])
 
   def _ScrubComment(self, comment, file_obj, context):
-    comment_text = comment.text
+    """Run the comment scrubbers over comment.
+
+    Returns:
+      (str, bool), the new comment text, and whether it may contain MOE
+      directives
+    """
+    comment_text, revisions, triggered = self._scrubbers.ScrubComment(
+        comment.text, file_obj, context)
+    if revisions:
+      logging.debug('Rewriting comment %s in %s because: %s',
+                    comment.text, file_obj.filename,
+                    u','.join([r.reason for r in revisions]))
+    return comment_text, triggered
+
+
+class _CommentScrubberPipeline(object):
+  """The CommentOrientedScrubbers of a CommentScrubber, ready to dispatch to.
+
+  Most comments contain nothing most scrubbers act on. The scrubbers' triggers
+  (see CommentOrientedScrubber.Trigger) and MOE directives are combined into
+  as few regexes as possible, and scanned for once per comment. Only if that
+  finds something is each scrubber's own trigger checked before calling it;
+  scrubbers without a trigger are always called.
+  """
+
+  def __init__(self, scrubbers):
+    """Initialize.
+
+    Args:
+      scrubbers: seq of CommentOrientedScrubber, in the order to run them
+    """
+    self._scrubbers = [(s, s.Trigger()) for s in scrubbers]
+    triggers = [t for _, t in self._scrubbers if t is not None]
+    self._combined_triggers = base.CombineRes(triggers + [MOE_DIRECTIVE_RE])
+
+  def ScrubComment(self, comment_text, file_obj, context):
+    """Scrub comment_text with each scrubber whose trigger it contains.
+
+    Args:
+      comment_text: str, the text of the comment
+      file_obj: ScannedFile, the file the comment appears in
+      context: ScrubberContext, to add errors to
+
+    Returns:
+      (str, [base.Revision], bool), the new comment text, the revisions made
+      to it, and whether any trigger or MOE directive may be in the new text
+    """
+    triggered = False
+    for trigger in self._combined_triggers:
+      if trigger.search(comment_text):
+        triggered = True
+        break
+
     revisions = []
-    for scrubber in self._scrubbers:
+    for scrubber, trigger in self._scrubbers:
+      if trigger is not None and not (triggered and
+                                      trigger.search(comment_text)):
+        continue
       result = scrubber.ScrubComment(comment_text, file_obj)
       if isinstance(result, base.Revision):
-        revision = result
-        comment_text = revision.new_text
-        revisions.append(revision)
+        comment_text = result.new_text
+        revisions.append(result)
+        # The new text hasn't been scanned, so check each trigger against it.
+        triggered = True
       if isinstance(result, CommentError):
         context.AddError(result)
-    if revisions:
-      logging.debug('Rewriting comment %s in %s because: %s',
-                    comment.text, file_obj.filename,
-                    u','.join([r.reason for r in revisions]))
-    return comment_text
+    return comment_text, revisions, triggered
 
 
 class CommentExtractor(object):
@@ -525,6 +588,17 @@ class CommentOrientedScrubber(object):
     """
     raise NotImplementedError
 
+  def Trigger(self):
+    """A regex that matches any comment this scrubber might act on.
+
+    CommentScrubber only calls ScrubComment for comments in which the trigger
+    is found, which saves calling every scrubber on every comment.
+
+    Returns:
+      compiled regex, or None if this scrubber must see every comment
+    """
+    return None
+
 
 class CommentError(base.ScrubberError):
   """A comment has given rise to an error."""
@@ -563,6 +637,9 @@ class TodoScrubber(CommentOrientedScrubber):
     CommentOrientedScrubber.__init__(self)
     self._username_filter = username_filter
 
+  def Trigger(self):
+    return NOTE_RE
+
   def ScrubComment(self, comment_text, file_obj):
     """Scrub usernames that should be scrubbed."""
     match = NOTE_RE.search(comment_text)
@@ -594,9 +671,12 @@ class TodoScrubber(CommentOrientedScrubber):
 
 
 class TodoError(CommentError):
+
+  FILTER_NAME = 'USERNAME'
+
   def __init__(self, file_obj, username):
     base.ScrubberError.__init__(
-        self, 'USERNAME', username,
+        self, self.FILTER_NAME, username,
         'Found unpublishable username "%s"' % username, file_obj)
     self.username = username
 
@@ -614,6 +694,9 @@ class SensitiveStringCommentScrubber(CommentOrientedScrubber):
     self._whitelist = whitelist
     self._string_finder = string_finder
 
+  def Trigger(self):
+    return self._string_finder.CandidateRe()
+
   def ScrubComment(self, comment_text, file_obj):
     for w in self._string_finder.FindSensitiveStrings(comment_text):
       filter_name = self._string_finder.FilterName()
@@ -669,6 +752,11 @@ class AuthorDeclarationScrubber(CommentOrientedScrubber):
       re.compile(r'^[ ]*[*][ ]*@author([^\n]*)(\n|$)', re.M),
       re.compile(r'^[ ]*(?://)?[ ]*Author:([^\n]*)(\n|$)', re.M),
       re.compile(r'^[ ]*<!--[ ]*Author:([^\n]*)-->(\n|$)', re.M)]
+  # Found in any comment one of AUTHOR_RE_LIST matches.
+  AUTHOR_TRIGGER_RE = re.compile(r'@author|Author:')
+
+  def Trigger(self):
+    return self.AUTHOR_TRIGGER_RE
 
   def ScrubComment(self, comment_text, unused_file_obj):
     """Scrub author declaration from a single comment."""
@@ -714,16 +802,19 @@ class _TokenizingExtractor(object):
     self._comments = []
     stopwatch.sw.start('tokenize')
     input_file = StringIO.StringIO(self._file_obj.Contents())  # ergh
-    # This dict holds the character offset in the file for each line.
-    self._line_ofs = {1: 0}
-    try:
-      for token_tuple in tokenize.generate_tokens(input_file.readline):
-        (srow, _) = token_tuple[2]
+    # This list holds the character offset in the file for each (1-based) line.
+    self._line_ofs = [0, 0]
 
-        # We always read an entire line at a time, so the current position is
-        # the start of the next one.
-        self._line_ofs[srow+1] = input_file.tell()
+    def ReadLine():
+      line = input_file.readline()
+      # We always read an entire line at a time, so the current position is
+      # the start of the next one. Recording it here rather than per token
+      # keeps the offsets right for lines that end inside a multi-line string.
+      self._line_ofs.append(input_file.tell())
+      return line
 
+    try:
+      for token_tuple in tokenize.generate_tokens(ReadLine):
         self._HandleToken(token_tuple)
 
     except tokenize.TokenError:
@@ -758,11 +849,173 @@ class _PythonTokenizingExtractor(_TokenizingExtractor):
     self._last_type = token_type
 
 
+class _UnclassifiableConstructError(Error):
+  """The Python scanner met source it can't tokenize with confidence.
+
+  This is an implementation detail of PythonCommentExtractor, which falls back
+  to the tokenize module when it sees it.
+  """
+
+
+# Characters that may begin a comment or a string literal.
+_PY_COMMENT_OR_QUOTE_RE = re.compile(r'''[#'"]''')
+_PY_COMMENT_RE = re.compile(r'#[^\r\n]*')
+# The rest of a string literal after its opening quote(s), keyed by quote.
+_PY_TRIPLE_QUOTED_REST_RES = {
+    '"': re.compile(r'[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*"""', re.S),
+    "'": re.compile(r"[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*'''", re.S),
+    }
+_PY_SINGLE_QUOTED_REST_RES = {
+    '"': re.compile(r'[^\n"\\]*(?:\\(?:\r\n|.)[^\n"\\]*)*"', re.S),
+    "'": re.compile(r"[^\n'\\]*(?:\\(?:\r\n|.)[^\n'\\]*)*'", re.S),
+    }
+# Characters tokenize considers part of NAME and NUMBER tokens.
+_PY_WORD_CHARS = frozenset(
+    'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_')
+# Characters that end an OP token.
+_PY_OPERATOR_CHARS = frozenset('+-*/%&|^=<>~()[]{}:;.,`@')
+
+
+class _PythonScanningExtractor(object):
+  """Find comments and docstrings in Python source without tokenizing it.
+
+  This finds the same comments as _PythonTokenizingExtractor, but only stops at
+  characters that can begin a comment or a string literal, and skips each
+  literal with a single regex match. A triple-quoted string is a docstring
+  unless the token before it is an operator, so for those we look back past
+  whitespace and line continuations to classify that token.
+
+  Raises _UnclassifiableConstructError on input where that isn't enough to be
+  sure what tokenize would do (unterminated single-quoted strings, stray
+  backslashes or carriage returns, and the like).
+  """
+
+  def __init__(self, file_obj):
+    self._file_obj = file_obj
+
+  def ExtractComments(self):
+    """Extract comments from file."""
+    stopwatch.sw.start('scan_python')
+    try:
+      return self._Scan(self._file_obj.Contents())
+    finally:
+      stopwatch.sw.stop('scan_python')
+
+  def _Scan(self, contents):
+    """Return the comments in contents, a Python source file."""
+    if contents.count('\r') != contents.count('\r\n'):
+      raise _UnclassifiableConstructError('lone carriage return')
+
+    filename = self._file_obj.filename
+    comments = []
+    lineno = 1
+    # Newlines before this index have already been counted into lineno.
+    counted_to = 0
+    last_string_end = -1
+    last_comment_end = -1
+
+    pos = 0
+    while True:
+      match = _PY_COMMENT_OR_QUOTE_RE.search(contents, pos)
+      if not match:
+        break
+      quote_index = match.start()
+      lineno += contents.count('\n', counted_to, quote_index)
+      counted_to = quote_index
+      quote = match.group()
+
+      if quote == '#':
+        end = _PY_COMMENT_RE.match(contents, quote_index).end()
+        comments.append(Comment(filename, lineno, quote_index,
+                                contents[quote_index:end].strip()))
+        last_comment_end = pos = end
+        continue
+
+      start = self._StringStart(contents, quote_index)
+      if contents.startswith(quote * 3, quote_index):
+        rest = _PY_TRIPLE_QUOTED_REST_RES[quote].match(contents,
+                                                       quote_index + 3)
+        if not rest:
+          # EOF in multi-line string; tokenize gives up here too.
+          break
+        end = rest.end()
+        if not self._FollowsOperator(contents, start, last_string_end,
+                                     last_comment_end):
+          comments.append(Comment(filename, lineno, start,
+                                  contents[start:end]))
+      else:
+        rest = _PY_SINGLE_QUOTED_REST_RES[quote].match(contents,
+                                                       quote_index + 1)
+        if not rest:
+          raise _UnclassifiableConstructError(
+              'unterminated string on line %d' % lineno)
+        end = rest.end()
+      last_string_end = pos = end
+
+    return comments
+
+  @staticmethod
+  def _StringStart(contents, quote_index):
+    """Return the index of the string prefix (if any) before quote_index."""
+    start = quote_index
+    if start > 0 and contents[start - 1] in 'rR':
+      start -= 1
+    if start > 0 and contents[start - 1] in 'uUbB':
+      start -= 1
+    if start == quote_index or start == 0:
+      return start
+    if contents[start - 1] in _PY_WORD_CHARS:
+      if contents[start - 1].isdigit():
+        # It depends on whether this continues a NAME or a NUMBER.
+        raise _UnclassifiableConstructError('string prefix after digit')
+      # The would-be prefix is really the tail of a NAME.
+      return quote_index
+    return start
+
+  @staticmethod
+  def _FollowsOperator(contents, start, last_string_end, last_comment_end):
+    """Return whether the token before the string at start is an OP."""
+    i = start - 1
+    while i >= 0:
+      c = contents[i]
+      if c in ' \t\f':
+        i -= 1
+      elif c == '\n':
+        j = i - 1
+        if j >= 0 and contents[j] == '\r':
+          j -= 1
+        if j < 0 or contents[j] != '\\' or last_comment_end == j + 1:
+          # A NEWLINE or NL token.
+          return False
+        # A backslash continuation, which produces no token.
+        i = j - 1
+      elif c in '\'"':
+        if i + 1 != last_string_end:
+          raise _UnclassifiableConstructError('stray quote before string')
+        return False
+      elif c in _PY_WORD_CHARS:
+        return False
+      elif c in _PY_OPERATOR_CHARS:
+        if c == '.' and i > 0 and contents[i - 1].isdigit():
+          # This may be the end of a NUMBER, like "1."
+          raise _UnclassifiableConstructError('number before string')
+        return True
+      else:
+        raise _UnclassifiableConstructError('%r before string' % c)
+    # Start of file.
+    return False
+
+
 class PythonCommentExtractor(CommentExtractor):
   """Extract comments and docstrings from Python source."""
 
   def ExtractComments(self, file_obj):
-    return _PythonTokenizingExtractor(file_obj).ExtractComments()
+    try:
+      return _PythonScanningExtractor(file_obj).ExtractComments()
+    except _UnclassifiableConstructError, e:
+      logging.debug('Tokenizing %s instead of scanning it: %s',
+                    file_obj.filename, e)
+      return _PythonTokenizingExtractor(file_obj).ExtractComments()
 
   def CommentWithoutDelimiters(self, text):
     """Given a Python comment, return the text without comment delimiters."""
@@ -784,32 +1037,349 @@ class PythonCommentExtractor(CommentExtractor):
     return text[quote_start+3:-3]
 
 
-class _ShellLikeTokenizingExtractor(_TokenizingExtractor):
-  """A _TokenizingExtractor for shell scripts and similar files."""
+class _HashCommentScanningExtractor(object):
+  """Base class for single-pass extractors of comments introduced by #.
+
+  Subclasses implement _Scan, which walks self._contents once and calls
+  _AddComment for each comment it finds, in order.
+  """
 
   def __init__(self, file_obj):
-    _TokenizingExtractor.__init__(self, file_obj)
-    self._brace_depth = 0
+    self._file_obj = file_obj
+    self._contents = None
+    self._comments = None
+    self._lineno = 1
+    # Newlines before this index have already been counted into _lineno.
+    self._counted_to = 0
+
+  def ExtractComments(self):
+    """Extract comments from file."""
+    if self._comments is not None:
+      return self._comments
+    self._comments = []
+    stopwatch.sw.start('scan_comments')
+    self._contents = self._file_obj.Contents()
+    self._Scan()
+    stopwatch.sw.stop('scan_comments')
+    return self._comments
+
+  def _AddComment(self, start, end=None):
+    """Add the comment running from start to the end of its line.
+
+    Args:
+      start: int, the index of the comment's #
+      end: int, where the comment ends, if before the end of its line
+
+    Returns:
+      int, the index just past the comment
+    """
+    contents = self._contents
+    if end is None:
+      end = contents.find('\n', start)
+      if end == -1:
+        end = len(contents)
+    self._lineno += contents.count('\n', self._counted_to, start)
+    self._counted_to = start
+    self._comments.append(Comment(self._file_obj.filename, self._lineno, start,
+                                  contents[start:end].rstrip()))
+    return end
+
+  def _Scan(self):
+    raise NotImplementedError
+
+
+_SH_CODE_RE = re.compile(
+    r'''#|\$'|'|"|`|\\.|\$\(\(|\(\(|\$\(|\(|\)|<<<|<<-|<<|\n''', re.S)
+_SH_DOUBLE_QUOTED_RE = re.compile(r'"|`|\\.|\$\(\(|\$\(', re.S)
+_SH_ANSI_C_QUOTED_REST_RE = re.compile(r"(?:[^'\\]|\\.)*'", re.S)
+_SH_PARENS_RE = re.compile(r'[()]')
+# What ends a comment inside backquotes: the closing backquote, or the line.
+_SH_BACKQUOTED_COMMENT_END_RE = re.compile(r'\\`|`|\n')
+_SH_HEREDOC_DELIMITER_RE = re.compile(
+    r'''[ \t]*(?:(['"])([^\s'"]+)\1|\\?([A-Za-z_][^\s;&|()<>'"`]*))''')
+# Characters after which a # begins a comment in shell.
+_SH_WORD_BREAK_CHARS = frozenset(' \t\r\n;&|()<>')
+
+
+class _ShellScanningExtractor(_HashCommentScanningExtractor):
+  """Extract comments from shell scripts.
+
+  This tracks quoting, command substitution (which may nest inside double
+  quotes), arithmetic expansion and here-documents well enough to tell a
+  comment from a # that is part of a word, a string, an expansion like ${#foo},
+  or the body of a here-document.
+  """
+
+  def _Scan(self):
+    contents = self._contents
+    length = len(contents)
+    # Open contexts: '"' for double quotes, '(' for parentheses and command
+    # substitution, '`' for backquotes. The bottom, empty, is the script.
+    stack = []
+    heredocs = []
+    pos = 0
+    while pos < length:
+      top = stack and stack[-1]
+      if top == '"':
+        match = _SH_DOUBLE_QUOTED_RE.search(contents, pos)
+      else:
+        match = _SH_CODE_RE.search(contents, pos)
+      if not match:
+        break
+      token = match.group()
+      pos = match.end()
+
+      if token[0] == '\\':
+        continue
+      elif top == '"':
+        if token == '"':
+          stack.pop()
+        elif token == '`':
+          stack.append('`')
+        elif token == '$((':
+          pos = self._SkipArithmetic(pos)
+        else:
+          stack.append('(')
+      elif token == '#':
+        if self._AtWordStart(match.start()):
+          end = None
+          if '`' in stack:
+            # The closing backquote ends the comment, and the substitution.
+            end = self._BackquotedCommentEnd(pos)
+          pos = self._AddComment(match.start(), end)
+      elif token == "'":
+        end = contents.find("'", pos)
+        if end == -1:
+          break
+        pos = end + 1
+      elif token == "$'":
+        rest = _SH_ANSI_C_QUOTED_REST_RE.match(contents, pos)
+        if not rest:
+          break
+        pos = rest.end()
+      elif token == '"':
+        stack.append('"')
+      elif token == '`':
+        if '`' in stack:
+          # Closes the innermost backquotes, and whatever is open inside.
+          del stack[len(stack) - stack[::-1].index('`') - 1:]
+        else:
+          stack.append('`')
+      elif token in ('((', '$(('):
+        pos = self._SkipArithmetic(pos)
+      elif token in ('(', '$('):
+        stack.append('(')
+      elif token == ')':
+        if top == '(':
+          stack.pop()
+      elif token in ('<<', '<<-'):
+        delimiter = _SH_HEREDOC_DELIMITER_RE.match(contents, pos)
+        if delimiter:
+          heredocs.append((delimiter.group(2) or delimiter.group(3),
+                           token == '<<-'))
+          pos = delimiter.end()
+      elif token == '\n' and heredocs:
+        pos = self._SkipHeredocs(pos, heredocs)
+        heredocs = []
+
+  def _BackquotedCommentEnd(self, pos):
+    """Return where a comment inside backquotes, going on at pos, ends."""
+    for match in _SH_BACKQUOTED_COMMENT_END_RE.finditer(self._contents, pos):
+      if match.group() in ('`', '\n'):
+        return match.start()
+    return len(self._contents)
+
+  def _AtWordStart(self, i):
+    """Return whether the character at i begins a word."""
+    contents = self._contents
+    # Look through backslash-newline line continuations.
+    while i >= 2 and contents[i - 1] == '\n' and contents[i - 2] == '\\':
+      i -= 2
+    return i == 0 or contents[i - 1] in _SH_WORD_BREAK_CHARS
+
+  def _SkipArithmetic(self, pos):
+    """Return the index just past the $((...)) or ((...)) open before pos."""
+    depth = 2
+    for paren in _SH_PARENS_RE.finditer(self._contents, pos):
+      if paren.group() == '(':
+        depth += 1
+      else:
+        depth -= 1
+        if not depth:
+          return paren.end()
+    return len(self._contents)
+
+  def _SkipHeredocs(self, pos, heredocs):
+    """Return the index just past the bodies of heredocs, starting at pos.
+
+    Args:
+      pos: int, the start of the line after the here-document operators
+      heredocs: seq of (str, bool), the delimiter of each here-document and
+                whether leading tabs are stripped from its lines (<<-)
+
+    Returns:
+      int
+    """
+    contents = self._contents
+    length = len(contents)
+    for delimiter, strip_tabs in heredocs:
+      while pos < length:
+        end = contents.find('\n', pos)
+        if end == -1:
+          end = length
+        line = contents[pos:end].rstrip('\r')
+        pos = end + 1
+        if strip_tabs:
+          line = line.lstrip('\t')
+        if line == delimiter:
+          break
+    return min(pos, length)
+
+
+_YAML_SPECIAL_RE = re.compile(r'''[#'"]''')
+_YAML_DOUBLE_QUOTED_REST_RE = re.compile(r'(?:[^"\\]|\\.)*"')
+_YAML_BLOCK_SCALAR_RE = re.compile(r'(?:^|[\s:\-\[,?])[|>][-+0-9]*[ \t\r]*$',
+                                   re.M)
+# Characters after which a quote begins a quoted scalar.
+_YAML_SCALAR_START_CHARS = frozenset(':-[{,?')
+
+
+class _YamlScanningExtractor(_HashCommentScanningExtractor):
+  """Extract comments from YAML.
+
+  A # begins a comment at the start of a line or after whitespace, but not
+  inside a quoted scalar (which may span lines) or a block scalar (| or >).
+  """
+
+  def _Scan(self):
+    contents = self._contents
+    length = len(contents)
+    # The quote of a quoted scalar continuing from a previous line, if any.
+    quote = None
+    # The indentation of the line that began the current block scalar, if any.
+    block_indent = None
+    pos = 0
+    while pos < length:
+      line_start = pos
+      eol = contents.find('\n', pos)
+      if eol == -1:
+        eol = length
+      indent = len(contents[pos:eol]) - len(contents[pos:eol].lstrip(' '))
+
+      if block_indent is not None:
+        if indent > block_indent or not contents[pos:eol].strip():
+          pos = eol + 1
+          continue
+        block_indent = None
+
+      if quote:
+        pos = self._SkipQuoted(quote, pos, eol)
+        if pos is None:
+          pos = eol + 1
+          continue
+        quote = None
+
+      code_end = eol
+      while True:
+        match = _YAML_SPECIAL_RE.search(contents, pos, eol)
+        if not match:
+          break
+        start = match.start()
+        if match.group() == '#':
+          if start == line_start or contents[start - 1] in ' \t':
+            self._AddComment(start)
+            code_end = start
+            break
+          pos = start + 1
+        elif self._StartsScalar(line_start, start):
+          pos = self._SkipQuoted(match.group(), start + 1, eol)
+          if pos is None:
+            quote = match.group()
+            break
+        else:
+          pos = start + 1
+
+      if not quote and _YAML_BLOCK_SCALAR_RE.search(contents, line_start,
+                                                    code_end):
+        block_indent = indent
+      pos = eol + 1
+
+  def _StartsScalar(self, line_start, i):
+    """Return whether the quote at i begins a quoted scalar."""
+    contents = self._contents
+    i -= 1
+    while i >= line_start and contents[i] in ' \t':
+      i -= 1
+    return i < line_start or contents[i] in _YAML_SCALAR_START_CHARS
+
+  def _SkipQuoted(self, quote, pos, eol):
+    """Return the index past the quote closing a scalar, or None if not on line.
+
+    Args:
+      quote: str, the quote character that opened the scalar
+      pos: int, where in the scalar to start looking
+      eol: int, the end of the line to look on
+
+    Returns:
+      int or None
+    """
+    contents = self._contents
+    if quote == '"':
+      rest = _YAML_DOUBLE_QUOTED_REST_RE.match(contents, pos, eol)
+      return rest and rest.end()
+    while True:
+      end = contents.find("'", pos, eol)
+      if end == -1:
+        return None
+      if contents.startswith("''", end):
+        pos = end + 2
+        continue
+      return end + 1
+
+
+_LINE_START_COMMENT_RE = re.compile(r'^#', re.M)
+_UNESCAPED_COMMENT_RE = re.compile(r'(?<!\\)#')
 
-  def _HandleToken(self, token_tuple):
-    token_type, _, _, _, _ = token_tuple
-    if token_type == tokenize.COMMENT:
-      self._AddComment(token_tuple)
+
+class _IgnoreFileScanningExtractor(_HashCommentScanningExtractor):
+  """Extract comments from .gitignore or .hgignore files."""
+
+  def __init__(self, file_obj, inline_comments):
+    """Initialize.
+
+    Args:
+      file_obj: ScannedFile, the file to get comments from
+      inline_comments: bool, whether an unescaped # anywhere in a line begins a
+                       comment (as in .hgignore), rather than only at the
+                       start of a line (as in .gitignore)
+    """
+    _HashCommentScanningExtractor.__init__(self, file_obj)
+    self._inline_comments = inline_comments
+
+  def _Scan(self):
+    if self._inline_comments:
+      comment_re = _UNESCAPED_COMMENT_RE
+    else:
+      comment_re = _LINE_START_COMMENT_RE
+    pos = 0
+    while True:
+      match = comment_re.search(self._contents, pos)
+      if not match:
+        break
+      pos = self._AddComment(match.start())
 
 
 class ShellLikeCommentExtractor(CommentExtractor):
-  """Comment extractor for shell-like (#) comments.
+  """Comment extractor for shell scripts, and base for other # comments.
 
-  This extractor uses the Python tokenizer, since it shares the same comment
-  delimiter. Limitations:
-   - Won't find comments inside triple-quoted strings.
-   - Doesn't handle here-documents.
-   - False positives on ${#foo}, ${fo#o}, and ${fo##o}.
+  Limitations:
+   - A "case" pattern's closing ) inside $(...) ends the substitution early.
+   - Here-document delimiters must be words, optionally quoted.
   """
 
   def ExtractComments(self, file_obj):
     """Extract comments from file."""
-    return _ShellLikeTokenizingExtractor(file_obj).ExtractComments()
+    return _ShellScanningExtractor(file_obj).ExtractComments()
 
   def CommentWithoutDelimiters(self, text):
     # Strip up to one space after the #.
@@ -818,6 +1388,34 @@ class ShellLikeCommentExtractor(CommentExtractor):
     return text[1:]
 
 
+class YamlCommentExtractor(ShellLikeCommentExtractor):
+  """Comment extractor for YAML files."""
+
+  def ExtractComments(self, file_obj):
+    """Extract comments from file."""
+    return _YamlScanningExtractor(file_obj).ExtractComments()
+
+
+class IgnoreFileCommentExtractor(ShellLikeCommentExtractor):
+  """Comment extractor for VCS ignore files."""
+
+  def __init__(self, inline_comments=False):
+    """Initialize.
+
+    Args:
+      inline_comments: bool, whether an unescaped # anywhere in a line begins a
+                       comment (as in .hgignore), rather than only at the
+                       start of a line (as in .gitignore)
+    """
+    ShellLikeCommentExtractor.__init__(self)
+    self._inline_comments = inline_comments
+
+  def ExtractComments(self, file_obj):
+    """Extract comments from file."""
+    return _IgnoreFileScanningExtractor(
+        file_obj, self._inline_comments).ExtractComments()
+
+
 def _GetReplacementText(comment_text, extractor):
   new_text = extractor.CommentWithoutDelimiters(comment_text)
   new_text = _StripTrailingSpaceFromLastLines(new_text)
@@ -12,6 +12,8 @@ Args:
 
 __author__ = 'dbentley@google.com (Dan Bentley)'
 
+import collections
+import json as simplejson
 import locale
 import os
 import re
@@ -57,6 +59,10 @@ flags.DEFINE_string('explicit_inputfile_list', '',
                     'List of files (with same base directory) to scrub')
 flags.DEFINE_string('temp_dir', '',
                     'Path of a temporary directory to use')
+flags.DEFINE_string('error_log', '',
+                    'Path of a file to write errors to as they are found, '
+                    'one JSON object per line. Only counts of errors are kept '
+                    'in memory, and reported.')
 
 DIFFS_DIR = 'diffs'
 ORIGINAL_DIR = 'originals'
@@ -75,13 +81,14 @@ class ScrubberConfig(object):
   """
 
   def __init__(self, codebase, input_files, extension_to_scrubber_map,
-               default_scrubbers, modify, output_tar, temp_dir):
+               default_scrubbers, modify, output_tar, temp_dir, error_log=''):
     # Other object state.
     self.codebase = os.path.abspath(codebase)
     self.input_files = input_files
     self.modify = modify
     self.output_tar = output_tar
     self.temp_dir = temp_dir
+    self.error_log = error_log
     self._comment_scrubbers = None
     self._sensitive_string_scrubbers = None
 
@@ -167,8 +174,11 @@ class ScrubberConfig(object):
           '.h': go_and_c_scrubbers,
           '.c': go_and_c_scrubbers,
           '.cc': go_and_c_scrubbers,
-          '.hgignore': self._MakeShellScrubbers(),
-          '.gitignore': self._MakeShellScrubbers(),
+          '.hgignore': self._MakeShellScrubbers(
+              comment_scrubber.IgnoreFileCommentExtractor(
+                  inline_comments=True)),
+          '.gitignore': self._MakeShellScrubbers(
+              comment_scrubber.IgnoreFileCommentExtractor()),
           '.html': self._MakeHtmlScrubbers(),
           '.java': self._MakeJavaScrubbers(),
           '.jj': self._MakeJavaScrubbers(),
@@ -183,7 +193,8 @@ class ScrubberConfig(object):
           '.protodevel': self._MakeProtoScrubbers(),
           '.py': self._MakePythonScrubbers(),
           '.css': self._PolyglotFileScrubbers(),
-          '.yaml': self._MakeShellScrubbers(),
+          '.yaml': self._MakeShellScrubbers(
+              comment_scrubber.YamlCommentExtractor()),
           '.sh': self._MakeShellScrubbers(),
           '.json': self._PolyglotFileScrubbers(),
           '.swig': go_and_c_scrubbers,
@@ -384,16 +395,137 @@ class ScrubberConfig(object):
     proto_scrubbers.extend(self._PolyglotFileScrubbers())
     return proto_scrubbers
 
-  def _MakeShellScrubbers(self):
+  def _MakeShellScrubbers(self, extractor=None):
     shell_scrubbers = []
     shell_scrubbers.append(
         comment_scrubber.CommentScrubber(
-            comment_scrubber.ShellLikeCommentExtractor(),
+            extractor or comment_scrubber.ShellLikeCommentExtractor(),
             comment_scrubbers=self._CommentScrubbers()))
     shell_scrubbers.extend(self._PolyglotFileScrubbers())
     return shell_scrubbers
 
 
+class ErrorSink(object):
+  """An ErrorSink receives the errors found in a scrub, and counts them.
+
+  Errors hold on to the files they were found in (and so their contents), so
+  sinks shouldn't keep the errors themselves.
+
+  Instance members:
+    error_count: int, the number of errors added
+    counts_by_trigger: {(str, str): int}, error counts by (filter, trigger)
+    counts_by_extension: {str: int}, error counts by extension of the file
+                         they were found in
+  """
+
+  def __init__(self):
+    self.error_count = 0
+    self.counts_by_trigger = collections.defaultdict(int)
+    self.counts_by_extension = collections.defaultdict(int)
+
+  def AddError(self, error):
+    """Add a base.ScrubberError or str error."""
+    self.error_count += 1
+    if not isinstance(error, basestring):
+      self.counts_by_trigger[(error.filter, error.trigger)] += 1
+      _, extension = os.path.splitext(error.file_obj.relative_filename)
+      self.counts_by_extension[extension] += 1
+
+  def ReportLines(self):
+    """Lines describing the errors, for ScrubberContext.Report.
+
+    Unknown usernames are left out, as ScrubberContext.Report summarizes them.
+    """
+    if not self.error_count:
+      return []
+    result = ['Found %d errors' % self.error_count]
+    for (filter_name, trigger), count in sorted(
+        self.counts_by_trigger.iteritems()):
+      if filter_name != comment_scrubber.TodoError.FILTER_NAME:
+        result.append(u'  %s %s %d' % (filter_name, trigger, count))
+    result.append('Found errors in files with extensions:')
+    for extension, count in sorted(self.counts_by_extension.iteritems()):
+      result.append(u'  %s %d' % (extension or '(none)', count))
+    return result
+
+  def Close(self):
+    """Release what the sink holds. No errors may be added after this."""
+
+
+class InMemoryErrorSink(ErrorSink):
+  """Keeps a line of report text for each error, up to max_listed of them.
+
+  Unknown usernames are only counted, as ScrubberContext.Report summarizes
+  them.
+  """
+
+  def __init__(self, max_listed=1000):
+    """Initialize.
+
+    Args:
+      max_listed: int, the most errors to keep report text for
+    """
+    ErrorSink.__init__(self)
+    self._max_listed = max_listed
+    self._listed = []
+    self._unlisted_count = 0
+
+  def AddError(self, error):
+    ErrorSink.AddError(self, error)
+    if isinstance(error, comment_scrubber.TodoError):
+      return
+    if len(self._listed) >= self._max_listed:
+      self._unlisted_count += 1
+    elif isinstance(error, basestring):
+      self._listed.append(error)
+    else:
+      self._listed.append(
+          'ERROR[entry:<filter:"%s" trigger:"%s" filename:"%s">]: %s' % (
+              error.filter, error.trigger, error.file_obj.relative_filename,
+              error.ReportText()))
+
+  def ReportLines(self):
+    result = list(self._listed)
+    if self._unlisted_count:
+      result.append('... and %d more errors' % self._unlisted_count)
+    return result + ErrorSink.ReportLines(self)
+
+
+class JsonLinesErrorSink(ErrorSink):
+  """Writes each error to a file as a line of JSON, as soon as it's added."""
+
+  def __init__(self, filename):
+    """Initialize.
+
+    Args:
+      filename: str, the file to write errors to
+    """
+    ErrorSink.__init__(self)
+    self.filename = filename
+    # Line buffered, so the file is complete even if the scrub dies.
+    self._file = open(filename, 'w', 1)
+
+  def AddError(self, error):
+    ErrorSink.AddError(self, error)
+    if isinstance(error, basestring):
+      error_json = {'reason': error}
+    else:
+      error_json = {'filter': error.filter,
+                    'trigger': error.trigger,
+                    'filename': error.file_obj.relative_filename,
+                    'reason': error.reason}
+    self._file.write(simplejson.dumps(error_json, sort_keys=True) + '\n')
+
+  def ReportLines(self):
+    result = ErrorSink.ReportLines(self)
+    if result:
+      result.append('Wrote errors into %s' % self.filename)
+    return result
+
+  def Close(self):
+    self._file.close()
+
+
 class ScrubberContext(object):
   """The ScrubberContext collects the context for a scrub.
 
@@ -403,11 +535,24 @@ class ScrubberContext(object):
     saved somewhere.
   """
 
-  def __init__(self, scrubber_config):
+  def __init__(self, scrubber_config, error_sink=None):
+    """Initialize.
+
+    Args:
+      scrubber_config: ScrubberConfig
+      error_sink: ErrorSink, where to put errors. By default, a
+                  JsonLinesErrorSink if the config has an error_log, else an
+                  InMemoryErrorSink.
+    """
     locale.setlocale(locale.LC_ALL, 'en_US.utf-8')
     os.environ['LANG'] = 'en_US.UTF-8'
     self.config = scrubber_config
-    self._errors = []
+    if error_sink is None:
+      if scrubber_config.error_log:
+        error_sink = JsonLinesErrorSink(scrubber_config.error_log)
+      else:
+        error_sink = InMemoryErrorSink()
+    self._error_sink = error_sink
     self.CreateTempDir()
     self.files = self.FindFiles(scrubber_config)
     self._unscrubbed_file_extensions = set()
@@ -428,29 +573,23 @@ class ScrubberContext(object):
     if self.config.whitelist.Allows(error):
       return
 
-    self._errors.append(error)
+    self._error_sink.AddError(error)
 
   def Report(self):
     """Report on this run of scrubber to stdout."""
     print 'Scanned %d files' % len(self.files)
     print 'Found %d files to modify' % len(self.ModifiedFiles())
 
+    for line in self._error_sink.ReportLines():
+      print line
+
     username_to_count_map = {}
     unknown_username_instances = 0
-    for error in self._errors:
-      if isinstance(error, comment_scrubber.TodoError):
-        username_to_count_map[error.username] = username_to_count_map.get(
-            error.username, 0) + 1
-        unknown_username_instances += 1
-      else:
-        if isinstance(error, str):
-          report_string = str
-        else:
-          report_string = (
-              'ERROR[entry:<filter:"%s" trigger:"%s" filename:"%s">]: %s' % (
-                  error.filter, error.trigger, error.file_obj.relative_filename,
-                  error.ReportText()))
-        print report_string
+    for (filter_name, trigger), count in (
+        self._error_sink.counts_by_trigger.iteritems()):
+      if filter_name == comment_scrubber.TodoError.FILTER_NAME:
+        username_to_count_map[trigger] = count
+        unknown_username_instances += count
     if unknown_username_instances:
       print 'Found unknown usernames %d times' % unknown_username_instances
       for username, count in username_to_count_map.iteritems():
@@ -469,7 +608,7 @@ class ScrubberContext(object):
 
   def Status(self):
     """Return a status code suitable for process exit status."""
-    if self._errors:
+    if self._error_sink.error_count:
       return 1
     return 0
 
@@ -566,6 +705,10 @@ class ScrubberContext(object):
         self.AddError('tar finished unsuccessfully')
     stopwatch.sw.stop('write_output')
 
+  def Close(self):
+    """Close the error sink, once nothing more will be added to it."""
+    self._error_sink.Close()
+
   def CleanUp(self):
     shutil.rmtree(self._temp_dir, ignore_errors=True)
 
@@ -740,6 +883,7 @@ def ScrubberConfigFromJson(codebase,
                            modify=False,
                            output_tar='',
                            temp_dir='',
+                           error_log='',
                            **unused_kwargs):
   """Generate a ScrubberConfig object from a ScrubberConfig JSON object."""
 
@@ -761,7 +905,8 @@ def ScrubberConfigFromJson(codebase,
   config_utils.CheckJsonKeys('scrubber config', config_json,
                              _SCRUBBER_CONFIG_KEYS)
   config = ScrubberConfig(codebase, input_files, extension_to_scrubber_map,
-                          default_scrubbers, modify, output_tar, temp_dir)
+                          default_scrubbers, modify, output_tar, temp_dir,
+                          error_log=error_log)
 
   # General options.
   SetOption(u'ignore_files_re', func=re.compile)
@@ -896,6 +1041,10 @@ class ScannedFile(object):
     is_deleted: bool, if the file has been deleted during scrubbing
   """
 
+  __slots__ = ('filename', 'relative_filename', 'output_relative_filename',
+               'is_modified', '_contents', '_in_unicode', '_temp_dir',
+               'is_deleted')
+
   def __init__(self, filename, relative_filename, temp_dir,
                output_relative_filename):
     self.filename = filename
@@ -1157,9 +1306,12 @@ def main(args):
     context = ScrubberContext(config_obj)
 
   print 'Found %d files' % len(context.files)
-  context.Scan()
+  try:
+    context.Scan()
 
-  context.WriteOutput()
+    context.WriteOutput()
+  finally:
+    context.Close()
   context.Report()
 
   stopwatch.sw.stop()
@@ -10,6 +10,10 @@ from google.apputils import stopwatch
 from moe.scrubber import base
 
 
+# Never matches; the candidate regex of a scrubber with nothing to look for.
+_NOTHING_RE = re.compile(r'(?!)')
+
+
 class SensitiveStringScrubber(base.FileScrubber):
   """Base class for scrubbers that find sensitive strings in files."""
 
@@ -23,6 +27,14 @@ class SensitiveStringScrubber(base.FileScrubber):
       context.AddError(base.ScrubberError(self.FilterName(), w, '', file_obj))
     stopwatch.sw.stop(timer)
 
+  def CandidateRe(self):
+    """A regex that matches any text in which sensitive strings may be found.
+
+    Returns:
+      compiled regex, or None if this scrubber can't say
+    """
+    return None
+
   def _TimerName(self):
     """The name of the stopwatch timer for a specific subclass."""
     return self.FilterName().lower() + 's'
@@ -44,6 +56,14 @@ class SensitiveReScrubber(SensitiveStringScrubber):
       result.extend(m.group() for m in sensitive_re.finditer(text))
     return result
 
+  def CandidateRe(self):
+    if not self.sensitive_res:
+      return _NOTHING_RE
+    candidate_res = base.CombineRes(self.sensitive_res)
+    if len(candidate_res) == 1:
+      return candidate_res[0]
+    return None
+
   def FilterName(self):
     return 'SENSITIVE_RE'
 
@@ -95,6 +115,9 @@ class SensitiveWordScrubber(SensitiveStringScrubber):
         result.append(hit_text.lower())
     return result
 
+  def CandidateRe(self):
+    return self.words_re or _NOTHING_RE
+
   def FilterName(self):
     return 'SENSITIVE_WORD'
 
@@ -6,6 +6,9 @@
 
 __author__ = 'dbentley@google.com (Daniel Bentley)'
 
+import time
+
+from google.apputils import app
 from google.apputils import appcommands
 
 from moe import db_client
@@ -28,3 +31,32 @@ class CheckConfigCmd(appcommands.Cmd):
                                                 'Checking Config')
     with task:
       moe_app.RUN.ui.Info('Success!')
+
+
+class CacheCmd(appcommands.Cmd):
+  """Inspect or trim the cache of expanded codebases.
+
+  moe cache stats: list the cached expansions and their sizes.
+  moe cache gc: remove the least recently used expansions until the cache is
+    within --expansion_cache_max_bytes.
+  """
+
+  def Run(self, argv):
+    if len(argv) != 2 or argv[1] not in ('stats', 'gc'):
+      raise app.UsageError('Usage: moe cache stats|gc')
+    cache = moe_app.ExpansionCacheFromFlags()
+    if not cache:
+      print 'The expansion cache is disabled.'
+      return
+    if argv[1] == 'gc':
+      removed, freed = cache.GarbageCollect()
+      print 'Removed %d expansions, freeing %d bytes' % (removed, freed)
+      return
+    entries = cache.Entries()
+    for digest, size, last_used in entries:
+      print '%s %12d  %s' % (
+          digest, size,
+          time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_used)))
+    print '%d expansions, %d of %d bytes in %s' % (
+        len(entries), sum(size for _, size, _ in entries), cache.max_bytes,
+        cache.cache_dir)
@@ -5,6 +5,7 @@
 
 __author__ = 'dbentley@google.com (Dan Bentley)'
 
+import collections
 import getpass
 import mimetypes
 import os
@@ -28,6 +29,11 @@ FLAGS = flags.FLAGS
 
 SVN_VERSION_RE = re.compile(r'svn, version 1\.(.)')
 
+# What svn status says of entries that aren't (or won't be) versioned files
+# in the working copy.
+_UNLISTED_STATUSES = frozenset(
+    ['unversioned', 'ignored', 'deleted', 'missing', 'external'])
+
 
 class SvnClient(base.CodebaseClient):
   """Implementation for Subversion-stored codebases."""
@@ -211,6 +217,9 @@ class SvnEditor(base.CodebaseEditor):
 
     self._modified = None
     self._diff = None
+    # The svn commands PutFile needs run, as {args: [relative filename]}.
+    self._pending = collections.defaultdict(list)
+    self._files = base.ClientFiles(client.checkout, self._ListFiles)
 
   def Checkout(self):
     """Check out code and test if we're authenticated."""
@@ -222,7 +231,27 @@ class SvnEditor(base.CodebaseEditor):
   def Walk(self):
     """Walks the client for existent files. Returns a list of str's."""
     # TODO(dbentley): obey additional_files_re
-    return base.ListFiles(self.client.checkout, re.compile(r'\.svn'))
+    return self._files.Files()
+
+  def _ListFiles(self, include_untracked):
+    """List the versioned files (and unversioned ones, if asked)."""
+    status = self.RunSvn(['status', '--verbose', '--xml'], need_stdout=True)
+    status_tree = ElementTree.XML(status.encode('UTF-8'))
+    files = []
+    for entry in status_tree.find('target').findall('entry'):
+      path = base.EncodeFilename(entry.get('path'))
+      item = entry.find('wc-status').get('item')
+      if item == 'unversioned' and include_untracked:
+        # svn only lists an unversioned directory, not what's in it.
+        abs_path = os.path.join(self.client.checkout, path)
+        if os.path.isdir(abs_path):
+          files.extend(os.path.join(path, f)
+                       for f in base.ListFiles(abs_path, None))
+          continue
+      elif item in _UNLISTED_STATUSES:
+        continue
+      files.append(path)
+    return files
 
   def PutFile(self, relative_dest, src):
     """Make relative_dest be src.
@@ -246,7 +275,8 @@ class SvnEditor(base.CodebaseEditor):
           (relative_dest, src, abs_dest))
     if not src_exists:
       # We need to delete this file.
-      self.RunSvn(['rm', relative_dest])
+      self._pending[('rm',)].append(relative_dest)
+      self._files.Remove(relative_dest)
 
       # TODO(dbentley): handle newly-empty directories
       return
@@ -256,7 +286,8 @@ class SvnEditor(base.CodebaseEditor):
     shutil.copyfile(src, abs_dest)
 
     if not dest_exists:
-      self.RunSvn(['add', '--parents', relative_dest])
+      self._pending[('add', '--parents')].append(relative_dest)
+      self._files.Add(relative_dest)
 
       # Add mime-types for new files.
       mimetype, _ = mimetypes.guess_type(relative_dest)
@@ -265,13 +296,24 @@ class SvnEditor(base.CodebaseEditor):
         if mimetype in ['application/x-javascript', 'application/javascript']:
           mimetype = 'text/javascript'
 
-        self.RunSvn(['propset', 'svn:mime-type', mimetype, relative_dest])
+        self._pending[('propset', 'svn:mime-type', mimetype)].append(
+            relative_dest)
 
     if dest_executable != src_executable:
       if src_executable:
-        self.RunSvn(['propset', 'svn:executable', '*', relative_dest])
+        self._pending[('propset', 'svn:executable', '*')].append(relative_dest)
       else:
-        self.RunSvn(['propdel', 'svn:executable', relative_dest])
+        self._pending[('propdel', 'svn:executable')].append(relative_dest)
+
+  def _RunPending(self):
+    """Run the svn commands PutFile needs, one per kind of change."""
+    # Deletions and additions first, so properties are set on added files.
+    order = {'rm': 0, 'add': 1}
+    for args in sorted(self._pending, key=lambda args: (order.get(args[0], 2),
+                                                        args)):
+      with base.ListFile(self._pending[args]) as targets:
+        self.RunSvn(list(args) + ['--targets', targets])
+    self._pending.clear()
 
   def ChangesMade(self):
     if self._modified is None:
@@ -280,6 +322,7 @@ class SvnEditor(base.CodebaseEditor):
 
   def FinalizeChange(self, commit_message, report):
     """Describe the state we're in."""
+    self._RunPending()
     # TODO(dbentley): refactor into _IsWorkingDirectoryDirty for svn.
     msg_filename = os.path.join(self.client.checkout, 'svn-commit.tmp')
     if os.path.exists(msg_filename):
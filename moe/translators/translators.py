@@ -101,8 +101,8 @@ class ScrubberInvokingTranslator(Translator):
                    '--config_data', simplejson.dumps(self._scrubber_config),
                    codebase.ExpandedPath()])
 
-      return codebase_utils.Codebase(output_tar_filename,
-                                     project_space=self._to_project_space)
+      return codebase_utils.ArchiveCodebase(
+          output_tar_filename, project_space=self._to_project_space)
 
 
 class IdentityTranslator(Translator):
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+"""Tests for moe.base."""
+
+import json
+import os
+import re
+import shutil
+import tarfile
+import threading
+import time
+
+import gflags as flags
+from google.apputils import basetest
+
+from moe import base
+
+FLAGS = flags.FLAGS
+
+
+class ListFilesTest(basetest.TestCase):
+
+  def setUp(self):
+    self.root = os.path.join(FLAGS.test_tmpdir, 'list_files')
+    shutil.rmtree(self.root, ignore_errors=True)
+    for d in ['a/b', '.git/objects', 'c/.svn']:
+      os.makedirs(os.path.join(self.root, d))
+    for f in ['f', 'a/g', 'a/b/h', '.git/objects/o', '.gitignore', 'c/.svn/x',
+              'c/y']:
+      open(os.path.join(self.root, f), 'w').write(f)
+    os.symlink('a', os.path.join(self.root, 'link_to_dir'))
+    os.symlink('f', os.path.join(self.root, 'link_to_file'))
+
+  def testListFiles(self):
+    self.assertItemsEqual(
+        ['f', 'a/g', 'a/b/h', '.git/objects/o', '.gitignore', 'c/.svn/x',
+         'c/y', 'link_to_file'],
+        base.ListFiles(self.root, None))
+    self.assertItemsEqual(
+        ['f', 'a/g', 'a/b/h', 'c/.svn/x', 'c/y', 'link_to_file'],
+        base.ListFiles(self.root, re.compile(r'^\.git')))
+
+  def testDirsToIgnore(self):
+    svn_re = re.compile(r'\.svn')
+    self.assertEqual(base.ListFiles(self.root, svn_re),
+                     base.ListFiles(self.root, svn_re, svn_re))
+    self.assertItemsEqual(
+        ['f', 'a/g', '.git/objects/o', '.gitignore', 'c/.svn/x', 'c/y',
+         'link_to_file'],
+        base.ListFiles(self.root, None, re.compile(r'^a/b$')))
+
+  def testListFilesWithStats(self):
+    stats = dict(base.ListFilesWithStats(self.root, None))
+    self.assertEqual(len('a/b/h'), stats['a/b/h'].st_size)
+    self.assertEqual(os.stat(os.path.join(self.root, 'f')),
+                     stats['link_to_file'])
+
+
+class ExpansionCacheTest(basetest.TestCase):
+
+  def setUp(self):
+    self.root = os.path.join(FLAGS.test_tmpdir, 'expansion_cache')
+    shutil.rmtree(self.root, ignore_errors=True)
+    os.makedirs(self.root)
+    self.cache_dir = os.path.join(self.root, 'cache')
+
+  def MakeTar(self, name, contents):
+    src = os.path.join(self.root, 'src_' + name)
+    os.makedirs(src)
+    open(os.path.join(src, 'file'), 'w').write(contents)
+    path = os.path.join(self.root, name + '.tar')
+    tar = tarfile.open(path, 'w')
+    tar.add(os.path.join(src, 'file'), arcname='file')
+    tar.close()
+    return path
+
+  def testExpand(self):
+    archive = self.MakeTar('a', 'abc')
+    expanded = base.ExpansionCache(self.cache_dir, 1000).Expand(archive)
+    self.assertEqual('abc', open(os.path.join(expanded, 'file')).read())
+    self.assertEqual(os.path.join(self.cache_dir, base.HashFile(archive)),
+                     expanded)
+    # No scratch directories are left behind.
+    self.assertItemsEqual([os.path.basename(expanded),
+                           os.path.basename(expanded) + '.json',
+                           os.path.basename(expanded) + '.lock', '.archives'],
+                          os.listdir(self.cache_dir))
+
+  def testReusedAcrossInstances(self):
+    archive = self.MakeTar('a', 'abc')
+    expanded = base.ExpansionCache(self.cache_dir, 1000).Expand(archive)
+    marker = os.path.join(expanded, 'marker')
+    open(marker, 'w').close()
+    # An archive with the same contents, under another name, is a hit.
+    shutil.copy(archive, os.path.join(self.root, 'copy.tar'))
+    self.assertEqual(
+        expanded,
+        base.ExpansionCache(self.cache_dir, 1000).Expand(
+            os.path.join(self.root, 'copy.tar')))
+    self.assert_(os.path.exists(marker))
+
+  def testUnchangedArchiveIsNotReread(self):
+    archive = self.MakeTar('a', 'abc')
+    # Each run has its own CodebaseExpander, as Codebase.ExpandedPath uses.
+    expanded = base.CodebaseExpander(
+        self.root, base.ExpansionCache(self.cache_dir, 1000)
+        )._PossiblyExpandCodebase(archive)
+    self.assertEqual(os.path.join(self.cache_dir, base.HashFile(archive)),
+                     expanded)
+
+    hashed = []
+    original_hash_file = base.HashFile
+    def HashFile(path):
+      hashed.append(path)
+      return original_hash_file(path)
+    base.HashFile = HashFile
+    try:
+      self.assertEqual(expanded, base.CodebaseExpander(
+          self.root, base.ExpansionCache(self.cache_dir, 1000)
+          )._PossiblyExpandCodebase(archive))
+      self.assertEqual([], hashed)
+      # Once the archive changes, it's read again.
+      shutil.move(self.MakeTar('b', 'abd'), archive)
+      os.utime(archive, (0, 0))
+      self.assertNotEqual(expanded, base.CodebaseExpander(
+          self.root, base.ExpansionCache(self.cache_dir, 1000)
+          )._PossiblyExpandCodebase(archive))
+      self.assertEqual([archive], hashed)
+    finally:
+      base.HashFile = original_hash_file
+
+  def testEviction(self):
+    # An expansion an earlier run is done with.
+    earlier = base.ExpansionCache(self.cache_dir, 10)
+    a = earlier.Expand(self.MakeTar('a', '123456'))
+    earlier.Close()
+    os.utime(a + '.json', (0, 0))
+    cache = base.ExpansionCache(self.cache_dir, 10)
+    b = cache.Expand(self.MakeTar('b', '7890'))
+    self.assertEqual(10, sum(size for _, size, _ in cache.Entries()))
+    # Over budget: the least recently used expansion goes, the new one stays.
+    c = cache.Expand(self.MakeTar('c', 'abc'))
+    self.assertFalse(os.path.exists(a))
+    self.assertFalse(os.path.exists(a + '.json'))
+    self.assertFalse(os.path.exists(a + '.lock'))
+    self.assertItemsEqual(
+        [os.path.basename(b), os.path.basename(c)],
+        [digest for digest, _, _ in cache.Entries()])
+    # Expansions this cache returned are in use until it's closed.
+    self.assertEqual((0, 0), cache.GarbageCollect(max_bytes=0))
+    cache.Close()
+    self.assertEqual((2, 7), cache.GarbageCollect(max_bytes=0))
+    self.assertEqual([], cache.Entries())
+
+  def testExpansionsInUseElsewhereAreKept(self):
+    # Another run is still using its expansion, however old.
+    other = base.ExpansionCache(self.cache_dir, 1000)
+    a = other.Expand(self.MakeTar('a', '123456'))
+    os.utime(a + '.json', (0, 0))
+    cache = base.ExpansionCache(self.cache_dir, 5)
+    b = cache.Expand(self.MakeTar('b', '7890'))
+    self.assertTrue(os.path.exists(a))
+    cache.Close()
+    self.assertEqual((1, 4), cache.GarbageCollect(max_bytes=0))
+    self.assertFalse(os.path.exists(b))
+    self.assertEqual('123456', open(os.path.join(a, 'file')).read())
+    other.Close()
+    self.assertEqual((1, 6), cache.GarbageCollect(max_bytes=0))
+
+
+class CmdTracerTest(basetest.TestCase):
+
+  def setUp(self):
+    self.trace_file = os.path.join(FLAGS.test_tmpdir, 'trace.json')
+    if os.path.exists(self.trace_file):
+      os.remove(self.trace_file)
+    self.original_tracer = base.CMD_TRACER
+    base.CMD_TRACER = base.CmdTracer(lambda: 'sync', self.trace_file)
+
+  def tearDown(self):
+    base.CMD_TRACER = self.original_tracer
+
+  def testRunCmdIsTraced(self):
+    base.RunCmd('echo', ['hello'], cwd=FLAGS.test_tmpdir)
+    self.assertRaises(base.CmdError, base.RunCmd, 'false', [])
+    traces = base.CMD_TRACER.traces
+    self.assertEqual(
+        [('echo', ['hello'], FLAGS.test_tmpdir, 'sync', len('hello\n'), 0, 0),
+         ('false', [], None, 'sync', 0, 0, 1)],
+        [(t.cmd, t.args, t.cwd, t.task, t.stdout_bytes, t.stderr_bytes,
+          t.returncode) for t in traces])
+    self.assertEqual(
+        [t._asdict() for t in traces],
+        [base.CmdTrace(**json.loads(line))._asdict()
+         for line in open(self.trace_file)])
+
+  def testSummaryLines(self):
+    for cmd, args, seconds in [('/usr/bin/git', ['fetch'], 3.0),
+                               ('git', ['fetch', 'origin'], 2.0),
+                               ('tar', ['-x'], 4.0),
+                               ('svn', ['log'], 1.0)]:
+      base.CMD_TRACER.Record(
+          base.CmdTrace(cmd, args, None, '', seconds, 0, 0, 0))
+    self.assertEqual(
+        ['Ran 4 commands in 10.0s',
+         '     total  count    longest  command',
+         '      5.0s      2       3.0s  git fetch',
+         '      4.0s      1       4.0s  tar'],
+        base.CMD_TRACER.SummaryLines(top=2))
+
+
+class RunPipeTest(basetest.TestCase):
+
+  def testRunPipe(self):
+    output = os.path.join(FLAGS.test_tmpdir, 'pipe_output')
+    base.RunPipe(('echo', ['piped']), ('dd', ['of=' + output]))
+    self.assertEqual('piped\n', open(output).read())
+    self.assertRaises(base.CmdError, base.RunPipe, ('false', []), ('cat', []))
+    self.assertRaises(base.CmdError, base.RunPipe, ('echo', []), ('false', []))
+
+
+class CmdExecutorTest(basetest.TestCase):
+
+  def testMap(self):
+    executor = base.CmdExecutor(2)
+    self.assertEqual([1, 2, 3], executor.Map([lambda: 1, lambda: 2, lambda: 3]))
+    self.assertEqual([], executor.Map([]))
+
+    def Fail():
+      raise base.Error('failed')
+    self.assertRaises(base.Error, executor.Map, [lambda: 1, Fail])
+
+  def testMapIsConcurrent(self):
+    barrier = threading.Event()
+    # Each waits for the other, so this only finishes if they run at once.
+    self.assertEqual([True, None], base.CmdExecutor(2).Map(
+        [lambda: barrier.wait(10), barrier.set]))
+
+  def _MaxConcurrent(self, executor, lock_keys):
+    running = []
+    most = []
+    lock = threading.Lock()
+
+    def Run(lock_key):
+      with executor.Slot(lock_key):
+        with lock:
+          running.append(lock_key)
+          most.append(len(running))
+        time.sleep(0.05)
+        with lock:
+          running.remove(lock_key)
+    executor.Map([lambda k=k: Run(k) for k in lock_keys])
+    return max(most)
+
+  def testSlot(self):
+    self.assertEqual(2, self._MaxConcurrent(base.CmdExecutor(2), [None] * 4))
+    self.assertEqual(1, self._MaxConcurrent(base.CmdExecutor(4), ['a'] * 3))
+
+
+if __name__ == '__main__':
+  basetest.main()
@@ -6,6 +6,12 @@
 
 __author__ = 'dbentley@google.com (Daniel Bentley)'
 
+import os
+import shutil
+import stat
+import tarfile
+import zipfile
+
 import gflags as flags
 
 from google.apputils import basetest
@@ -43,6 +49,272 @@ class CodebaseUtilsTest(basetest.TestCase):
     self.assertFalse(base.AreCodebasesDifferent(codebase, copy))
     self.assertFalse(codebase.Path() == copy.Path())
 
+  def testCreateModifiableCopyOnWrite(self):
+    codebase = self._MakeManifestCodebase()
+    original = codebase.FilePath('foo.py')
+    original_contents = open(original).read()
+    copy = codebase_utils.CreateModifiableCopy(codebase, copy_on_write=True)
+    self.assertFalse(base.AreCodebasesDifferent(codebase, copy))
+    path = copy.WritableFilePath('foo.py')
+    self.assertEqual(1, os.stat(path).st_nlink)
+    open(path, 'a').write('# modified\n')
+    self.assertEqual(original_contents, open(original).read())
+    self.assertEqual(original_contents + '# modified\n', open(path).read())
+
+  def _MakeManifestCodebase(self):
+    path = os.path.join(FLAGS.test_tmpdir, 'manifest_codebase')
+    shutil.rmtree(path, ignore_errors=True)
+    shutil.copytree(test_util.TestResourceFilename('codebases/simple_python/'), path)
+    return codebase_utils.Codebase(
+        path, manifest_path=path + codebase_utils.MANIFEST_SUFFIX)
+
+  def testManifest(self):
+    codebase = self._MakeManifestCodebase()
+    manifest = codebase.Manifest()
+    self.assertEqual(['foo.py'], codebase.Walk())
+    self.assertEqual(
+        base.HashFile(codebase.FilePath('foo.py')),
+        manifest.Entry('foo.py').digest)
+    self.assertEqual(manifest, codebase_utils.LoadManifest(
+        codebase.Path() + codebase_utils.MANIFEST_SUFFIX))
+
+  def testManifestReusesUnchangedDigests(self):
+    codebase = self._MakeManifestCodebase()
+    manifest_path = codebase.Path() + codebase_utils.MANIFEST_SUFFIX
+    codebase.Manifest()
+
+    saved_manifest = codebase_utils.LoadManifest(manifest_path)
+    entry = saved_manifest.Entry('foo.py')
+    saved_manifest._entries['foo.py'] = entry._replace(digest='reused')
+    saved_manifest.Save(manifest_path)
+    self.assertEqual(
+        'reused', codebase_utils.Codebase(
+            codebase.Path(), manifest_path=manifest_path
+            ).Manifest().Entry('foo.py').digest)
+
+    open(codebase.FilePath('foo.py'), 'a').write('# changed\n')
+    self.assertEqual(
+        base.HashFile(codebase.FilePath('foo.py')),
+        codebase_utils.Codebase(
+            codebase.Path(), manifest_path=manifest_path
+            ).Manifest().Entry('foo.py').digest)
+
+  def testManifestDifference(self):
+    codebase = self._MakeManifestCodebase()
+    copy_path = os.path.join(FLAGS.test_tmpdir, 'manifest_codebase_copy')
+    shutil.rmtree(copy_path, ignore_errors=True)
+    shutil.copytree(codebase.Path(), copy_path)
+    copy = codebase_utils.Codebase(
+        copy_path, manifest_path=copy_path + codebase_utils.MANIFEST_SUFFIX)
+    self.assertFalse(base.AreCodebasesDifferent(codebase, copy))
+
+    open(os.path.join(copy_path, 'foo.py'), 'a').write('# changed\n')
+    copy = codebase_utils.Codebase(
+        copy_path, manifest_path=copy_path + codebase_utils.MANIFEST_SUFFIX)
+    self.assertTrue(base.AreCodebasesDifferent(codebase, copy))
+    self.assertTrue(base.AreCodebasesDifferent(codebase, copy,
+                                               any_difference=True))
+
+  def _MakeArchiveSource(self):
+    source = os.path.join(FLAGS.test_tmpdir, 'archive_source')
+    shutil.rmtree(source, ignore_errors=True)
+    os.makedirs(os.path.join(source, 'dir'))
+    open(os.path.join(source, 'foo.py'), 'w').write('foo\n')
+    open(os.path.join(source, 'dir', 'run.sh'), 'w').write('run\n')
+    os.chmod(os.path.join(source, 'dir', 'run.sh'), 0755)
+    return codebase_utils.Codebase(source)
+
+  def _CheckArchiveCodebase(self, archive, source):
+    codebase = codebase_utils.CodebaseFromPath(archive)
+    self.assertTrue(isinstance(codebase, codebase_utils.ArchiveCodebase))
+    self.assertItemsEqual(['foo.py', 'dir/run.sh'], codebase.Walk())
+    self.assertEqual('run\n', open(codebase.FilePath('dir/run.sh')).read())
+    self.assertTrue(base.IsExecutable(codebase.FilePath('dir/run.sh')))
+    self.assertFalse(base.AreCodebasesDifferent(source, codebase))
+    self.assertFalse(base.AreCodebasesDifferent(
+        source, codebase_utils.CodebaseFromPath(archive)))
+
+  def testTarArchiveCodebase(self):
+    source = self._MakeArchiveSource()
+    for suffix, mode in [('.tar', 'w'), ('.tar.gz', 'w:gz'),
+                         ('.tar.bz2', 'w:bz2')]:
+      archive = os.path.join(FLAGS.test_tmpdir, 'archive' + suffix)
+      tar = tarfile.open(archive, mode)
+      tar.add(source.Path(), arcname='.')
+      tar.close()
+      self._CheckArchiveCodebase(archive, source)
+
+  def testZipArchiveCodebase(self):
+    source = self._MakeArchiveSource()
+    archive = os.path.join(FLAGS.test_tmpdir, 'archive.zip')
+    zip_file = zipfile.ZipFile(archive, 'w')
+    for relative_filename in source.Walk():
+      zip_file.write(source.FilePath(relative_filename), relative_filename)
+    zip_file.close()
+    self._CheckArchiveCodebase(archive, source)
+
+  def testZipArchiveSymlink(self):
+    archive = os.path.join(FLAGS.test_tmpdir, 'symlink.zip')
+    zip_file = zipfile.ZipFile(archive, 'w')
+    zip_file.writestr('dir/foo.py', 'foo\n')
+    link = zipfile.ZipInfo('dir/link')
+    link.external_attr = (stat.S_IFLNK | 0777) << 16
+    zip_file.writestr(link, 'foo.py')
+    zip_file.close()
+
+    codebase = codebase_utils.ArchiveCodebase(archive)
+    path = codebase.FilePath('dir/link')
+    self.assertEqual('foo.py', os.readlink(path))
+    self.assertEqual('foo\n', open(path).read())
+
+  def testArchiveLinksOutsideAreRejected(self):
+    for target in ['../../x', '/etc/passwd', 'sub/../../../x']:
+      archive = os.path.join(FLAGS.test_tmpdir, 'escaping.zip')
+      zip_file = zipfile.ZipFile(archive, 'w')
+      link = zipfile.ZipInfo('dir/link')
+      link.external_attr = (stat.S_IFLNK | 0777) << 16
+      zip_file.writestr(link, target)
+      zip_file.close()
+      codebase = codebase_utils.ArchiveCodebase(archive)
+      self.assertRaises(base.Error, codebase.FilePath, 'dir/link')
+
+      archive = os.path.join(FLAGS.test_tmpdir, 'escaping.tar')
+      tar = tarfile.open(archive, 'w')
+      link = tarfile.TarInfo('dir/link')
+      link.type = tarfile.SYMTYPE
+      link.linkname = target
+      tar.addfile(link)
+      tar.close()
+      codebase = codebase_utils.ArchiveCodebase(archive)
+      self.assertRaises(base.Error, codebase.FilePath, 'dir/link')
+
+  def testArchiveCodebaseExtractsOnlyWhatsNeeded(self):
+    source = self._MakeArchiveSource()
+    archive = os.path.join(FLAGS.test_tmpdir, 'archive.tar')
+    tar = tarfile.open(archive, 'w')
+    tar.add(source.Path(), arcname='.')
+    tar.close()
+    codebase = codebase_utils.ArchiveCodebase(archive)
+    path = codebase.FilePath('foo.py')
+    self.assertFalse(os.path.exists(
+        os.path.join(os.path.dirname(path), 'dir', 'run.sh')))
+    self.assertTrue(os.path.exists(
+        os.path.join(codebase.ExpandedPath(), 'dir', 'run.sh')))
+
+
+class ExportStoreTest(basetest.TestCase):
+
+  def setUp(self):
+    self.root = os.path.join(FLAGS.test_tmpdir, 'export_store')
+    shutil.rmtree(self.root, ignore_errors=True)
+    self.exports = []
+
+  def _Exporter(self, files):
+    def Export(directory):
+      self.exports.append(directory)
+      os.makedirs(directory)
+      for name, contents in files.iteritems():
+        open(os.path.join(directory, name), 'w').write(contents)
+    return Export
+
+  def testExport(self):
+    store = codebase_utils.ExportStore(self.root, 1000)
+    path = store.Export('1', self._Exporter({'a': 'aaa'}))
+    self.assertEqual(os.path.join(self.root, '1'), path)
+    self.assertTrue(store.IsComplete('1'))
+    self.assertEqual(['a'], store.Manifest('1').Files())
+    # A complete export is reused.
+    self.assertEqual(path, store.Export('1', self._Exporter({})))
+    self.assertEqual(1, len(self.exports))
+
+  def testExportedFilesAreReadOnly(self):
+    store = codebase_utils.ExportStore(self.root, 1000)
+    path = store.Export('1', self._Exporter({'a': 'aaa'}))
+    self.assertFalse(os.stat(os.path.join(path, 'a')).st_mode & 0222)
+    copy = codebase_utils.CreateModifiableCopy(codebase_utils.Codebase(path))
+    self.assertTrue(os.stat(copy.FilePath('a')).st_mode & stat.S_IWUSR)
+
+  def testChangedExportHasNoManifest(self):
+    store = codebase_utils.ExportStore(self.root, 1000)
+    path = store.Export('1', self._Exporter({'a': 'aaa', 'b': 'bbb'}))
+    self.assertTrue(store.Manifest('1'))
+    os.remove(os.path.join(path, 'a'))
+    open(os.path.join(path, 'a'), 'w').write('changed')
+    self.assertEqual(None, store.Manifest('1'))
+
+  def testInterruptedExportIsRedone(self):
+    store = codebase_utils.ExportStore(self.root, 1000)
+    def Interrupted(directory):
+      self._Exporter({'a': 'aaa'})(directory)
+      raise KeyboardInterrupt
+    self.assertRaises(KeyboardInterrupt, store.Export, '1', Interrupted)
+    self.assertFalse(store.IsComplete('1'))
+    self.assertFalse(os.path.exists(store.Path('1')))
+    # As if an older MOE had been interrupted exporting in place.
+    os.makedirs(store.Path('1'))
+    path = store.Export('1', self._Exporter({'a': 'aaa', 'b': 'bbb'}))
+    self.assertItemsEqual(['a', 'b'], os.listdir(path))
+
+  def testUnchangedFilesAreShared(self):
+    store = codebase_utils.ExportStore(self.root, 1000)
+    path1 = store.Export('1', self._Exporter({'a': 'aaa', 'b': 'bbb'}))
+    path2 = store.Export('2', self._Exporter({'a': 'aaa', 'b': 'BBBB'}))
+    self.assertEqual(os.stat(os.path.join(path1, 'a')).st_ino,
+                     os.stat(os.path.join(path2, 'a')).st_ino)
+    self.assertNotEqual(os.stat(os.path.join(path1, 'b')).st_ino,
+                        os.stat(os.path.join(path2, 'b')).st_ino)
+    self.assertEqual(10, store.DiskUsage())
+    codebase1 = codebase_utils.Codebase(path1, manifest=store.Manifest('1'))
+    codebase2 = codebase_utils.Codebase(path2, manifest=store.Manifest('2'))
+    self.assertEqual('b', base.AreCodebasesDifferent(
+        codebase1, codebase2).first_difference.relative_filename)
+
+  def testEviction(self):
+    # A revision an earlier run is done with.
+    earlier = codebase_utils.ExportStore(self.root, 8)
+    earlier.Export('1', self._Exporter({'a': 'aaa', 'b': 'bbb'}))
+    earlier.Close()
+    os.utime(earlier.Path('1') + earlier.COMPLETE_SUFFIX, (0, 0))
+    store = codebase_utils.ExportStore(self.root, 8)
+    store.Export('2', self._Exporter({'a': 'aaa', 'c': 'ccc'}))
+    # 9 bytes is over budget, so 1 goes; a is still used by 2.
+    self.assertEqual(['2'], [name for name, _, _ in store.Revisions()])
+    self.assertFalse(os.path.exists(store.Path('1')))
+    self.assertFalse(os.path.exists(store.Path('1') + '.lock'))
+    self.assertEqual(6, store.DiskUsage())
+    # Revisions this store exported are in use until it's closed.
+    self.assertEqual([], store.GarbageCollect(max_bytes=0))
+    store.Close()
+    self.assertEqual(['2'], store.GarbageCollect(max_bytes=0))
+    self.assertEqual(0, store.DiskUsage())
+
+  def testRevisionsInUseAreKept(self):
+    store = codebase_utils.ExportStore(self.root, 3)
+    path1 = store.Export('1', self._Exporter({'a': 'aaa'}))
+    # Over budget, but this run is still using 1.
+    path2 = store.Export('2', self._Exporter({'b': 'bbb'}))
+    self.assertEqual('aaa', open(os.path.join(path1, 'a')).read())
+    # Another run's revisions are kept too.
+    other = codebase_utils.ExportStore(self.root, 0)
+    other.Export('3', self._Exporter({'c': 'ccc'}))
+    self.assertEqual([], other.GarbageCollect())
+    self.assertFalse(store.Remove('2'))
+    store.Close()
+    self.assertItemsEqual(['1', '2'], other.GarbageCollect())
+    self.assertFalse(os.path.exists(path2))
+    self.assertTrue(store.IsComplete('3'))
+
+  def testEvictionCountsFreedBlobs(self):
+    for i, name in enumerate(['b', 'c', 'd']):
+      store = codebase_utils.ExportStore(self.root, 1000)
+      store.Export(str(i), self._Exporter({'a': 'aaa', name: name * 3}))
+      store.Close()
+      os.utime(store.Path(str(i)) + store.COMPLETE_SUFFIX, (i, i))
+    # Removing 0 frees b's blob, which is enough; its shared a stays.
+    self.assertEqual(12, store.DiskUsage())
+    self.assertEqual(['0'], store.GarbageCollect(max_bytes=9))
+    self.assertEqual(9, store.DiskUsage())
+
 
 if __name__ == '__main__':
   basetest.main()
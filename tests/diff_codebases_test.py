@@ -52,6 +52,81 @@ class DiffCodebasesTest(basetest.TestCase):
 
     self.assertEquals(expected_diff.strip(), str(codebase_diff_obj).strip())
 
+  def testCodebaseDifferenceJobs(self):
+    codebase_internal = codebase_utils.Codebase(test_util.TestResourceFilename(
+        os.path.join('diff_codebases', 'codebase_internal/')))
+    codebase_public = codebase_utils.Codebase(test_util.TestResourceFilename(
+        os.path.join('diff_codebases', 'codebase_public/')))
+
+    self.assertEquals(
+        str(base.AreCodebasesDifferent(codebase_internal, codebase_public,
+                                       record_full_diffs=True)),
+        str(base.AreCodebasesDifferent(codebase_internal, codebase_public,
+                                       record_full_diffs=True, jobs=4)))
+
+  def testAnyDifference(self):
+    codebase_internal = codebase_utils.Codebase(test_util.TestResourceFilename(
+        os.path.join('diff_codebases', 'codebase_internal/')))
+    codebase_public = codebase_utils.Codebase(test_util.TestResourceFilename(
+        os.path.join('diff_codebases', 'codebase_public/')))
+
+    codebase_diff_obj = base.AreCodebasesDifferent(
+        codebase_internal, codebase_public, any_difference=True)
+    self.assertEquals(1, len(codebase_diff_obj.differences))
+    self.assertFalse(base.AreCodebasesDifferent(
+        codebase_internal, codebase_public, noisy_files_re='line',
+        any_difference=True))
+
+  def _WriteFiles(self, contents1, contents2):
+    file1 = os.path.join(FLAGS.test_tmpdir, 'file1')
+    file2 = os.path.join(FLAGS.test_tmpdir, 'file2')
+    open(file1, 'wb').write(contents1)
+    open(file2, 'wb').write(contents2)
+    return file1, file2
+
+  def testSameSizeDifferentContents(self):
+    file1, file2 = self._WriteFiles('a\nb\n', 'a\nc\n')
+    self.assertEquals('File contents differ',
+                      base.AreFilesDifferent(file1, file2).reason)
+    file1, file2 = self._WriteFiles('a\nb\n', 'a\nb\n')
+    self.assertEquals(None, base.AreFilesDifferent(file1, file2))
+
+  def testOnlyOwnersExecutableBitCounts(self):
+    file1, file2 = self._WriteFiles('a\n', 'a\n')
+    os.chmod(file2, 0644)
+    for mode, executable in [(0744, True), (0654, False), (0645, False)]:
+      os.chmod(file1, mode)
+      self.assertEquals(executable, base.IsExecutable(file1))
+      difference = base.AreFilesDifferent(file1, file2)
+      self.assertEquals(executable, bool(difference))
+      # Manifests of the files agree.
+      entry1, entry2 = [codebase_utils.ManifestEntry(2, m, 0, 0, 0, 'digest')
+                        for m in (mode, 0644)]
+      self.assertEquals(executable, bool(base._AreManifestEntriesDifferent(
+          entry1, entry2, file1, file2, 'file', False)))
+
+  def testNoNewlineAtEndOfFile(self):
+    file1, file2 = self._WriteFiles('a\nb\n', 'a\nb')
+    self.assertEquals(
+        'File contents differ:\n2c2\n< b\n---\n> b\n'
+        '\\ No newline at end of file',
+        base.AreFilesDifferent(file1, file2, record_full_diffs=True).reason)
+
+  def testBinaryFiles(self):
+    file1, file2 = self._WriteFiles('a\0b', 'a\0c')
+    self.assertEquals(
+        'File contents differ:\nBinary files %s and %s differ' % (file1,
+                                                                  file2),
+        base.AreFilesDifferent(file1, file2, record_full_diffs=True).reason)
+
+  def testTruncatedDiff(self):
+    file1, file2 = self._WriteFiles('a\nb\nc\nd\ne\nf\n',
+                                    'A\nb\nC\nd\nE\nf\n')
+    self.assertEquals(
+        'File contents differ:\n'
+        '1c1\n< a\n---\n> A\n3c3\n< c\n---\n> C\n5c5\n< e\n...Truncated...',
+        base.AreFilesDifferent(file1, file2, record_full_diffs=True).reason)
+
   def _CheckFileDifference(self, scenario_name):
     file_internal = test_util.TestResourceFilename(
         os.path.join('diff_codebases', 'codebase_internal', scenario_name))
@@ -7,43 +7,24 @@
 
 
 import os
-import sys
+import shutil
 
 from google.apputils import file_util
 import gflags as flags
 
 from google.apputils import basetest
+from moe import base
+from moe import config
 from moe import git
+from moe import moe_app
 import test_util
 
 
 FLAGS = flags.FLAGS
 
-SCENARIOS_DIR = ''
-UNRUN_SCENARIOS = None
-
-
-def setUp():
-  global SCENARIOS_DIR
-  SCENARIOS_DIR = test_util.TestResourceFilename('git_scenarios/')
-  global UNRUN_SCENARIOS
-  UNRUN_SCENARIOS = set(os.listdir(SCENARIOS_DIR))
-
-
-def tearDown():
-  if UNRUN_SCENARIOS:
-    print 'UNRUN_SCENARIOS:', repr(UNRUN_SCENARIOS)
-    sys.exit(1)
-
 
 class GitTest(basetest.TestCase):
 
-  def testShortLog(self):
-    self.RunScenario('short_log', FilterLog)
-
-  def testLongLog(self):
-    self.RunScenario('long_log', FilterLog)
-
   def testHeadRevisionError(self):
     client = git.GitClient(
         os.path.join(FLAGS.test_tmpdir, 'testHeadRevisionError'),
@@ -51,20 +32,298 @@ class GitTest(basetest.TestCase):
     result = client.GetHeadRevision('1')
     self.assertFalse(result)
 
-  def RunScenario(self, scenario_name, filter_to_test):
-    UNRUN_SCENARIOS.remove(scenario_name)
-    scenario_base = os.path.join(SCENARIOS_DIR, scenario_name)
-    in_file = os.path.join(scenario_base, 'input')
-    input_txt = file_util.Read(in_file)
-    output = filter_to_test(input_txt)
-    expected = os.path.join(scenario_base, 'expected')
-    out_file = os.path.join(FLAGS.test_tmpdir, scenario_name + '.out.txt')
-    file_util.Write(out_file, output)
-    basetest.DiffTestFiles(expected, out_file)
+  def MakeEditor(self, name):
+    """Make an editor of a new repository, and a source to push into it."""
+    root = os.path.join(FLAGS.test_tmpdir, name)
+    shutil.rmtree(root, ignore_errors=True)
+    repository = os.path.join(root, 'repository')
+    source = os.path.join(root, 'source')
+    os.makedirs(os.path.join(repository, 'dir'))
+    os.makedirs(os.path.join(source, 'new_dir'))
+    os.makedirs(os.path.join(root, 'client'))
+    for filename in ['kept', 'modified', 'dir/deleted']:
+      file_util.Write(os.path.join(repository, filename), filename)
+    file_util.Write(os.path.join(repository, '.gitignore'), 'ignored\n')
+    git.RunGit(['init', '-q'], cwd=repository)
+    git.RunGit(['add', '.'], cwd=repository)
+    git.RunGit(['-c', 'user.name=MOE', '-c', 'user.email=moe@example.com',
+                'commit', '-q', '-m', 'initial'], cwd=repository)
+    file_util.Write(os.path.join(source, 'kept'), 'kept')
+    file_util.Write(os.path.join(source, 'modified'), 'changed')
+    file_util.Write(os.path.join(source, 'new_dir', 'added'), 'added')
+
+    client = git.GitClient(os.path.join(root, 'client'), repository)
+    editor = client.MakeEditor(config.MigrationStrategy(
+        merge_strategy=base.ERROR, commit_strategy=base.LEAVE_PENDING))
+    editor.Checkout()
+    return client, editor, source
+
+  def testEditorStagesChangesAtFinalizeChange(self):
+    client, editor, source = self.MakeEditor('testEditorStages')
+    for filename in ['kept', 'modified', 'dir/deleted', 'new_dir/added']:
+      editor.PutFile(filename, os.path.join(source, filename))
+    self.assertFalse(os.path.exists(os.path.join(client.checkout, 'dir')))
+    editor.FinalizeChange('message', base.MoeReport())
+    self.assertTrue(editor.ChangesMade())
+    self.assertEqual(
+        'D\tdir/deleted\nM\tmodified\nA\tnew_dir/added\n',
+        client.RunGit(['diff', '--cached', '--name-status'], need_stdout=True))
+
+  def testEditorKeepsSubdirectoryWhenEmptied(self):
+    _, _, source = self.MakeEditor('testEditorKeepsSubdirectory')
+    root = os.path.join(FLAGS.test_tmpdir, 'testEditorKeepsSubdirectory')
+    os.makedirs(os.path.join(root, 'dir_client'))
+    client = git.GitClient(os.path.join(root, 'dir_client'),
+                           os.path.join(root, 'repository'), subdirectory='dir')
+    editor = client.MakeEditor(config.MigrationStrategy(
+        merge_strategy=base.ERROR, commit_strategy=base.LEAVE_PENDING))
+    editor.Checkout()
+    editor.PutFile('deleted', os.path.join(source, 'deleted'))
+    self.assertEqual([], os.listdir(client.codebase_root))
+
+  def testEditorKeepsClientFilesWritable(self):
+    client, editor, source = self.MakeEditor('testEditorKeepsWritable')
+    # Exported files are read-only blobs; only their exec bit should count.
+    os.chmod(os.path.join(source, 'modified'), 0555)
+    os.chmod(os.path.join(source, 'new_dir', 'added'), 0444)
+    for _ in range(2):
+      editor.PutFile('modified', os.path.join(source, 'modified'))
+      editor.PutFile('new_dir/added', os.path.join(source, 'new_dir/added'))
+    modified = os.path.join(client.checkout, 'modified')
+    added = os.path.join(client.checkout, 'new_dir', 'added')
+    self.assertTrue(os.stat(modified).st_mode & 0200)
+    self.assertTrue(os.stat(added).st_mode & 0200)
+    self.assertTrue(base.IsExecutable(modified))
+    self.assertFalse(base.IsExecutable(added))
+
+    os.chmod(os.path.join(source, 'modified'), 0444)
+    editor.PutFile('modified', os.path.join(source, 'modified'))
+    self.assertFalse(base.IsExecutable(modified))
+
+  def testEditorWalk(self):
+    client, editor, source = self.MakeEditor('testEditorWalk')
+    for filename in ['untracked', 'ignored', 'caf\xc3\xa9']:
+      file_util.Write(os.path.join(client.checkout, filename), filename)
+    client.RunGit(['add', 'caf\xc3\xa9'])
+    # Listed as the same bytes as the filesystem's, not decoded.
+    self.assertEqual(['caf\xc3\xa9', 'dir/deleted', 'kept', 'modified'],
+                     editor.Walk())
+    self.assertTrue(isinstance(editor.Walk()[0], str))
+    # PutFile keeps the listing up to date, without asking git again.
+    editor.PutFile('dir/deleted', os.path.join(source, 'dir/deleted'))
+    editor.PutFile('new_dir/added', os.path.join(source, 'new_dir/added'))
+    self.assertEqual(['caf\xc3\xa9', 'kept', 'modified', 'new_dir/added'],
+                     editor.Walk())
+
+    FLAGS.walk_untracked_files = True
+    try:
+      editor = client.MakeEditor(config.MigrationStrategy(
+          merge_strategy=base.ERROR, commit_strategy=base.LEAVE_PENDING))
+      self.assertEqual(['caf\xc3\xa9', 'kept', 'modified', 'new_dir/added',
+                        'untracked'], editor.Walk())
+    finally:
+      FLAGS.walk_untracked_files = False
+
+  def Commit(self, repository, contents):
+    """Commit contents to repository's file, returning the commit's id."""
+    file_util.Write(os.path.join(repository, 'file'), contents)
+    git.RunGit(['add', 'file'], cwd=repository)
+    git.RunGit(['-c', 'user.name=MOE', '-c', 'user.email=moe@example.com',
+                'commit', '-q', '-m', contents], cwd=repository)
+    return git.RunGit(['rev-parse', 'HEAD'], cwd=repository,
+                      need_stdout=True).strip()[:git.ID_LENGTH]
+
+  def testMirror(self):
+    root = os.path.join(FLAGS.test_tmpdir, 'testMirror')
+    shutil.rmtree(root, ignore_errors=True)
+    repository = os.path.join(root, 'repository')
+    for d in ['repository', 'client1', 'client2']:
+      os.makedirs(os.path.join(root, d))
+    git.RunGit(['init', '-q'], cwd=repository)
+
+    first = self.Commit(repository, 'first')
+    mirror_root = os.path.join(root, 'mirrors')
+    client = git.GitClient(os.path.join(root, 'client1'), repository,
+                           mirror=git.GitMirror(mirror_root, repository))
+    # The head comes from the repository, without cloning it.
+    self.assertEqual(first, client.GetHeadRevision())
+    self.assertFalse(os.path.exists(mirror_root))
+    client.Checkout()
+    self.assertEqual(first, client.GetHeadRevision('HEAD'))
+    self.assertEqual(
+        repository,
+        client.RunGit(['config', 'remote.origin.url'], need_stdout=True).strip())
+
+    # A later run fetches the new commit into the same mirror.
+    second = self.Commit(repository, 'second')
+    mirror = git.GitMirror(mirror_root, repository)
+    client = git.GitClient(os.path.join(root, 'client2'), repository,
+                           mirror=mirror)
+    self.assertEqual(second, client.GetHeadRevision())
+    self.assertEqual(first, client.GetHeadRevision(first))
+    self.assertEqual([os.path.basename(mirror.Path()),
+                      os.path.basename(mirror.Path()) + '.lock'],
+                     sorted(os.listdir(mirror_root)))
+    client.Checkout()
+    self.assertEqual('second',
+                     file_util.Read(os.path.join(client.checkout, 'file')))
+
+  def testExport(self):
+    root = os.path.join(FLAGS.test_tmpdir, 'testExport')
+    shutil.rmtree(root, ignore_errors=True)
+    repository = os.path.join(root, 'repository')
+    os.makedirs(os.path.join(repository, 'sub', 'dir'))
+    os.makedirs(os.path.join(root, 'client'))
+    for filename in ['top', 'sub/file', 'sub/dir/nested']:
+      file_util.Write(os.path.join(repository, filename), filename)
+    git.RunGit(['init', '-q'], cwd=repository)
+    git.RunGit(['add', '.'], cwd=repository)
+    git.RunGit(['-c', 'user.name=MOE', '-c', 'user.email=moe@example.com',
+                'commit', '-q', '-m', 'initial'], cwd=repository)
+
+    client = git.GitClient(os.path.join(root, 'client'), repository,
+                           mirror=git.GitMirror(os.path.join(root, 'mirrors'),
+                                                repository),
+                           subdirectory='sub')
+    # Exporting from the mirror doesn't check out a client.
+    client.Export(os.path.join(root, 'from_mirror'))
+    self.assertFalse(client.checked_out)
+    self.assertItemsEqual(
+        ['file', 'dir/nested'],
+        base.ListFiles(os.path.join(root, 'from_mirror'), None))
+    self.assertEqual('sub/dir/nested', file_util.Read(
+        os.path.join(root, 'from_mirror', 'dir', 'nested')))
+
+    client.Checkout()
+    client.Export(os.path.join(root, 'from_client'), 'HEAD')
+    self.assertItemsEqual(
+        ['file', 'dir/nested'],
+        base.ListFiles(os.path.join(root, 'from_client'), None))
+
+    # Editors see the subdirectory as the codebase, too.
+    editor = client.MakeEditor(config.MigrationStrategy(
+        merge_strategy=base.ERROR, commit_strategy=base.LEAVE_PENDING))
+    self.assertEqual(['dir/nested', 'file'], editor.Walk())
+    self.assertEqual(os.path.join(client.checkout, 'sub'), editor.Root())
+
+    self.assertRaises(base.CmdError, client.Export,
+                      os.path.join(root, 'from_client'), 'no_such_revision')
+
+  def testRevisions(self):
+    root = os.path.join(FLAGS.test_tmpdir, 'testRevisions')
+    shutil.rmtree(root, ignore_errors=True)
+    repository = os.path.join(root, 'repository')
+    os.makedirs(repository)
+    git.RunGit(['init', '-q'], cwd=repository)
+    commits = [self.Commit(repository, 'change %d' % i) for i in range(5)]
+    commits.reverse()
+
+    moe_app.InitForTest()
+    FLAGS.git_mirror_dir = os.path.join(root, 'mirrors')
+    original_page_size = git.LOG_PAGE_SIZE
+    original_tracer = base.CMD_TRACER
+    git.LOG_PAGE_SIZE = 2
+    try:
+      repository_object = git.GitRepository(repository, 'test', '', False,
+                                            False)
+      revisions = repository_object.RecurUntilMatchingRevision(
+          None, lambda r: r.changelog == 'change 0')
+      self.assertEqual(commits, [r.rev_id for r in revisions])
+      self.assertEqual('moe@example.com', revisions[0].author)
+      self.assertEqual('change 4', revisions[0].changelog)
+      self.assertEqual(commits[1:3], [
+          r.rev_id for r in repository_object.RetrieveGitLog(2, commits[1])])
+      self.assertRaises(base.Error,
+                        repository_object.RecurUntilMatchingRevision,
+                        commits[1], lambda r: False)
+
+      # Another run reads what it already knows from the cache, not git log.
+      base.CMD_TRACER = base.CmdTracer()
+      repository_object = git.GitRepository(repository, 'test', '', False,
+                                            False)
+      self.assertEqual(commits, [
+          r.rev_id for r in repository_object.RetrieveGitLog(10, None)])
+      self.assertEqual([], [t for t in base.CMD_TRACER.traces
+                            if t.args[0] == 'log'])
+      # The history is listed once, however many pages it takes.
+      self.assertEqual(1, len([t for t in base.CMD_TRACER.traces
+                               if t.args[0] == 'rev-list']))
+    finally:
+      git.LOG_PAGE_SIZE = original_page_size
+      base.CMD_TRACER = original_tracer
+      FLAGS.git_mirror_dir = ''
+
+  def testTreeCodebase(self):
+    root = os.path.join(FLAGS.test_tmpdir, 'testTreeCodebase')
+    shutil.rmtree(root, ignore_errors=True)
+    repository = os.path.join(root, 'repository')
+    os.makedirs(os.path.join(repository, 'dir'))
+    git.RunGit(['init', '-q'], cwd=repository)
+    file_util.Write(os.path.join(repository, 'dir', 'script'), 'script')
+    base.SetExecutable(os.path.join(repository, 'dir', 'script'))
+    os.symlink('file', os.path.join(repository, 'link'))
+    file_util.Write(os.path.join(repository, 'caf\xc3\xa9'), 'caf\xc3\xa9')
+    git.RunGit(['add', 'dir', 'link', 'caf\xc3\xa9'], cwd=repository)
+    first = self.Commit(repository, 'first')
+    self.Commit(repository, 'second')
+
+    moe_app.InitForTest()
+    FLAGS.git_mirror_dir = os.path.join(root, 'mirrors')
+    original_tracer = base.CMD_TRACER
+    base.CMD_TRACER = base.CmdTracer()
+    try:
+      repository_object = git.GitRepository(repository, 'test', '', False,
+                                            False)
+      old = repository_object.MakeCodebase(first)
+      head = repository_object.MakeCodebase()
+      self.assertEqual(['caf\xc3\xa9', 'dir/script', 'file', 'link'],
+                       old.Walk())
+      # Paths are the filesystem's bytes, not decoded.
+      self.assertTrue(isinstance(old.Walk()[0], str))
+      self.assertEqual('caf\xc3\xa9',
+                       file_util.Read(old.FilePath('caf\xc3\xa9')))
+      self.assertEqual(first, old.RevId())
+
+      # Only the files asked for are written.
+      script = old.FilePath('dir/script')
+      self.assertEqual('script', file_util.Read(script))
+      self.assertTrue(base.IsExecutable(script))
+      self.assertFalse(os.path.exists(old.FilePath('no_such_file')))
+      self.assertFalse(os.path.exists(
+          os.path.join(os.path.dirname(script), '..', 'file')))
+
+      # Both revisions' script is the same blob, read once. It's read-only,
+      # until a codebase asks for its own copy.
+      self.assertEqual(os.stat(script).st_ino,
+                       os.stat(head.FilePath('dir/script')).st_ino)
+      self.assertFalse(os.stat(script).st_mode & 0222)
+      writable = old.WritableFilePath('dir/script')
+      file_util.Write(writable, 'changed')
+      self.assertTrue(base.IsExecutable(writable))
+      self.assertEqual('script', file_util.Read(head.FilePath('dir/script')))
+      self.assertEqual('second', file_util.Read(head.FilePath('link')))
+      self.assertEqual('first', file_util.Read(
+          os.path.join(old.ExpandedPath(), 'file')))
+      self.assertEqual('file', os.readlink(old.FilePath('link')))
 
+      repository_object.Close()
+      self.assertEqual(
+          [['cat-file', '--batch']],
+          [t.args for t in base.CMD_TRACER.traces if t.args[0] == 'cat-file'])
 
-def FilterLog(text):
-  return '\n'.join([str(rev) for rev in git.ParseRevisions(text, '')])
+      # Pushing a blob leaves a writable file in the client.
+      blob = head.FilePath('dir/script')
+      self.assertFalse(os.stat(blob).st_mode & 0222)
+      client, editor, _ = self.MakeEditor('testTreeCodebaseClient')
+      for _ in range(2):
+        editor.PutFile('modified', blob)
+      pushed = os.path.join(client.checkout, 'modified')
+      self.assertTrue(os.stat(pushed).st_mode & 0200)
+      self.assertTrue(base.IsExecutable(pushed))
+      self.assertEqual('script', file_util.Read(pushed))
+    finally:
+      base.CMD_TRACER = original_tracer
+      FLAGS.git_mirror_dir = ''
 
 
 if __name__ == '__main__':
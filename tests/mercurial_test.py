@@ -7,6 +7,7 @@
 
 
 import os
+import shutil
 import sys
 
 import mox
@@ -15,6 +16,8 @@ from google.apputils import file_util
 import gflags as flags
 
 from google.apputils import basetest
+from moe import base
+from moe import config
 from moe import mercurial
 from moe import moe_app
 import test_util
@@ -78,6 +81,117 @@ class MercurialTest(basetest.TestCase):
     self.assertFalse(mercurial.IsSupportedVersion(UNSUPPORTED_VERSION))
     self.assertFalse(mercurial.IsSupportedVersion(''))
 
+  def MakeEditor(self, files, outputs=None):
+    """Make an editor of a clone with files in it, which runs no hg.
+
+    Args:
+      files: list of str, the files to make in the clone
+      outputs: {tuple of str: str or Exception}, what hg commands output (or
+               raise)
+
+    Returns:
+      (MercurialEditor; list, the hg commands it runs, each with the files
+       in its listfile0: file in place of the pattern)
+    """
+    commands = []
+
+    def RunHg(args, **unused_kwargs):
+      output = (outputs or {}).get(tuple(args))
+      if args[-1].startswith('listfile0:'):
+        args = args[:-1] + [base.SplitNulTerminated(
+            file_util.Read(args[-1][len('listfile0:'):]))]
+      commands.append(args)
+      if args == ['version']:
+        return SUPPORTED_VERSION
+      if args == ['status']:
+        return ''
+      if isinstance(output, Exception):
+        raise output
+      return output
+    self.mox.stubs.Set(mercurial, 'RunHg', RunHg)
+
+    client = mercurial.MercurialClient('http://not_a_url')
+    client.checked_out = True
+    os.makedirs(client.checkout)
+    for filename in files:
+      base.MakeDir(os.path.dirname(os.path.join(client.checkout, filename)))
+      file_util.Write(os.path.join(client.checkout, filename), filename)
+    editor = client.MakeEditor(config.MigrationStrategy(
+        merge_strategy=base.ERROR, commit_strategy=base.LEAVE_PENDING))
+    del commands[:]
+    return editor, commands
+
+  def testEditorRunsOneCommandPerKindOfChange(self):
+    editor, commands = self.MakeEditor(['deleted', 'also_deleted', 'modified'])
+    source = os.path.join(FLAGS.test_tmpdir, 'testEditorRunsOneCommand_src')
+    shutil.rmtree(source, ignore_errors=True)
+    os.makedirs(os.path.join(source, 'dir'))
+    for filename in ['modified', 'new', 'dir/new']:
+      file_util.Write(os.path.join(source, filename), 'new ' + filename)
+
+    for filename in ['deleted', 'new', 'modified', 'dir/new', 'also_deleted']:
+      editor.PutFile(filename, os.path.join(source, filename))
+    # Nothing runs until FinalizeChange.
+    self.assertEqual([], commands)
+    editor.FinalizeChange('message', base.MoeReport())
+    self.assertEqual(
+        [['rm', ['deleted', 'also_deleted']],
+         ['add', ['new', 'dir/new']],
+         ['status']],
+        commands)
+    self.assertFalse(editor.ChangesMade())
+
+  def testEditorKeepsClientFilesWritable(self):
+    editor, _ = self.MakeEditor(['modified'])
+    source = os.path.join(FLAGS.test_tmpdir, 'testEditorKeepsWritable_src')
+    shutil.rmtree(source, ignore_errors=True)
+    os.makedirs(source)
+    for filename, mode in [('modified', 0555), ('new', 0444)]:
+      file_util.Write(os.path.join(source, filename), filename)
+      # Exported files are read-only blobs; only their exec bit should count.
+      os.chmod(os.path.join(source, filename), mode)
+    for _ in range(2):
+      for filename in ['modified', 'new']:
+        editor.PutFile(filename, os.path.join(source, filename))
+    modified = os.path.join(editor.client.checkout, 'modified')
+    new = os.path.join(editor.client.checkout, 'new')
+    self.assertTrue(os.stat(modified).st_mode & 0200)
+    self.assertTrue(os.stat(new).st_mode & 0200)
+    self.assertTrue(base.IsExecutable(modified))
+    self.assertFalse(base.IsExecutable(new))
+
+  def testEditorWalk(self):
+    # Like RunCmd, the fake hg's output is decoded.
+    outputs = {('files', '-0'): u'kept\0dir/tracked\0.hgtags\0caf\xe9\0',
+               ('status', '--unknown', '--no-status', '-0'): u'untracked\0'}
+    editor, commands = self.MakeEditor(
+        ['kept', 'dir/tracked', '.hgtags', 'untracked', 'caf\xc3\xa9'],
+        outputs)
+    self.assertEqual(['caf\xc3\xa9', 'dir/tracked', 'kept'], editor.Walk())
+    self.assertTrue(isinstance(editor.Walk()[0], str))
+    # PutFile keeps the listing up to date, without asking hg again.
+    source = os.path.join(FLAGS.test_tmpdir, 'testEditorWalk_src')
+    shutil.rmtree(source, ignore_errors=True)
+    os.makedirs(source)
+    file_util.Write(os.path.join(source, 'added'), 'added')
+    editor.PutFile('kept', os.path.join(source, 'kept'))
+    editor.PutFile('added', os.path.join(source, 'added'))
+    self.assertEqual(['added', 'caf\xc3\xa9', 'dir/tracked'], editor.Walk())
+    self.assertEqual([['files', '-0']], commands)
+
+    FLAGS.walk_untracked_files = True
+    try:
+      editor, _ = self.MakeEditor(['kept', 'untracked'], outputs)
+      self.assertEqual(['kept', 'untracked'], editor.Walk())
+    finally:
+      FLAGS.walk_untracked_files = False
+
+  def testEditorWalkWithNoFiles(self):
+    # hg files exits 1 when it lists nothing.
+    editor, _ = self.MakeEditor([], {
+        ('files', '-0'): base.CmdError('hg files returned 1', returncode=1)})
+    self.assertEqual([], editor.Walk())
+
   def testShortLog(self):
     self.RunScenario('short_log', FilterLog)
 
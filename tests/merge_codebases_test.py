@@ -7,6 +7,9 @@
 __author__ = 'dbentley@google.com (Daniel Bentley)'
 
 import os
+import random
+import shutil
+import subprocess
 import sys
 
 import gflags as flags
@@ -48,7 +51,11 @@ class MergeCodebasesTest(basetest.TestCase):
     self.RunScenario('add_one_file')
 
   def testDeleteOneFile(self):
-    self.RunScenario('delete_one_file')
+    context = self.RunScenario('delete_one_file')
+    self.assertEqual({merge_codebases.IDENTICAL: 1,
+                      merge_codebases.PUBLIC_CHANGED: 1,
+                      merge_codebases.GENERATED_CHANGED: 1},
+                     dict(context.triage_counts))
 
   def testDeleteOneFileFromInternal(self):
     self.RunScenario('delete_one_file_from_internal')
@@ -57,7 +64,9 @@ class MergeCodebasesTest(basetest.TestCase):
     self.RunScenario('edit_one_file')
 
   def testMergeOneFile(self):
-    self.RunScenario('merge_one_file')
+    context = self.RunScenario('merge_one_file')
+    self.assertEqual({merge_codebases.BOTH_CHANGED: 1},
+                     dict(context.triage_counts))
 
   def testAddFileSimultaneously(self):
     self.RunScenario('add_file_simultaneously')
@@ -100,6 +109,122 @@ class MergeCodebasesTest(basetest.TestCase):
       # TODO(dbentley): this should describe how they differ.
       print 'DIFFERENT:', different
       self.fail("Codebases %s and %s differ" % (codebase1, codebase2))
+    return context
+
+
+class ParallelMergeTest(basetest.TestCase):
+
+  def _MakeCodebase(self, name, contents_fn):
+    path = os.path.join(FLAGS.test_tmpdir, 'parallel_merge', name)
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    for i in range(20):
+      open(os.path.join(path, 'f%02d' % i), 'w').write(contents_fn(i))
+    return codebase_utils.Codebase(path)
+
+  def testResultsAreInFileOrder(self):
+    config = merge_codebases.MergeCodebasesConfig(
+        generated_codebase=self._MakeCodebase(
+            'generated', lambda i: 'generated %d\n' % i),
+        public_codebase=self._MakeCodebase(
+            'public', lambda i: 'public %d\n' % i if i % 2 else 'orig\n'),
+        previous_codebase=self._MakeCodebase('previous', lambda i: 'orig\n'))
+    context = merge_codebases.MergeCodebasesContext(config, jobs=8)
+    context.Update()
+    self.assertEqual(context.files, context.merged_files)
+    self.assertEqual([f for f in context.files if int(f[1:]) % 2],
+                     context.failed_merges)
+    self.assertEqual({merge_codebases.GENERATED_CHANGED: 10,
+                      merge_codebases.BOTH_CHANGED: 10},
+                     dict(context.triage_counts))
+
+
+class Merge3Test(basetest.TestCase):
+
+  def Merge(self, mod1, orig, mod2):
+    lines, conflicts = merge_codebases.Merge3(
+        mod1.splitlines(True), orig.splitlines(True), mod2.splitlines(True),
+        'mod1', 'mod2')
+    return ''.join(lines), conflicts
+
+  def testMergesChangesFromBothSides(self):
+    self.assertEqual(('A\nb\nc\nD\n', False),
+                     self.Merge('A\nb\nc\nd\n', 'a\nb\nc\nd\n',
+                                'a\nb\nc\nD\n'))
+    self.assertEqual(('x\na\nc\n', False),
+                     self.Merge('x\na\nb\nc\n', 'a\nb\nc\n', 'a\nc\n'))
+
+  def testSameChangeOnBothSides(self):
+    self.assertEqual(('a\nB\nc\n', False),
+                     self.Merge('a\nB\nc\n', 'a\nb\nc\n', 'a\nB\nc\n'))
+
+  def testConflict(self):
+    self.assertEqual(
+        ('a\n<<<<<<< mod1\nB1\n=======\nB2\n>>>>>>> mod2\nc\nD\n', True),
+        self.Merge('a\nB1\nc\nd\n', 'a\nb\nc\nd\n', 'a\nB2\nc\nD\n'))
+
+  def testConflictWithoutFinalNewline(self):
+    self.assertEqual(
+        ('<<<<<<< mod1\nx\n=======\ny\n>>>>>>> mod2\n', True),
+        self.Merge('x', '', 'y'))
+
+  def testAddedFile(self):
+    self.assertEqual(('a\n', False), self.Merge('', '', 'a\n'))
+
+  def testAdjacentChangesConflict(self):
+    self.assertEqual(
+        ('<<<<<<< mod1\nA\nb\n=======\na\nB\n>>>>>>> mod2\n', True),
+        self.Merge('A\nb\n', 'a\nb\n', 'a\nB\n'))
+
+  def testRepeatedLinesAlignLikeDiff3(self):
+    self.assertEqual(('x\n<<<<<<< mod1\n=======\ny\nx\n>>>>>>> mod2\n',
+                      True),
+                     self.Merge('x\n', 'x\nx\n', 'x\ny\nx\n'))
+
+  def Diff3(self, mod1, orig, mod2):
+    tmpdir = os.path.join(FLAGS.test_tmpdir, 'diff3')
+    base.MakeDir(tmpdir)
+    paths = []
+    for name, contents in (('mod1', mod1), ('orig', orig), ('mod2', mod2)):
+      paths.append(os.path.join(tmpdir, name))
+      open(paths[-1], 'w').write(contents)
+    process = subprocess.Popen(
+        ['diff3', '-m', '-E', '-L', 'mod1', '-L', 'orig', '-L', 'mod2'] + paths,
+        stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    return output, process.returncode == 1
+
+  def Mutate(self, rand, lines, alphabet):
+    lines = list(lines)
+    for _ in range(rand.randint(0, 6)):
+      pos = rand.randint(0, len(lines))
+      new_lines = [rand.choice(alphabet) for _ in range(rand.randint(1, 3))]
+      kind = rand.randint(0, 2)
+      if kind == 0:
+        lines[pos:pos] = new_lines
+      elif kind == 1:
+        del lines[pos:pos + rand.randint(1, 3)]
+      else:
+        lines[pos:pos + rand.randint(1, 2)] = new_lines
+    return ''.join(lines)
+
+  def testMatchesDiff3(self):
+    try:
+      self.Diff3('', '', '')
+    except OSError:
+      self.skipTest('diff3 is not installed')
+    rand = random.Random(0)
+    for _ in range(500):
+      # Few distinct lines, so that most can be aligned more than one way.
+      alphabet = ['line %d\n' % i for i in range(rand.choice([2, 3, 5, 20]))]
+      orig = [rand.choice(alphabet)
+              for _ in range(rand.choice([0, 5, 20, 60, 250]))]
+      mod1 = self.Mutate(rand, orig, alphabet)
+      mod2 = self.Mutate(rand, orig, alphabet)
+      orig = ''.join(orig)
+      self.assertEqual(self.Diff3(mod1, orig, mod2),
+                       self.Merge(mod1, orig, mod2),
+                       'merging %r, %r and %r' % (mod1, orig, mod2))
 
 
 if __name__ == '__main__':
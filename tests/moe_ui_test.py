@@ -6,12 +6,22 @@
 
 __author__ = 'dbentley@google.com (Daniel Bentley)'
 
+import threading
+
 from google.apputils import basetest
 
 from moe import moe_ui
 import test_util
 
 
+class FakeFormatter(object):
+  def PrintBeginning(self, description):
+    pass
+
+  def PrintEnding(self, description, result=None):
+    pass
+
+
 class MoeUiTest(basetest.TestCase):
   def setUp(self):
     self._ui = moe_ui.MoeUI()
@@ -43,6 +53,17 @@ class MoeUiTest(basetest.TestCase):
     basetest.DiffTestStdout(
         test_util.TestResourceFilename('moe_ui/nested.txt'))
 
+  def testInCurrentTask(self):
+    results = []
+    with self._ui.BeginTask('foo', 'Fooing', FakeFormatter()):
+      run = self._ui.InCurrentTask(lambda: results.append(
+          self._ui.CurrentTask()))
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    self.assertEqual(['foo'], results)
+    self.assertEqual('', self._ui.CurrentTask())
+
 
 
 if __name__ == '__main__':
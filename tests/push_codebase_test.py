@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+"""Tests for moe.push_codebase."""
+
+import os
+import shutil
+
+import gflags as flags
+from google.apputils import basetest
+
+from moe import base
+from moe import codebase_utils
+from moe import moe_app
+from moe import push_codebase
+import test_util
+
+FLAGS = flags.FLAGS
+
+
+def setUp():
+  moe_app.InitForTest()
+
+
+class RootedMockEditor(test_util.MockEditor):
+  """A MockEditor whose client is a real directory."""
+
+  def __init__(self, root, **kwargs):
+    test_util.MockEditor.__init__(self, **kwargs)
+    self.root = root
+
+  def Root(self):
+    return self.root
+
+
+class CodebasePusherTest(basetest.TestCase):
+
+  def setUp(self):
+    self.root = os.path.join(FLAGS.test_tmpdir, 'push_codebase')
+    shutil.rmtree(self.root, ignore_errors=True)
+
+  def MakeDir(self, name, files):
+    path = os.path.join(self.root, name)
+    for filename, contents in files.iteritems():
+      base.MakeDir(os.path.dirname(os.path.join(path, filename)))
+      open(os.path.join(path, filename), 'w').write(contents)
+    return path
+
+  def testOnlyChangedFilesArePut(self):
+    source = self.MakeDir('source', {'same': 'same', 'modified': 'new',
+                                     'resized': 'longer', 'exec': 'exec',
+                                     'dir/added': 'added'})
+    client = self.MakeDir('client', {'same': 'same', 'modified': 'old',
+                                     'resized': 'short', 'exec': 'exec',
+                                     'deleted': 'deleted'})
+    base.SetExecutable(os.path.join(source, 'exec'))
+    editor = RootedMockEditor(
+        client, walk_result=base.ListFiles(client, None))
+
+    pusher = push_codebase.CodebasePusher(
+        codebase_utils.Codebase(source), editor)
+    pusher.Push()
+    self.assertItemsEqual(['modified', 'resized', 'exec', 'dir/added',
+                           'deleted'],
+                          editor.files_seen_dest)
+    self.assertEqual({push_codebase.ADDED: 1,
+                      push_codebase.MODIFIED: 2,
+                      push_codebase.MODE_CHANGED: 1,
+                      push_codebase.DELETED: 1,
+                      push_codebase.UNCHANGED: 1},
+                     pusher.change_counts)
+    self.assert_(pusher.pushed)
+
+  def testNothingChanged(self):
+    files = {'a': 'a', 'b/c': 'c'}
+    source = self.MakeDir('source', files)
+    client = self.MakeDir('client', files)
+    editor = RootedMockEditor(
+        client, walk_result=base.ListFiles(client, None))
+    pusher = push_codebase.CodebasePusher(
+        codebase_utils.Codebase(source), editor)
+    pusher.Push()
+    self.assertEqual([], editor.files_seen_dest)
+    self.assertEqual(2, pusher.change_counts[push_codebase.UNCHANGED])
+    self.assertFalse(pusher.pushed)
+
+
+if __name__ == '__main__':
+  basetest.main()
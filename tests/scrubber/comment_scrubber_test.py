@@ -6,6 +6,7 @@
 __author__ = ('nicksantos@google.com (Nick Santos)')
 
 import os
+import re
 
 import json as simplejson
 
@@ -45,6 +46,26 @@ def TestCommentExtractor(test_case, extractor, source_file, expected_file):
   test_case.assertListEqual(expected_comments, comments)
 
 
+class CommentsFromJsonTest(basetest.TestCase):
+
+  def testFilenamesShared(self):
+    comments = comment_scrubber.CommentsFromJson(simplejson.loads(
+        '[{"filename": "a.c", "line": 1, "char_index": 0, "text": "// x"},'
+        ' {"filename": "a.c", "line": 2, "char_index": 0, "text": "// y"}]'))
+    self.assertEqual(
+        [comment_scrubber.Comment(u'a.c', 1, 0, u'// x'),
+         comment_scrubber.Comment(u'a.c', 2, 0, u'// y')], comments)
+    self.assertTrue(comments[0].filename is comments[1].filename)
+
+  def testFilenameSubstitutions(self):
+    filename = 'foo/a.c'
+    comment, = comment_scrubber.CommentsFromJson(
+        [{u'filename': u'/tmp/a.c', u'line': 1, u'char_index': 0,
+          u'text': u'// x'}],
+        {u'/tmp/a.c': filename})
+    self.assertTrue(comment.filename is filename)
+
+
 class CLikeCommentExtractorTest(basetest.TestCase):
   """Unittests for the C-style comment extractor."""
 
@@ -79,6 +100,46 @@ class PythonCommentExtractorTest(basetest.TestCase):
         os.path.join(TEST_DATA_DIR, 'raw_docstring.py.txt'),
         os.path.join(TEST_DATA_DIR, 'raw_docstring_comments.txt'))
 
+  def assertScannerMatchesTokenizer(self, file_obj):
+    self.assertListEqual(
+        comment_scrubber._PythonTokenizingExtractor(file_obj).ExtractComments(),
+        comment_scrubber._PythonScanningExtractor(file_obj).ExtractComments())
+
+  def testScannerMatchesTokenizer(self):
+    for name in ['test_file.py.txt', 'raw_docstring.py.txt']:
+      self.assertScannerMatchesTokenizer(
+          test_util.FakeFile(filename=os.path.join(TEST_DATA_DIR, name)))
+    for contents in [
+        'x = """not a docstring"""  # but a comment\n',
+        'print """a docstring, says tokenize"""\n',
+        'x = \\\n    """not a docstring"""\n',
+        'x = 1  # comment \\\n"""docstring"""\n',
+        'f("a" """b""", \'\'\'c\'\'\')\n',
+        'x = r\'\\\'\'  # the quote is escaped\n',
+        's = "a # b\\\nc"  # d\n',
+        'bur"""tail of a name"""\n',
+        'ur"""u\'s and r\'s"""\r\n# windows\r\n',
+        '"""unterminated\n# not a comment\n',
+        ]:
+      self.assertScannerMatchesTokenizer(test_util.FakeFile(contents=contents))
+
+  def testCommentAfterMultilineString(self):
+    contents = 'x = """a\nb"""  # c\n'
+    self.assertListEqual(
+        [comment_scrubber.Comment('f.py', 2, 15, '# c')],
+        comment_scrubber.PythonCommentExtractor().ExtractComments(
+            test_util.FakeFile(contents=contents, filename='f.py')))
+
+  def testFallsBackToTokenizer(self):
+    file_obj = test_util.FakeFile(
+        contents="x = 'unterminated # comment\n'''doc'''\n")
+    self.assertRaises(
+        comment_scrubber._UnclassifiableConstructError,
+        comment_scrubber._PythonScanningExtractor(file_obj).ExtractComments)
+    self.assertListEqual(
+        comment_scrubber._PythonTokenizingExtractor(file_obj).ExtractComments(),
+        comment_scrubber.PythonCommentExtractor().ExtractComments(file_obj))
+
 
 class ShellLikeCommentExtractorTest(basetest.TestCase):
   def testShellLikeCommentExtraction(self):
@@ -87,6 +148,25 @@ class ShellLikeCommentExtractorTest(basetest.TestCase):
         os.path.join(TEST_DATA_DIR, 'test_file.sh.txt'),
         os.path.join(TEST_DATA_DIR, 'sh_comments.txt'))
 
+  def testYamlCommentExtraction(self):
+    TestCommentExtractor(
+        self, comment_scrubber.YamlCommentExtractor(),
+        os.path.join(TEST_DATA_DIR, 'test_file.yaml.txt'),
+        os.path.join(TEST_DATA_DIR, 'yaml_comments.txt'))
+
+  def testIgnoreFileCommentExtraction(self):
+    contents = '# comment\nfoo#bar  # trailing\n\\#baz\n'
+    self.assertListEqual(
+        [comment_scrubber.Comment('.gitignore', 1, 0, '# comment')],
+        comment_scrubber.IgnoreFileCommentExtractor().ExtractComments(
+            test_util.FakeFile(contents=contents, filename='.gitignore')))
+    self.assertListEqual(
+        [comment_scrubber.Comment('.hgignore', 1, 0, '# comment'),
+         comment_scrubber.Comment('.hgignore', 2, 13, '#bar  # trailing')],
+        comment_scrubber.IgnoreFileCommentExtractor(
+            inline_comments=True).ExtractComments(
+                test_util.FakeFile(contents=contents, filename='.hgignore')))
+
 
 class CommentPreservedTest(basetest.TestCase):
   def assertContentsPreserved(self, contents, extractor):
@@ -543,6 +623,46 @@ class CommentScrubberTest(basetest.TestCase):
          'b = a  <!-- MOE:strip_line -->',
          'c = a'])
 
+  def testScrubbersOnlyCalledWhenTriggered(self):
+    scrubber = _RecordingCommentScrubber(re.compile('secret'))
+    comment_scrubber.CommentScrubber(
+        comment_scrubber.ShellLikeCommentExtractor(), [scrubber]).ScrubFile(
+            test_util.FakeFile(contents=u'# public\n# secret\n'),
+            FakeContext())
+    self.assertEqual([u'# secret'], scrubber.comments)
+
+  def testUntriggeredScrubbersAlwaysCalled(self):
+    scrubber = _RecordingCommentScrubber(None)
+    comment_scrubber.CommentScrubber(
+        comment_scrubber.ShellLikeCommentExtractor(), [scrubber]).ScrubFile(
+            test_util.FakeFile(contents=u'# public\n# secret\n'),
+            FakeContext())
+    self.assertEqual([u'# public', u'# secret'], scrubber.comments)
+
+  def testRevisionTriggersLaterScrubbers(self):
+    scrubber = comment_scrubber.CommentScrubber(
+        comment_scrubber.ShellLikeCommentExtractor(),
+        [_RecordingCommentScrubber(None, u'# TODO(someguy)'),
+         self.UserScrubber()])
+    self.assertContents(scrubber, ['# TODO(user)'], ['# public'])
+
+
+class _RecordingCommentScrubber(comment_scrubber.CommentOrientedScrubber):
+  """Records the comments it's asked to scrub, optionally replacing them."""
+
+  def __init__(self, trigger, new_text=None):
+    self._trigger = trigger
+    self._new_text = new_text
+    self.comments = []
+
+  def Trigger(self):
+    return self._trigger
+
+  def ScrubComment(self, comment_text, file_obj):
+    self.comments.append(comment_text)
+    if self._new_text is not None:
+      return base.Revision(self._new_text, 'test')
+
 
 if __name__ == '__main__':
   basetest.main()
@@ -6,6 +6,7 @@
 
 __author__ = 'dbentley@google.com (Daniel Bentley)'
 
+import json as simplejson
 import os
 import sys
 
@@ -120,6 +121,58 @@ class ScrubberRegressionTest(basetest.TestCase):
 
   # TODO(dborowitz): More tests with inputs that are known to fail scrubbing.
 
+  def testErrorLog(self):
+    scenario_base = os.path.join(SCENARIOS_DIR, 'sensitive_words')
+    codebase = os.path.join(scenario_base, 'input')
+    (_, input_files) = scrubber.CreateInputFileListFromDir(codebase)
+    config = scrubber.ParseConfigFile(
+        os.path.join(scenario_base, 'config.json'), codebase, input_files)
+    config.error_log = os.path.join(FLAGS.test_tmpdir, 'errors.json')
+    context = scrubber.ScrubberContext(config)
+
+    context.Scan()
+    context.Close()
+
+    self.assertEqual(1, context.Status())
+    self.assertEqual(
+        [{u'filter': u'SENSITIVE_WORD', u'trigger': u'bubbles',
+          u'filename': u'foo.txt', u'reason': u''}],
+        [simplejson.loads(line) for line in open(config.error_log)])
+    self.assertEqual({('SENSITIVE_WORD', 'bubbles'): 1},
+                     context._error_sink.counts_by_trigger)
+    self.assertEqual({'.txt': 1}, context._error_sink.counts_by_extension)
+
+  def testInMemoryReport(self):
+    scenario_base = os.path.join(SCENARIOS_DIR, 'sensitive_words')
+    codebase = os.path.join(scenario_base, 'input')
+    (_, input_files) = scrubber.CreateInputFileListFromDir(codebase)
+    config = scrubber.ParseConfigFile(
+        os.path.join(scenario_base, 'config.json'), codebase, input_files)
+    context = scrubber.ScrubberContext(config)
+
+    context.Scan()
+    context.Close()
+
+    self.assertEqual(1, context.Status())
+    report_lines = context._error_sink.ReportLines()
+    # Each error is listed, then counted.
+    self.assertTrue(report_lines[0].startswith(
+        'ERROR[entry:<filter:"SENSITIVE_WORD" trigger:"bubbles" '
+        'filename:"foo.txt">]: '))
+    self.assertEqual(
+        ['Found 1 errors', '  SENSITIVE_WORD bubbles 1',
+         'Found errors in files with extensions:', '  .txt 1'],
+        report_lines[1:])
+
+  def testInMemoryErrorSinkListsBoundedNumberOfErrors(self):
+    sink = scrubber.InMemoryErrorSink(max_listed=2)
+    for i in range(5):
+      sink.AddError('error %d' % i)
+    self.assertEqual(
+        ['error 0', 'error 1', '... and 3 more errors', 'Found 5 errors',
+         'Found errors in files with extensions:'],
+        sink.ReportLines())
+
   def RunScenarioWithConfigFile(self, scenario_base, config_file):
     codebase = os.path.join(scenario_base, 'input')
     config_path = os.path.join(scenario_base, config_file)
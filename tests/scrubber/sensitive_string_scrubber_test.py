@@ -60,6 +60,11 @@ class SensitiveWordsTest(basetest.TestCase):
     self.assertMatch(u'testy', u'THIS_IS_TESTY_A_SECRET_PROJECT')
     self.assertNoMatch(u'kittens attesty')
 
+  def testCandidateRe(self):
+    candidate_re = self.word_scrubber.CandidateRe()
+    self.assertTrue(candidate_re.search(u'void fixForSecrety'))
+    self.assertFalse(candidate_re.search(u'go to the next line'))
+
 
 class SensitiveResTest(basetest.TestCase):
   """Unittests for the sensitive word search."""
@@ -89,6 +94,24 @@ class SensitiveResTest(basetest.TestCase):
     self.assertNoMatch(u'SECRET_CODE_123')
     self.assertNoMatch(u'THESECRETCODE123')
 
+  def testCandidateRe(self):
+    # Regexes compiled with different flags can't be combined.
+    self.assertEquals(None, self.re_scrubber.CandidateRe())
+
+    candidate_re = sensitive_string_scrubber.SensitiveReScrubber(
+        [u'(?i)supersecret', u'(?i)\\Wsecret_?code_?1\\d*\\W']).CandidateRe()
+    self.assertTrue(candidate_re.search(u'THISISSOSUPERSECRET'))
+    self.assertTrue(candidate_re.search(u'the SECRET_CODE123 is secret'))
+    self.assertFalse(candidate_re.search(u'notasecret'))
+
+    # A conditional group refers to a group by number, which combining would
+    # renumber.
+    conditional_scrubber = sensitive_string_scrubber.SensitiveReScrubber(
+        [u'(y)z', u'(a)?(?(1)b|c)d'])
+    self.assertEquals(None, conditional_scrubber.CandidateRe())
+    self.assertEquals([u'abd'],
+                      conditional_scrubber.FindSensitiveStrings(u'abd'))
+
 
 if __name__ == '__main__':
   basetest.main()
@@ -7,6 +7,7 @@
 
 
 import os
+import shutil
 import sys
 
 import mox
@@ -15,6 +16,7 @@ import gflags as flags
 
 from google.apputils import basetest
 from moe import base
+from moe import config
 from moe import moe_app
 from moe import svn
 import test_util
@@ -25,6 +27,8 @@ FLAGS = flags.FLAGS
 SCENARIOS_DIR = ''
 UNRUN_SCENARIOS = None
 
+EMPTY_STATUS = '<status><target path="."></target></status>'
+
 
 def setUp():
   global SCENARIOS_DIR
@@ -47,6 +51,112 @@ class SVNTest(basetest.TestCase):
     self.mox.UnsetStubs()
     self.mox.ResetAll()
 
+  def MakeEditor(self, name, files, verbose_status=''):
+    """Make an editor of a checkout with files in it, which runs no svn.
+
+    Args:
+      name: str, the name of the checkout
+      files: list of str, the files to make in the checkout
+      verbose_status: str, the output of svn status --verbose --xml
+
+    Returns:
+      (SvnEditor; list, the svn commands it runs, each with the contents of
+       its --targets file in place of the file)
+    """
+    checkout = os.path.join(FLAGS.test_tmpdir, name)
+    shutil.rmtree(checkout, ignore_errors=True)
+    os.makedirs(os.path.join(checkout, '.svn'))
+    for filename in files:
+      base.MakeDir(os.path.dirname(os.path.join(checkout, filename)))
+      file_util.Write(os.path.join(checkout, filename), filename)
+    commands = []
+
+    def RunSvn(args, **unused_kwargs):
+      args = [a for a in args if a != '--no-auth-cache']
+      if '--targets' in args:
+        i = args.index('--targets')
+        args[i:] = [file_util.Read(args[i + 1]).splitlines()]
+      commands.append(args)
+      if args == ['--version']:
+        return 'svn, version 1.6.17'
+      if args == ['status', '--xml']:
+        return EMPTY_STATUS
+      if args == ['status', '--verbose', '--xml']:
+        return verbose_status
+    self.mox.stubs.Set(svn, 'RunSvn', RunSvn)
+
+    repository = self.mox.CreateMockAnything()
+    repository.Url().AndReturn('http://not_a_url')
+    self.mox.ReplayAll()
+    client = svn.SvnClient(repository, FLAGS.test_tmpdir,
+                           existing_checkout=checkout)
+    editor = client.MakeEditor(config.MigrationStrategy(
+        merge_strategy=base.ERROR, commit_strategy=base.LEAVE_PENDING))
+    del commands[:]
+    return editor, commands
+
+  def testEditorRunsOneCommandPerKindOfChange(self):
+    editor, commands = self.MakeEditor(
+        'testEditorRunsOneCommand', ['deleted', 'also_deleted', 'made_exec'])
+    source = os.path.join(FLAGS.test_tmpdir, 'testEditorRunsOneCommand_src')
+    shutil.rmtree(source, ignore_errors=True)
+    os.makedirs(os.path.join(source, 'dir'))
+    for filename in ['made_exec', 'new.js', 'dir/new']:
+      file_util.Write(os.path.join(source, filename), filename)
+    base.SetExecutable(os.path.join(source, 'made_exec'))
+
+    for filename in ['deleted', 'new.js', 'made_exec', 'dir/new',
+                     'also_deleted']:
+      editor.PutFile(filename, os.path.join(source, filename))
+    # Nothing runs until FinalizeChange.
+    self.assertEqual([], commands)
+    editor.FinalizeChange('message', base.MoeReport())
+    # Removals and additions come first, so properties are set on added
+    # files.
+    self.assertEqual(
+        [['rm', ['deleted', 'also_deleted']],
+         ['add', '--parents', ['new.js', 'dir/new']],
+         ['propset', 'svn:executable', '*', ['made_exec']],
+         ['propset', 'svn:mime-type', 'text/javascript', ['new.js']],
+         ['status', '--xml']],
+        commands)
+    self.assertFalse(editor.ChangesMade())
+
+  def testEditorWalk(self):
+    files = ['kept', 'dir/versioned', 'unversioned', 'unversioned_dir/file',
+             'caf\xc3\xa9', 'unversioned_dir/\xc3\xa9t\xc3\xa9']
+    # Like RunCmd, the fake svn's output is decoded.
+    status = u''.join(
+        [u'<status><target path=".">'] +
+        [u'<entry path="%s"><wc-status item="%s"/></entry>' % entry
+         for entry in [(u'.', u'normal'), (u'dir', u'normal'),
+                       (u'dir/versioned', u'normal'), (u'kept', u'modified'),
+                       (u'caf\xe9', u'normal'), (u'missing', u'missing'),
+                       (u'unversioned', u'unversioned'),
+                       (u'unversioned_dir', u'unversioned')]] +
+        [u'</target></status>'])
+    editor, commands = self.MakeEditor('testEditorWalk', files, status)
+    self.assertEqual(['caf\xc3\xa9', 'dir/versioned', 'kept'], editor.Walk())
+    self.assertTrue(isinstance(editor.Walk()[0], str))
+    # PutFile keeps the listing up to date, without asking svn again.
+    source = os.path.join(FLAGS.test_tmpdir, 'testEditorWalk_src')
+    shutil.rmtree(source, ignore_errors=True)
+    os.makedirs(source)
+    file_util.Write(os.path.join(source, 'added'), 'added')
+    editor.PutFile('kept', os.path.join(source, 'kept'))
+    editor.PutFile('added', os.path.join(source, 'added'))
+    self.assertEqual(['added', 'caf\xc3\xa9', 'dir/versioned'], editor.Walk())
+    self.assertEqual([['status', '--verbose', '--xml']], commands)
+
+    FLAGS.walk_untracked_files = True
+    try:
+      editor, _ = self.MakeEditor('testEditorWalk', files, status)
+      self.assertEqual(['caf\xc3\xa9', 'dir/versioned', 'kept', 'unversioned',
+                        'unversioned_dir/file',
+                        'unversioned_dir/\xc3\xa9t\xc3\xa9'], editor.Walk())
+    finally:
+      FLAGS.walk_untracked_files = False
+
   def testShortLog(self):
     self.RunScenario('short_log', FilterLog)
 
@@ -247,6 +247,9 @@ class MockRepository(object):
   def MakeRevisionFromId(self, id):
     return base.Revision(rev_id=id, repository_name=self.name)
 
+  def Close(self):
+    pass
+
 
 class MockRepositoryConfig(base.RepositoryConfig):
   """An empty repository config."""